@@ -9,11 +9,78 @@ from requests.auth import AuthBase, HTTPBasicAuth
 from requests.cookies import extract_cookies_to_jar
 from requests.utils import parse_dict_header
 from urllib.parse import urlparse
+import hashlib
+import logging
 import requests
 import re
+import threading
+import time
 
 from atomic_reactor.utils.retries import get_retrying_requests_session
 
+logger = logging.getLogger(__name__)
+
+
+def get_credentials_id(username=None, password=None, auth_b64=None):
+    """Get an identifier of the credentials, safe to be used as a cache key or logged"""
+    credentials = '{}\0{}\0{}'.format(auth_b64 or '', username or '', password or '')
+    return hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+
+
+class BearerTokenCache(object):
+    """Cache of Bearer tokens, shared by all the HTTPBearerAuth instances of the process.
+
+    Tokens are cached by the credentials they were requested with and by
+    (realm, service, scope), until they expire. The Bearer challenges of
+    registries (realm and service) are cached by the registry host, which
+    allows getting the token for a repository before sending the first
+    request to it rather than after the registry refuses it.
+    """
+
+    # the spec says tokens without expires_in are valid for 60 seconds
+    DEFAULT_EXPIRES_IN = 60
+    # do not use tokens which are about to expire
+    EXPIRY_MARGIN = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._challenges = {}
+
+    def get_challenge(self, host):
+        with self._lock:
+            return self._challenges.get(host)
+
+    def set_challenge(self, host, challenge):
+        with self._lock:
+            self._challenges[host] = challenge
+
+    def get_token(self, key):
+        with self._lock:
+            token, expires_at = self._tokens.get(key, (None, 0))
+            if time.monotonic() >= expires_at:
+                return None
+            return token
+
+    def put_token(self, key, token, expires_in=None):
+        if expires_in is None:
+            expires_in = self.DEFAULT_EXPIRES_IN
+        with self._lock:
+            self._tokens[key] = (token, time.monotonic() + expires_in - self.EXPIRY_MARGIN)
+
+    def invalidate_token(self, key, token):
+        with self._lock:
+            if self._tokens.get(key, (None, 0))[0] == token:
+                del self._tokens[key]
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+            self._challenges.clear()
+
+
+bearer_token_cache = BearerTokenCache()
+
 
 class HTTPBearerAuth(AuthBase):
     """Performs Bearer authentication for the given Request object.
@@ -26,15 +93,18 @@ class HTTPBearerAuth(AuthBase):
     password).
 
     Once Bearer token is retrieved, it will be cached and used in subsequent
-    requests. Since tokens are specific to repositories, the token cache may
-    store multiple tokens.
+    requests until it expires. Since tokens are specific to repositories, the
+    token cache may store multiple tokens. The cache is shared by all instances
+    (see BearerTokenCache), once the registry asked for a token, the tokens for
+    other repositories are fetched before sending the requests.
 
     Supports registry v2 API only.
     """
     BEARER_PATTERN = re.compile(r'bearer ', flags=re.IGNORECASE)
     V2_REPO_PATTERN = re.compile(r'^/v2/(.*)/(manifests|tags|blobs)/')
 
-    def __init__(self, username=None, password=None, verify=True, access=None, auth_b64=None):
+    def __init__(self, username=None, password=None, verify=True, access=None, auth_b64=None,
+                 token_cache=None):
         """Initialize HTTPBearerAuth object.
 
         :param username: str, username to be used for authentication
@@ -45,6 +115,7 @@ class HTTPBearerAuth(AuthBase):
             requested; possible values to be included are 'pull' and/or 'push';
             defaults to ('pull',)
         :param auth_b64: str, base64 credendials as described in RFC 7617
+        :param token_cache: BearerTokenCache, defaults to the cache shared by the process
         """
         self.username = username
         self.password = password
@@ -52,23 +123,34 @@ class HTTPBearerAuth(AuthBase):
         self.verify = verify
         self.access = access or ('pull',)
 
-        self._token_cache = {}
+        self._token_cache = token_cache if token_cache is not None else bearer_token_cache
+        # tokens are only shared by instances using the same credentials
+        self._credentials_id = get_credentials_id(username, password, auth_b64)
         self._retry_session = get_retrying_requests_session()   # Used when querying for token
 
     def __call__(self, response):
         repo = self._get_repo_from_url(response.url)
+        host = urlparse(response.url).netloc
 
-        if repo in self._token_cache:
-            self._set_header(response, repo)
-            return response
+        token = None
+        challenge = self._token_cache.get_challenge(host)
+        if challenge is not None:
+            token = self._get_cached_token(challenge, repo)
+            if token is None and repo:
+                # The registry is known to require a token, get it right away
+                # instead of waiting for the request to be refused
+                token = self._get_token(challenge, [repo])
+
+        if token is not None:
+            self._set_header(response, token)
 
         def handle_401_with_repo(response, **kwargs):
-            return self.handle_401(response, repo, **kwargs)
+            return self.handle_401(response, repo, used_token=token, **kwargs)
 
         response.register_hook('response', handle_401_with_repo)
         return response
 
-    def handle_401(self, response, repo, **kwargs):
+    def handle_401(self, response, repo, used_token=None, **kwargs):
         """Fetch Bearer token and retry."""
         if response.status_code != requests.codes.unauthorized:
             return response
@@ -78,7 +160,12 @@ class HTTPBearerAuth(AuthBase):
         if 'bearer' not in auth_info.lower():
             return response
 
-        self._token_cache[repo] = self._get_token(auth_info, repo)
+        challenge = parse_dict_header(self.BEARER_PATTERN.sub('', auth_info, count=1))
+        self._token_cache.set_challenge(urlparse(response.url).netloc, challenge)
+        if used_token is not None:
+            # The token expired early or does not grant the access, do not use it again
+            self._token_cache.invalidate_token(self._get_token_key(challenge, repo), used_token)
+        token = self._get_token(challenge, [repo] if repo else [])
 
         # Consume content and release the original connection
         # to allow our new request to reuse the same one.
@@ -89,7 +176,7 @@ class HTTPBearerAuth(AuthBase):
         extract_cookies_to_jar(retry_request._cookies, response.request, response.raw)
         retry_request.prepare_cookies(retry_request._cookies)
 
-        self._set_header(retry_request, repo)
+        self._set_header(retry_request, token)
         retry_response = response.connection.send(retry_request, **kwargs)
         retry_response.history.append(response)
         retry_response.request = retry_request
@@ -100,12 +187,56 @@ class HTTPBearerAuth(AuthBase):
 
         return retry_response
 
-    def _get_token(self, auth_info, repo):
-        bearer_info = parse_dict_header(self.BEARER_PATTERN.sub('', auth_info, count=1))
-        # If repo could not be determined, do not set scope - implies global access
+    def prefetch_tokens(self, registry_url, repos):
+        """Fetch the tokens for many repositories in advance, in a single request.
+
+        Useful when the repositories to be accessed are known up front, e.g. all the
+        repositories an image is about to be tagged into. Failures are not fatal, the
+        tokens will be fetched on demand instead.
+
+        :param registry_url: str, URL of the registry, including the scheme
+        :param repos: iterable of str, repositories, e.g. namespace/repo
+        """
+        host = urlparse(registry_url).netloc
+        challenge = self._token_cache.get_challenge(host)
+        try:
+            if challenge is None:
+                # ask the registry which token service it uses
+                response = self._retry_session.get('{}/v2/'.format(registry_url.rstrip('/')),
+                                                   verify=self.verify)
+                auth_info = response.headers.get('www-authenticate', '')
+                if (response.status_code != requests.codes.unauthorized or
+                        'bearer' not in auth_info.lower()):
+                    return
+                challenge = parse_dict_header(self.BEARER_PATTERN.sub('', auth_info, count=1))
+                self._token_cache.set_challenge(host, challenge)
+
+            missing = [repo for repo in dict.fromkeys(repos)
+                       if self._get_cached_token(challenge, repo) is None]
+            if missing:
+                self._get_token(challenge, missing)
+        except requests.RequestException as e:
+            logger.debug("Failed to prefetch tokens for %s: %s", registry_url, e)
+
+    def _get_scope(self, challenge, repo):
+        # If repo could not be determined, use the scope of the challenge - implies global access
         if repo:
-            bearer_info['scope'] = 'repository:{}:{}'.format(repo, ','.join(self.access))
-        realm = bearer_info.pop('realm')
+            return 'repository:{}:{}'.format(repo, ','.join(self.access))
+        return challenge.get('scope')
+
+    def _get_token_key(self, challenge, repo):
+        return (self._credentials_id, challenge.get('realm'), challenge.get('service'),
+                self._get_scope(challenge, repo))
+
+    def _get_cached_token(self, challenge, repo):
+        return self._token_cache.get_token(self._get_token_key(challenge, repo))
+
+    def _get_token(self, challenge, repos):
+        """Get one token granting access to all the repos and cache it for each of them."""
+        params = [(key, value) for key, value in challenge.items()
+                  if key not in ('realm', 'scope')]
+        scopes = [self._get_scope(challenge, repo) for repo in repos or [None]]
+        params.extend(('scope', scope) for scope in scopes if scope)
 
         realm_auth = None
         if self.auth_b64:
@@ -113,13 +244,19 @@ class HTTPBearerAuth(AuthBase):
         elif self.username and self.password:
             realm_auth = HTTPBasicAuth(self.username, self.password)
 
-        realm_response = self._retry_session.get(realm, params=bearer_info, verify=self.verify,
-                                                 auth=realm_auth)
+        realm_response = self._retry_session.get(challenge['realm'], params=params,
+                                                 verify=self.verify, auth=realm_auth)
         realm_response.raise_for_status()
-        return realm_response.json()['token']
+        token_info = realm_response.json()
+        # the spec allows access_token as an alias of token
+        token = token_info.get('token') or token_info.get('access_token')
+        for repo in repos or [None]:
+            self._token_cache.put_token(self._get_token_key(challenge, repo), token,
+                                        token_info.get('expires_in'))
+        return token
 
-    def _set_header(self, response, repo):
-        response.headers['Authorization'] = 'Bearer {}'.format(self._token_cache[repo])
+    def _set_header(self, response, token):
+        response.headers['Authorization'] = 'Bearer {}'.format(token)
 
     def _get_repo_from_url(self, url):
         url_parts = urlparse(url)
@@ -170,25 +307,12 @@ class HTTPRegistryAuth(AuthBase):
 
     def __call__(self, request):
         url_parts = urlparse(request.url)
-        if self.auth_b64:
-            basic_auth = HTTPBasicAuthWithB64(self.auth_b64)
-        elif self.username and self.password:
-            basic_auth = HTTPBasicAuth(self.username, self.password)
-        else:
-            basic_auth = None
-
         if not self.V2_URL.search(url_parts.path):
             raise NotImplementedError("registry auth only implemented for %s" %
                                       self.V2_URL.pattern)
 
         if not self.v2_auths:
-            # It's safe to always add bearer auth handler because
-            # it's only activated if indicated by www-authenticate response header
-            self.v2_auths.append(HTTPBearerAuth(self.username, self.password,
-                                                access=self.access, auth_b64=self.auth_b64))
-
-            if basic_auth:
-                self.v2_auths.append(basic_auth)
+            self._init_v2_auths()
 
         for auth in self.v2_auths:
             request = auth(request)
@@ -197,3 +321,20 @@ class HTTPRegistryAuth(AuthBase):
                 break
 
         return request
+
+    def _init_v2_auths(self):
+        # It's safe to always add bearer auth handler because
+        # it's only activated if indicated by www-authenticate response header
+        self.v2_auths.append(HTTPBearerAuth(self.username, self.password,
+                                            access=self.access, auth_b64=self.auth_b64))
+
+        if self.auth_b64:
+            self.v2_auths.append(HTTPBasicAuthWithB64(self.auth_b64))
+        elif self.username and self.password:
+            self.v2_auths.append(HTTPBasicAuth(self.username, self.password))
+
+    def prefetch_tokens(self, registry_url, repos):
+        """Fetch the Bearer tokens for the repos in advance, see HTTPBearerAuth.prefetch_tokens"""
+        if not self.v2_auths:
+            self._init_v2_auths()
+        self.v2_auths[0].prefetch_tokens(registry_url, repos)
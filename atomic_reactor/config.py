@@ -8,7 +8,9 @@ of the BSD license. See the LICENSE file for details.
 
 from copy import deepcopy
 from atomic_reactor.utils.cachito import CachitoAPI
-from atomic_reactor.constants import REACTOR_CONFIG_ENV_NAME
+from atomic_reactor.utils.artifact_cache import DEFAULT_MAX_SIZE as DEFAULT_ARTIFACT_CACHE_SIZE
+from atomic_reactor.utils.registry_cache import DEFAULT_TAG_TTL
+from atomic_reactor.constants import REACTOR_CONFIG_ENV_NAME, REGISTRY_POOL_MAXSIZE
 from atomic_reactor.util import (
     read_yaml,
     read_yaml_from_file_path,
@@ -179,6 +181,10 @@ class ReactorConfigKeys(object):
     OPERATOR_MANIFESTS_KEY = 'operator_manifests'
     IMAGE_SIZE_LIMIT_KEY = 'image_size_limit'
     BUILDER_CA_BUNDLE_KEY = 'builder_ca_bundle'
+    PLUGIN_RUNNER_KEY = 'plugin_runner'
+    REGISTRY_CACHE_KEY = 'registry_cache'
+    REGISTRY_POOL_MAXSIZE_KEY = 'registry_pool_maxsize'
+    ARTIFACT_CACHE_KEY = 'artifact_cache'
 
 
 class ODCSConfig(object):
@@ -551,3 +557,39 @@ class Configuration(object):
     @property
     def builder_ca_bundle(self):
         return self._get_value(ReactorConfigKeys.BUILDER_CA_BUNDLE_KEY, fallback=None)
+
+    @property
+    def plugin_runner(self):
+        config = self._get_value(ReactorConfigKeys.PLUGIN_RUNNER_KEY, fallback={})
+        return {
+            'max_workers': config.get('max_workers', 1),
+            'profile': config.get('profile', {}),
+            'resume': config.get('resume', False),
+            'task_timeout': config.get('task_timeout'),
+            'plugin_timeouts': config.get('plugin_timeouts', {}),
+        }
+
+    @property
+    def registry_pool_maxsize(self):
+        return self._get_value(ReactorConfigKeys.REGISTRY_POOL_MAXSIZE_KEY,
+                               fallback=REGISTRY_POOL_MAXSIZE)
+
+    @property
+    def registry_cache(self):
+        config = self._get_value(ReactorConfigKeys.REGISTRY_CACHE_KEY, fallback=None)
+        if config is None:
+            return None
+        return {
+            'shared_dir': config.get('shared_dir'),
+            'tag_ttl': config.get('tag_ttl', DEFAULT_TAG_TTL),
+        }
+
+    @property
+    def artifact_cache(self):
+        config = self._get_value(ReactorConfigKeys.ARTIFACT_CACHE_KEY, fallback=None)
+        if config is None:
+            return None
+        return {
+            'dir': config['dir'],
+            'max_size': config.get('max_size', DEFAULT_ARTIFACT_CACHE_SIZE),
+        }
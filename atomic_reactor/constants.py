@@ -72,6 +72,9 @@ TOOLS_USED = (
 )
 
 DEFAULT_DOWNLOAD_BLOCK_SIZE = 10 * 1024 * 1024  # 10Mb
+# max number of files downloaded concurrently, in total and from a single host
+DOWNLOAD_MAX_CONCURRENT = 8
+DOWNLOAD_MAX_CONCURRENT_PER_HOST = 4
 
 IMAGE_TYPE_DOCKER_ARCHIVE = 'docker-archive'
 IMAGE_TYPE_OCI = 'oci'
@@ -137,6 +140,11 @@ HTTP_BACKOFF_FACTOR = 5
 HTTP_CLIENT_STATUS_RETRY = (408, 429, 500, 502, 503, 504)
 # requests timeout in seconds
 HTTP_REQUEST_TIMEOUT = 600
+# max number of concurrent requests when querying a registry for many images
+REGISTRY_MAX_CONCURRENT_REQUESTS = 8
+# connections kept open to each registry, enough for the concurrent requests of
+# bulk inspections and of plugins running in parallel
+REGISTRY_POOL_MAXSIZE = 16
 # max retries for git clone
 GIT_MAX_RETRIES = 3
 # how many seconds should wait before another try of git clone
@@ -294,6 +294,26 @@ class ContextDir:
             path.mkdir(parents=True)
         self._path = path
         self.workflow_json = path / "workflow.json"
+        self.profiles_dir = path / "profiles"
+        self.checkpoints_dir = path / "checkpoints"
+        self.workflow_data_dir = path / "workflow_data"
+        self.blobs_dir = path / "blobs"
+        self.registry_cache_dir = path / "registry_cache"
+        self.fs_usage_file = path / "fs_usage.jsonl"
+
+    @property
+    def path(self) -> Path:
+        """Path of the context directory."""
+        return self._path
+
+    def get_workflow_data_file(self, section: str) -> Path:
+        """Get the file holding a section of the workflow data.
+
+        :param str section: name of the section, a field of the workflow data.
+        :return: path of the section file.
+        :rtype: pathlib.Path
+        """
+        return self.workflow_data_dir / f"{section}.json"
 
     def get_platform_dir(self, platform: str) -> Path:
         """Get the directory specific to the specified platform.
@@ -8,13 +8,21 @@ of the BSD license. See the LICENSE file for details.
 import hashlib
 import logging
 import os
+import threading
 import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Union
 import requests
 from urllib.parse import urlparse
 
 from atomic_reactor.util import get_retrying_requests_session
 from atomic_reactor.constants import (
     DEFAULT_DOWNLOAD_BLOCK_SIZE,
+    DOWNLOAD_MAX_CONCURRENT,
+    DOWNLOAD_MAX_CONCURRENT_PER_HOST,
     HTTP_BACKOFF_FACTOR,
     HTTP_MAX_RETRIES,
 )
@@ -23,10 +31,55 @@ from atomic_reactor.constants import (
 logger = logging.getLogger(__name__)
 
 
+def _get_range_validator(response):
+    """Get the value of the If-Range header to resume the download of the response
+
+    :return: str, strong ETag or Last-Modified of the response; None if the
+             download can't be resumed
+    """
+    if response.headers.get('Accept-Ranges') == 'none':
+        return None
+    # ranges apply to the encoded content, which is decoded while downloading
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def _is_resumed(response, offset):
+    """Check that the response is the rest of the file starting from offset"""
+    if response.status_code != requests.codes.partial_content:
+        return False
+    content_range = response.headers.get('Content-Range', '')
+    return content_range.startswith('bytes {}-'.format(offset))
+
+
+def _hash_file(path, algorithms):
+    checksums = {algo: hashlib.new(algo) for algo in algorithms}
+    if checksums:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(DEFAULT_DOWNLOAD_BLOCK_SIZE), b''):
+                for checksum in checksums.values():
+                    checksum.update(block)
+    return checksums
+
+
+def _get_dest_path(url, dest_dir, dest_filename=None):
+    if not dest_filename:
+        dest_filename = os.path.basename(urlparse(url).path)
+    return os.path.join(dest_dir, dest_filename)
+
+
 def download_url(url, dest_dir, insecure=False, session=None, dest_filename=None,
-                 expected_checksums=None):
+                 expected_checksums=None, cache=None):
     """Download file from URL, handling retries
 
+    When the download fails midway and the server supports range requests,
+    the retry only downloads the rest of the file. The If-Range header
+    makes the server send the whole file instead if it changed meanwhile.
+
     To download to a temporary directory, use:
       f = download_url(url, tempfile.mkdtemp())
 
@@ -37,6 +90,9 @@ def download_url(url, dest_dir, insecure=False, session=None, dest_filename=None
     :param dest_filename: optional filename for downloaded file
     :param expected_checksums: optional dictionary of checksum_type and
                                checksum to verify downloaded files
+    :param cache: optional ArtifactCache, files with expected sha256 or stronger
+                  checksums are taken from it if cached, and added to it once
+                  downloaded
     :return: str, path of downloaded file
     """
 
@@ -45,34 +101,164 @@ def download_url(url, dest_dir, insecure=False, session=None, dest_filename=None
     if session is None:
         session = get_retrying_requests_session()
 
-    parsed_url = urlparse(url)
-    if not dest_filename:
-        dest_filename = os.path.basename(parsed_url.path)
-    dest_path = os.path.join(dest_dir, dest_filename)
+    dest_path = _get_dest_path(url, dest_dir, dest_filename)
+    if cache is not None and cache.get(url, expected_checksums, dest_path):
+        logger.debug('%s taken from the artifact cache: %s', url, dest_path)
+        return dest_path
     logger.debug('downloading %s', url)
 
-    checksums = {algo: hashlib.new(algo) for algo in expected_checksums}
+    # the file is written under a temporary name, then renamed: dest_path may be
+    # a hardlink of an artifact cache entry, which must not be written into
+    tmp_path = '{}.{}.part'.format(dest_path, uuid.uuid4().hex)
+    try:
+        _download_to_file(url, tmp_path, insecure, session, expected_checksums)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    logger.debug('download finished: %s', dest_path)
+    if cache is not None:
+        cache.put(url, dest_path, expected_checksums)
+    return dest_path
+
+
+def _download_to_file(url, dest_path, insecure, session, expected_checksums):
+    """Download file from URL into dest_path, see download_url"""
+    # bytes downloaded by the previous attempts and the validator of their response
+    offset = 0
+    validator = None
 
     for attempt in range(HTTP_MAX_RETRIES + 1):
-        response = session.get(url, stream=True, verify=not insecure)
+        headers = {}
+        if offset and validator:
+            headers = {'Range': 'bytes={}-'.format(offset), 'If-Range': validator}
+        response = session.get(url, stream=True, verify=not insecure, headers=headers)
+        if headers and (
+            # e.g. the previous attempt failed after the last byte
+            response.status_code == requests.codes.requested_range_not_satisfiable or
+            # a part of the file which does not continue the downloaded bytes
+            response.status_code == requests.codes.partial_content and
+            not _is_resumed(response, offset)
+        ):
+            logger.debug('cannot resume download of %s from byte %d, downloading it again',
+                         url, offset)
+            response.close()
+            headers = {}
+            response = session.get(url, stream=True, verify=not insecure, headers=headers)
         response.raise_for_status()
+
+        if headers and _is_resumed(response, offset):
+            logger.debug('resuming download of %s from byte %d', url, offset)
+            mode = 'ab'
+            checksums = _hash_file(dest_path, expected_checksums)
+        else:
+            mode = 'wb'
+            checksums = {algo: hashlib.new(algo) for algo in expected_checksums}
+            validator = _get_range_validator(response)
         try:
-            with open(dest_path, 'wb') as f:
+            with open(dest_path, mode) as f:
                 for chunk in response.iter_content(chunk_size=DEFAULT_DOWNLOAD_BLOCK_SIZE):
                     f.write(chunk)
                     for checksum in checksums.values():
                         checksum.update(chunk)
-            for algo, checksum in checksums.items():
-                if checksum.hexdigest() != expected_checksums[algo]:
-                    raise ValueError(
-                        'Computed {} checksum, {}, does not match expected checksum, {}'
-                        .format(algo, checksum.hexdigest(), expected_checksums[algo]))
+            mismatched = {algo: checksum.hexdigest() for algo, checksum in checksums.items()
+                          if checksum.hexdigest() != expected_checksums[algo]}
+            if mismatched and mode == 'ab' and attempt < HTTP_MAX_RETRIES:
+                # the file changed on the server even though its validator did not
+                logger.warning('checksum of resumed download of %s does not match, '
+                               'downloading the whole file again', url)
+                offset = 0
+                continue
+            for algo, computed in mismatched.items():
+                raise ValueError(
+                    'Computed {} checksum, {}, does not match expected checksum, {}'
+                    .format(algo, computed, expected_checksums[algo]))
             break
         except requests.exceptions.RequestException:
+            offset = os.path.getsize(dest_path)
             if attempt < HTTP_MAX_RETRIES:
                 time.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
             else:
                 raise
 
-    logger.debug('download finished: %s', dest_path)
-    return dest_path
+
+@dataclass(frozen=True)
+class Download:
+    """A file to download, see download_url for the meaning of the attributes"""
+
+    url: str
+    dest_dir: Union[str, os.PathLike]
+    dest_filename: Optional[str] = None
+    expected_checksums: Optional[Dict[str, str]] = None
+
+
+def download_urls(downloads: Sequence[Download], insecure=False, session=None,
+                  max_workers=DOWNLOAD_MAX_CONCURRENT,
+                  max_per_host=DOWNLOAD_MAX_CONCURRENT_PER_HOST, cache=None) -> List[str]:
+    """Download many files concurrently, see download_url
+
+    At most max_workers files are downloaded at a time, and at most
+    max_per_host from the same host, so that no single server is overloaded.
+    If a download fails, the downloads not started yet are cancelled and the
+    error of the first failed download is raised.
+
+    Identical downloads to the same path are done once, downloads of different
+    files to the same path are rejected.
+
+    :param downloads: sequence of Download
+    :param insecure: bool, whether to perform TLS checks
+    :param session: optional existing requests session to use, shared by
+                    all the downloads
+    :param max_workers: int, max number of concurrent downloads
+    :param max_per_host: int, max number of concurrent downloads from one host
+    :param cache: optional ArtifactCache, see download_url
+    :return: list of str, paths of the downloaded files, in the order of downloads
+    :raises ValueError: if different files would be downloaded to the same path
+    """
+    if not downloads:
+        return []
+
+    # files downloaded to the same path are downloaded once, concurrent
+    # downloads would write into the same file
+    dest_paths = [os.path.normpath(_get_dest_path(item.url, item.dest_dir, item.dest_filename))
+                  for item in downloads]
+    unique: Dict[str, Download] = {}
+    for dest_path, item in zip(dest_paths, downloads):
+        other = unique.setdefault(dest_path, item)
+        if (other.url, other.expected_checksums) != (item.url, item.expected_checksums):
+            raise ValueError('Conflicting downloads to {}: {} and {}'
+                             .format(dest_path, other.url, item.url))
+
+    # workers beyond max_per_host for a host would only wait for its slots
+    per_host = Counter(urlparse(item.url).netloc for item in unique.values())
+    max_workers = min(max_workers, sum(min(max_per_host, n) for n in per_host.values()))
+    if session is None:
+        session = get_retrying_requests_session(pool_maxsize=max_workers)
+
+    host_slots = {host: threading.BoundedSemaphore(max_per_host) for host in per_host}
+
+    def download(index, item):
+        with host_slots[urlparse(item.url).netloc]:
+            logger.debug('%d/%d downloading %s', index + 1, len(unique), item.url)
+            return download_url(item.url, item.dest_dir, insecure=insecure, session=session,
+                                dest_filename=item.dest_filename,
+                                expected_checksums=item.expected_checksums, cache=cache)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {dest_path: executor.submit(download, index, item)
+                   for index, (dest_path, item) in enumerate(unique.items())}
+        try:
+            paths = {dest_path: future.result() for dest_path, future in futures.items()}
+        except BaseException:
+            for future in futures.values():
+                future.cancel()
+            raise
+    elapsed = time.monotonic() - start
+
+    total_size = sum(os.path.getsize(path) for path in paths.values())
+    logger.info('downloaded %d files, %.1f MiB in %.1fs (%.1f MiB/s)',
+                len(paths), total_size / 2**20, elapsed,
+                total_size / 2**20 / elapsed if elapsed else 0)
+    return [paths[dest_path] for dest_path in dest_paths]
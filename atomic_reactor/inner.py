@@ -9,8 +9,12 @@ of the BSD license. See the LICENSE file for details.
 Script for building docker image. This is expected to run inside container.
 """
 
+import contextlib
+import copy
 import functools
+import hashlib
 import json
+import jsonschema
 import logging
 import signal
 import threading
@@ -19,12 +23,15 @@ import time
 import re
 from dataclasses import dataclass, field, fields
 from textwrap import dedent
-from typing import Any, Callable, Dict, Final, List, Optional, Union
+from pathlib import Path
+from typing import (Any, Callable, Dict, Final, Iterable, Iterator, List, Optional, Tuple,
+                    Union)
 
 from atomic_reactor.dirs import ContextDir, RootBuildDir
 from atomic_reactor.plugin import (
     BuildCanceledException,
     BuildStepPluginsRunner,
+    Deadline,
     ExitPluginsRunner,
     PluginFailedException,
     PostBuildPluginsRunner,
@@ -39,13 +46,24 @@ from atomic_reactor.constants import (
 )
 from atomic_reactor.types import ISerializer
 from atomic_reactor.util import (exception_message, DockerfileImages, df_parser,
-                                 base_image_is_custom, print_version_of_tools, validate_with_schema)
+                                 base_image_is_custom, print_version_of_tools,
+                                 get_schema_validator)
 from atomic_reactor.config import Configuration
 from atomic_reactor.source import Source, DummySource
 from atomic_reactor.tasks import PluginsDef
 from atomic_reactor.utils import imageutil
+from atomic_reactor.utils.blobs import BlobRef, BlobStore
+from atomic_reactor.utils.artifact_cache import ArtifactCache
+from atomic_reactor.utils.registry_cache import RegistryCache
 # from atomic_reactor import get_logging_encoding
 from osbs.utils import ImageName
+from osbs.utils import yaml as osbs_yaml
+
+try:
+    import orjson
+except ImportError:
+    # optional, speeds up saving the workflow data
+    orjson = None
 
 
 logger = logging.getLogger(__name__)
@@ -332,40 +350,140 @@ class TagConf(ISerializer):
 
 class FSWatcher(threading.Thread):
     """
-    Poll the filesystem every second in the background and keep a record of highest usage.
+    Poll the filesystems of the build in the background and keep a record of highest usage.
+
+    For each watched filesystem, the plugins running when the highest usage
+    was reached are recorded as well. Samples are taken often while the usage
+    changes quickly and less often while it does not, and whenever a plugin
+    starts or finishes. All samples may be appended to a JSON lines file.
     """
 
-    def __init__(self, *args, **kwargs):
+    USAGE_KEYS = ("mb_free", "mb_total", "mb_used", "inodes_free", "inodes_total", "inodes_used")
+
+    # the interval between samples is between these, in seconds
+    min_interval = 0.25
+    max_interval = 4.0
+    # a change in usage between two samples which keeps the sampling fast
+    mb_threshold = 10
+    inodes_threshold = 1000
+
+    def __init__(self, paths: Optional[Dict[str, str]] = None,
+                 series_path: Optional[Path] = None, *args, **kwargs):
+        """
+        :param paths: dict, label -> path on the filesystem to watch; the
+            first one is also reported at the top level of the usage data
+        :param series_path: Path, file to append all samples to
+        """
         super(FSWatcher, self).__init__(*args, **kwargs)
         self.daemon = True  # exits whenever the process exits
         self._lock = threading.Lock()
         self._done = False
         self._data = {}
+        self._paths = paths or {"root": "/"}
+        self._series_path = series_path
+        self._series_file = None
+        self._running_plugins: List[str] = []
+        self._last_sample: Dict[str, Dict[str, int]] = {}
+        self._interval = self.min_interval
+        self._wakeup = threading.Event()
 
     def run(self):
         """ Overrides parent method to implement thread's functionality. """
-        while True:  # make sure to run at least once before exiting
+        try:
+            while True:  # make sure to run at least once before exiting
+                self._wakeup.clear()
+                with self._lock:
+                    self._sample()
+                if self._done:
+                    break
+                self._wakeup.wait(self._interval)
+        finally:
             with self._lock:
-                self._update(self._data)
-            if self._done:
-                break
-            time.sleep(1)
+                if self._series_file:
+                    self._series_file.close()
+                    self._series_file = None
 
     def get_usage_data(self):
         """ Safely retrieve the most up to date results. """
         with self._lock:
-            data_copy = self._data.copy()
+            data_copy = copy.deepcopy(self._data)
         return data_copy
 
     def finish(self):
         """ Signal background thread to exit next time it wakes up. """
         with self._lock:  # just to be tidy; lock not really needed to set a boolean
             self._done = True
+        self._wakeup.set()
+
+    @contextlib.contextmanager
+    def watch_plugin(self, plugin_key: str) -> Iterator[None]:
+        """Attribute the usage within the context to the plugin"""
+        with self._lock:
+            self._running_plugins.append(plugin_key)
+            self._interval = self.min_interval
+        self._wakeup.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                # sample right away, the plugin is still running
+                if self.is_alive() and not self._done:
+                    self._sample()
+                self._running_plugins.remove(plugin_key)
+
+    def _sample(self):
+        """Sample all watched filesystems, must be called with the lock held"""
+        plugins = sorted(self._running_plugins)
+        filesystems = self._data.setdefault("filesystems", {})
+        sample = {}
+        changed = False
+        for label, path in self._paths.items():
+            fs_data = filesystems.setdefault(label, {"path": path})
+            peak_mb = fs_data.get("mb_used", -1)
+            peak_inodes = fs_data.get("inodes_used", -1)
+            new_data = self._update(fs_data, path)
+            if not isinstance(new_data, dict):
+                continue
+
+            if new_data["mb_used"] > peak_mb:
+                fs_data["peak_plugins"] = plugins
+            if new_data["inodes_used"] > peak_inodes:
+                fs_data["inodes_peak_plugins"] = plugins
+
+            last = self._last_sample.get(label)
+            if last and (
+                abs(new_data["mb_used"] - last["mb_used"]) >= self.mb_threshold or
+                abs(new_data["inodes_used"] - last["inodes_used"]) >= self.inodes_threshold
+            ):
+                changed = True
+            self._last_sample[label] = new_data
+            sample[label] = {key: new_data[key] for key in
+                             ("mb_used", "mb_free", "inodes_used", "inodes_free")}
+
+        # the first watched filesystem is reported at the top level for compatibility
+        first = filesystems.get(next(iter(self._paths)), {})
+        self._data.update({key: value for key, value in first.items() if key in self.USAGE_KEYS})
+
+        if changed:
+            self._interval = self.min_interval
+        else:
+            self._interval = min(self._interval * 2, self.max_interval)
+
+        if self._series_path and sample:
+            record = {"time": time.time(), "plugins": plugins, "filesystems": sample}
+            try:
+                if self._series_file is None:
+                    self._series_file = open(self._series_path, "a")
+                self._series_file.write(json.dumps(record) + "\n")
+                self._series_file.flush()
+            except OSError as e:
+                logger.warning("cannot write filesystem usage to %s: %s", self._series_path, e)
+                self._series_path = None
 
     @staticmethod
-    def _update(data):
+    def _update(data, path="/"):
         try:
-            st = os.statvfs("/")
+            st = os.statvfs(path)
         except Exception as e:
             return e  # just for tests; we don't really need return value
 
@@ -386,6 +504,27 @@ class FSWatcher(threading.Thread):
         return new_data
 
 
+WORKFLOW_DATA_SCHEMA = "schemas/workflow_data.json"
+
+# Fields of the workflow data which are stored in separate files of the context dir
+# and loaded only when accessed, so that tasks do not pay for data they do not use.
+# Only fields without a class level default can be loaded lazily.
+WORKFLOW_DATA_SECTIONS = (
+    "dockerfile_images",
+    "tag_conf",
+    "prebuild_results",
+    "buildstep_result",
+    "prepub_results",
+    "postbuild_results",
+    "exit_results",
+    "plugin_workspace",
+    "files",
+)
+
+# Serializes loading of sections, plugins may access the workflow data concurrently
+_sections_lock = threading.Lock()
+
+
 @dataclass
 class ImageBuildWorkflowData(ISerializer):
     """Manage workflow data.
@@ -412,6 +551,9 @@ class ImageBuildWorkflowData(ISerializer):
     plugins_timestamps: Dict[str, str] = field(default_factory=dict)
     # Plugin name -> seconds
     plugins_durations: Dict[str, float] = field(default_factory=dict)
+    # Plugin name -> resources used while running the plugin, e.g. CPU time,
+    #  I/O, HTTP traffic; see atomic_reactor.utils.resources.get_resource_usage
+    plugins_resources: Dict[str, Dict[str, Union[int, float]]] = field(default_factory=dict)
     # Plugin name -> a string containing error message
     plugins_errors: Dict[str, str] = field(default_factory=dict)
     build_canceled: bool = False
@@ -436,6 +578,7 @@ class ImageBuildWorkflowData(ISerializer):
 
     # mapping of downloaded files; DON'T PUT ANYTHING BIG HERE!
     # "path/to/file" -> "content"
+    # Store big content in workflow.blob_store and put the returned BlobRef here instead.
     files: Dict[str, str] = field(default_factory=dict)
 
     # List of RPMs that go into the final result, as per utils.rpm.parse_rpm_output
@@ -491,6 +634,9 @@ class ImageBuildWorkflowData(ISerializer):
     def load_from_dir(cls, context_dir: ContextDir) -> "ImageBuildWorkflowData":
         """Load workflow data from the data directory.
 
+        The fields in WORKFLOW_DATA_SECTIONS are stored in separate files and
+        loaded only when they are accessed for the first time.
+
         :param context_dir: a directory holding the files containing the serialized
             workflow data.
         :type context_dir: ContextDir
@@ -506,26 +652,46 @@ class ImageBuildWorkflowData(ISerializer):
         if not context_dir.workflow_json.exists():
             return cls()
 
-        with open(context_dir.workflow_json, "r") as f:
-            file_content = f.read()
-
-        raw_data = json.loads(file_content)
-        validate_with_schema(raw_data, "schemas/workflow_data.json")
-
-        # NOTE: json.loads twice since the data is validated at the first time.
-        workflow_data = json.loads(file_content, object_hook=WorkflowDataDecoder())
+        workflow_data = _load_data_file(context_dir.workflow_json)
+        core_fields = [f.name for f in fields(cls) if f.name not in WORKFLOW_DATA_SECTIONS]
+        _validate_data(workflow_data, required=core_fields)
 
         build_result = workflow_data.pop("build_result")
         loaded_data = cls(**workflow_data)
         loaded_data.build_result = build_result
+
+        loaded_data._context_dir = context_dir
+        loaded_data._section_digests = {}
+        for name in WORKFLOW_DATA_SECTIONS:
+            # data saved before the sections were introduced has them inline
+            if name not in workflow_data and context_dir.get_workflow_data_file(name).exists():
+                delattr(loaded_data, name)
         return loaded_data
 
+    def __getattr__(self, name: str) -> Any:
+        # Called only when the attribute is not set, i.e. for sections not loaded yet
+        if name not in WORKFLOW_DATA_SECTIONS or "_context_dir" not in self.__dict__:
+            raise AttributeError(name)
+
+        with _sections_lock:
+            if name not in self.__dict__:
+                path = self._context_dir.get_workflow_data_file(name)
+                raw_content = path.read_bytes()
+                value = _load_data_file(path, raw_content)[name]
+                _validate_data({name: value}, required=[name])
+                self._section_digests[name] = hashlib.sha256(raw_content).hexdigest()
+                setattr(self, name, value)
+        return self.__dict__[name]
+
     def as_dict(self) -> Dict[str, Any]:
         return {field.name: getattr(self, field.name) for field in fields(self)}
 
     def save(self, context_dir: ContextDir) -> None:
         """Save workflow data into the files under a specific directory.
 
+        Sections which were not loaded, or did not change since they were
+        loaded, are not written again.
+
         :param context_dir: a directory holding the files containing the serialized
             workflow data.
         :type context_dir: ContextDir
@@ -533,9 +699,28 @@ class ImageBuildWorkflowData(ISerializer):
 
         # TBD: same comment as above for build_result
 
+        loaded_from = self.__dict__.get("_context_dir")
+        same_dir = (loaded_from is not None and
+                    loaded_from.workflow_json == context_dir.workflow_json)
+        digests = self.__dict__.get("_section_digests", {}) if same_dir else {}
+
+        for name in WORKFLOW_DATA_SECTIONS:
+            if same_dir and name not in self.__dict__:
+                continue
+            content = _dump_workflow_data({name: getattr(self, name)})
+            if digests.get(name) == hashlib.sha256(content).hexdigest():
+                continue
+            path = context_dir.get_workflow_data_file(name)
+            logger.debug("Writing workflow data section %s into %s", name, path)
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(content)
+
+        core_data = {
+            f.name: getattr(self, f.name)
+            for f in fields(self) if f.name not in WORKFLOW_DATA_SECTIONS
+        }
         logger.info("Writing workflow data into %s", context_dir.workflow_json)
-        with open(context_dir.workflow_json, "w+") as f:
-            json.dump(self.as_dict(), f, cls=WorkflowDataEncoder)
+        context_dir.workflow_json.write_bytes(_dump_workflow_data(core_data))
 
 
 class WorkflowDataEncoder(json.JSONEncoder):
@@ -569,6 +754,7 @@ class WorkflowDataDecoder:
             DockerfileImages.__name__: DockerfileImages.load,
             TagConf.__name__: TagConf.load,
             ImageName.__name__: self._restore_image_name,
+            BlobRef.__name__: BlobRef.load,
         }
         if "__type__" not in data:
             # __type__ is an identifier to indicate a dict object represents an
@@ -584,6 +770,62 @@ class WorkflowDataDecoder:
         return loader_meth(data)
 
 
+def _load_data_file(path: Path, content: Optional[bytes] = None) -> Dict[str, Any]:
+    """Load a file holding (a part of) the workflow data, restoring the serialized objects."""
+    if content is None:
+        content = path.read_bytes()
+    return json.loads(content, object_hook=WorkflowDataDecoder())
+
+
+@functools.lru_cache(maxsize=None)
+def _get_data_validator(required: Tuple[str, ...]) -> jsonschema.Draft4Validator:
+    """Get a validator of workflow data which requires only the specified fields."""
+    schema = dict(get_schema_validator(WORKFLOW_DATA_SCHEMA).schema, required=list(required))
+    return jsonschema.Draft4Validator(schema)
+
+
+def _validate_data(data: Dict[str, Any], required: Iterable[str]) -> None:
+    """Validate (a part of) the workflow data loaded by _load_data_file.
+
+    The data is parsed only once, the objects restored by the decoder are
+    serialized back for the validation. The schema does not constrain the
+    contents of the fields where such objects may be nested.
+
+    :raises osbs.OsbsValidationException: if the data is not valid
+    """
+    validator = _get_data_validator(tuple(required))
+    data = _serialize_objects(data)
+    if not validator.is_valid(data):
+        # Let osbs-client report the errors, for consistency with other validations
+        osbs_yaml.validate_with_schema(data, validator.schema)
+
+
+def _serialize_objects(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert the objects restored by WorkflowDataDecoder at the top level back to JSON data."""
+    encoder = WorkflowDataEncoder()
+    return {
+        name: json.loads(encoder.encode(value))
+        if isinstance(value, (ISerializer, ImageName)) else value
+        for name, value in data.items()
+    }
+
+
+def _dump_workflow_data(data: Dict[str, Any]) -> bytes:
+    """Serialize workflow data, with orjson if it is installed since it is much faster."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                data,
+                default=WorkflowDataEncoder().default,
+                option=(orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS |
+                        orjson.OPT_PASSTHROUGH_DATETIME),
+            )
+        except TypeError as e:
+            # e.g. namedtuples, which json serializes as lists
+            logger.debug("orjson cannot serialize workflow data, using json: %s", e)
+    return json.dumps(data, cls=WorkflowDataEncoder).encode("utf-8")
+
+
 class DockerBuildWorkflow(object):
     """
     This class defines a workflow for building images:
@@ -609,6 +851,7 @@ class DockerBuildWorkflow(object):
         reactor_config_path: str = REACTOR_CONFIG_FULL_PATH,
         plugin_files: List[str] = None,
         client_version: str = None,
+        context_dir: Optional[ContextDir] = None,
     ):
         """
         :param build_dir: a directory holding all the artifacts to build an image.
@@ -621,16 +864,28 @@ class DockerBuildWorkflow(object):
         :param reactor_config_path: path to atomic-reactor configuration file
         :param plugin_files: load plugins also from these files
         :param client_version: osbs-client version used to render build json
+        :param context_dir: directory holding data through the whole build pipeline
+        :type context_dir: ContextDir
         """
         self.build_dir = build_dir
         self.data = data or ImageBuildWorkflowData()
+        self.context_dir = context_dir
+        self._blob_store: Optional[BlobStore] = None
 
         self.source = source or DummySource(None, None)
         self.plugins = plugins or PluginsDef()
         self.user_params = user_params or self._default_user_params.copy()
 
         self.plugin_files = plugin_files
-        self.fs_watcher = FSWatcher()
+        watched_paths = {"root": "/"}
+        if isinstance(build_dir, RootBuildDir):
+            watched_paths["build_dir"] = str(build_dir.path)
+        if context_dir is not None:
+            watched_paths["context_dir"] = str(context_dir.path)
+        self.fs_watcher = FSWatcher(
+            watched_paths,
+            series_path=context_dir.fs_usage_file if context_dir is not None else None,
+        )
 
         self.storage_transport = DOCKER_STORAGE_TRANSPORT_NAME
 
@@ -653,6 +908,23 @@ class DockerBuildWorkflow(object):
         if build_file_path.endswith(DOCKERFILE_FILENAME):
             self.reset_dockerfile_images(build_file_path)
 
+    @property
+    def blob_store(self) -> BlobStore:
+        """Store for content too big to be put into the workflow data
+
+        Plugins put the returned BlobRef objects into the workflow data.
+        The store lives in the context dir, so the content is available to
+        the subsequent tasks. Without a context dir, it lives in the build
+        dir and the content is available only within the task.
+        """
+        if self._blob_store is None:
+            if self.context_dir is not None:
+                path = self.context_dir.blobs_dir
+            else:
+                path = self.build_dir.path / "blobs"
+            self._blob_store = BlobStore(path)
+        return self._blob_store
+
     @property
     def df_path(self):
         if self._df_path is None:
@@ -744,7 +1016,38 @@ class DockerBuildWorkflow(object):
         for performance reasons (ImageUtil caches registry queries, a new instance would not have
         the cache).
         """
-        return imageutil.ImageUtil(self.data.dockerfile_images, self.conf)
+        return imageutil.ImageUtil(
+            self.data.dockerfile_images, self.conf, registry_cache=self.registry_cache
+        )
+
+    @functools.cached_property
+    def registry_cache(self) -> Optional[RegistryCache]:
+        """Get the persistent cache of registry content, if enabled in the config.
+
+        The cache lives in the context dir, so the subsequent tasks do not query the
+        registries for the same content again. Optionally, it is backed by a directory
+        shared by the builds on the node.
+        """
+        cache_conf = self.conf.registry_cache
+        if cache_conf is None:
+            return None
+
+        shared_dir = Path(cache_conf['shared_dir']) if cache_conf['shared_dir'] else None
+        if self.context_dir is not None:
+            path = self.context_dir.registry_cache_dir
+        elif shared_dir is not None:
+            path, shared_dir = shared_dir, None
+        else:
+            return None
+        return RegistryCache(path, shared_path=shared_dir, tag_ttl=cache_conf['tag_ttl'])
+
+    @functools.cached_property
+    def artifact_cache(self) -> Optional[ArtifactCache]:
+        """Get the node-local cache of downloaded files, if enabled in the config."""
+        cache_conf = self.conf.artifact_cache
+        if cache_conf is None:
+            return None
+        return ArtifactCache(Path(cache_conf['dir']), max_size=cache_conf['max_size'])
 
     def parent_images_to_str(self):
         results = {}
@@ -814,12 +1117,19 @@ class DockerBuildWorkflow(object):
         try:
             self.fs_watcher.start()
             signal.signal(signal.SIGTERM, self.throw_canceled_build_exception)
-            prebuild_runner = PreBuildPluginsRunner(self, self.plugins.prebuild,
-                                                    plugin_files=self.plugin_files)
+            runner_conf = self.conf.plugin_runner
+            # the time budget covers all phases but the exit plugins, which always run
+            runner_kwargs = {
+                'plugin_files': self.plugin_files,
+                'max_workers': runner_conf['max_workers'],
+                'plugin_timeouts': runner_conf['plugin_timeouts'],
+                'deadline': Deadline(runner_conf['task_timeout'], description='task time budget'),
+            }
+            prebuild_runner = PreBuildPluginsRunner(self, self.plugins.prebuild, **runner_kwargs)
             prepublish_runner = PrePublishPluginsRunner(self, self.plugins.prepublish,
-                                                        plugin_files=self.plugin_files)
+                                                        **runner_kwargs)
             postbuild_runner = PostBuildPluginsRunner(self, self.plugins.postbuild,
-                                                      plugin_files=self.plugin_files)
+                                                      **runner_kwargs)
             # time to run pre-build plugins, so they can access cloned repo
             logger.info("running pre-build plugins")
             try:
@@ -831,7 +1141,7 @@ class DockerBuildWorkflow(object):
             # we are delaying initialization, because prebuild plugin reactor_config
             # might change build method
             buildstep_runner = BuildStepPluginsRunner(self, self.plugins.buildstep,
-                                                      plugin_files=self.plugin_files)
+                                                      **runner_kwargs)
 
             logger.info("running buildstep plugins")
             try:
@@ -868,9 +1178,12 @@ class DockerBuildWorkflow(object):
             # We need to make sure all exit plugins are executed
             signal.signal(signal.SIGTERM, lambda *args: None)
 
+            runner_conf = self.conf.plugin_runner
             exit_runner = ExitPluginsRunner(self, self.plugins.exit,
                                             keep_going=True,
-                                            plugin_files=self.plugin_files)
+                                            plugin_files=self.plugin_files,
+                                            max_workers=runner_conf['max_workers'],
+                                            plugin_timeouts=runner_conf['plugin_timeouts'])
             try:
                 exit_runner.run(keep_going=True)
             except PluginFailedException as ex:
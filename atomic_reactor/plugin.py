@@ -11,24 +11,41 @@ definition of plugin system
 plugins are supposed to be run when image is built and we need to extract some information
 """
 from abc import ABC, abstractmethod
+import ast
+import asyncio
+import contextlib
 import copy
+import functools
+import hashlib
+import json
 import logging
 import os
 import sys
+import threading
 import traceback
-import imp  # pylint: disable=deprecated-module
+import importlib.machinery
+import importlib.util
 import datetime
 import inspect
 import time
 from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
 
 import atomic_reactor.inner
+from atomic_reactor import constants
 from atomic_reactor.util import exception_message
+from atomic_reactor.utils import profiling, resources
 from dockerfile_parse import DockerfileParser
 
 MODULE_EXTENSIONS = ('.py', '.pyc', '.pyo')
 logger = logging.getLogger(__name__)
 
+# State shared by plugins outside the workflow data, declared in Plugin.reads and
+# Plugin.writes next to workflow data fields. They are not checkpointed.
+SOURCE_FILES = '@source'  # the files of the source repository, e.g. container.yaml
+BUILD_DIRS = '@build_dirs'  # the build dirs of all platforms, including the Dockerfiles
+
 
 class PluginFailedException(Exception):
     """ There was an error during plugin execution """
@@ -42,12 +59,91 @@ class InappropriateBuildStepError(Exception):
     """Requested build step is not appropriate"""
 
 
+class PluginTimeoutException(Exception):
+    """Plugin did not finish in time"""
+
+
+class Deadline(object):
+    """
+    point in time by which a plugin has to finish
+
+    Plugins waiting for something, e.g. polling an external service, should
+    check the deadline in their loops (see check and sleep) so that they can
+    be stopped cleanly. A plugin which does not finish within a grace period
+    after its deadline is abandoned by the runner.
+    """
+
+    def __init__(self, seconds: Optional[float] = None, parent: Optional["Deadline"] = None,
+                 description: str = "timeout"):
+        """
+        :param seconds: float, seconds from now, None for no time limit
+        :param parent: Deadline, an outer deadline which may expire sooner
+        :param description: str, what the deadline is, used in error messages
+        """
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self.description = description
+        if seconds is not None:
+            self.description = "{} of {}s".format(description, seconds)
+        if parent is not None and parent.expires_at is not None:
+            if self.expires_at is None or parent.expires_at < self.expires_at:
+                self.expires_at = parent.expires_at
+                self.description = parent.description
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """seconds left until the deadline, None if there is no time limit"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining == 0.0
+
+    def check(self) -> None:
+        """
+        :raises PluginTimeoutException: if the deadline has passed
+        """
+        if self.expired:
+            raise PluginTimeoutException("{} exceeded".format(self.description))
+
+    def sleep(self, seconds: float) -> None:
+        """
+        sleep, but not past the deadline
+
+        :raises PluginTimeoutException: if the deadline has passed
+        """
+        remaining = self.remaining
+        time.sleep(seconds if remaining is None else min(seconds, remaining))
+        self.check()
+
+
 class Plugin(ABC):
     """ abstract plugin class """
 
     # by default, if plugin fails (raises exc), execution continues
     is_allowed_to_fail = True
 
+    # Workflow data fields read and written by the plugin. A field name may be
+    # narrowed to a single item with a dotted suffix, e.g. 'prebuild_results.koji_parent'.
+    # The plugin's own result is accounted for by the runner and needs no declaration.
+    # Shared state outside the workflow data is declared with SOURCE_FILES and BUILD_DIRS.
+    # Plugins declaring both may be run concurrently with other declaring plugins they
+    # share no written data with. A plugin which does not declare them, or which accesses
+    # anything else shared outside the workflow data, is run only after all plugins
+    # before it have finished and before any plugin after it is started.
+    reads: Optional[Iterable[str]] = None
+    writes: Optional[Iterable[str]] = None
+
+    # Whether the result of a previous attempt of the task may be restored from a checkpoint
+    # instead of running the plugin again, see BuildPluginsRunner.get_plugin_fingerprint.
+    # Only plugins declaring reads and writes whose other effects are limited to files
+    # in the build dir may be resumable.
+    resumable = False
+
+    # Set by the runner before run() is called
+    deadline = Deadline()
+
     def __init__(self, *args, **kwargs):
         """
         constructor
@@ -92,6 +188,9 @@ class Plugin(ABC):
 
           results[plugin.key] = plugin.run()
 
+        build plugins may also implement it as a coroutine, ``async def run(self)``,
+        see BuildPlugin.run_blocking
+
         input plugins should emit build json with this method
         """
         raise NotImplementedError()
@@ -131,52 +230,223 @@ class BuildPlugin(Plugin):
         """
         return {}
 
+    @staticmethod
+    async def run_blocking(func, *args, **kwargs):
+        """Run a blocking function in a thread and wait for its result.
+
+        Plugins implementing ``async def run()`` are run on an event loop shared
+        by the plugins of the runner. They can overlap blocking calls, e.g. HTTP
+        requests made with requests, by awaiting this method, for instance with
+        ``asyncio.gather(*(self.run_blocking(fetch, image) for image in images))``.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+def _data_overlaps(names_a: Iterable[str], names_b: Iterable[str]) -> bool:
+    """Check whether two sets of workflow data names refer to any common data
+
+    'foo' overlaps with 'foo' and with any item of it, e.g. 'foo.bar', but
+    'foo.bar' does not overlap with 'foo.baz'.
+    """
+    for a in names_a:
+        for b in names_b:
+            if a == b or a.startswith(b + '.') or b.startswith(a + '.'):
+                return True
+    return False
+
+
+def _is_data_item(name: str) -> bool:
+    """Check whether a name used in Plugin.reads or Plugin.writes is workflow data"""
+    return not name.startswith('@')
+
+
+def _get_data_item(data, name: str):
+    """Get a workflow data field, or an item of it, by a name used in Plugin.reads"""
+    field_name, _, key = name.partition('.')
+    value = getattr(data, field_name)
+    return value.get(key) if key else value
+
+
+def _set_data_item(data, name: str, value) -> None:
+    """Set a workflow data field, or an item of it, by a name used in Plugin.writes"""
+    field_name, _, key = name.partition('.')
+    if key:
+        getattr(data, field_name)[key] = value
+    else:
+        setattr(data, field_name, value)
+
+
+@functools.lru_cache(maxsize=None)
+def get_plugin_keys(path: str) -> Optional[FrozenSet[str]]:
+    """Find keys of the plugins defined in a module without importing it
+
+    Keys are read from the ``key`` class attributes of classes defined at the
+    module level. They may be string literals, names of string constants
+    defined in the module or imported from atomic_reactor.constants, or the
+    key of another class in the module.
+
+    :param path: str, path to the module source
+    :return: frozenset of plugin keys, or None if some key could not be determined
+    """
+    try:
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+    names: Dict[str, str] = {}
+
+    def resolve(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        if isinstance(node, ast.Name):
+            return names.get(node.id)
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+            return names.get('{}.{}'.format(node.value.id, node.attr))
+        return None
+
+    keys = set()
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module == constants.__name__:
+            for alias in node.names:
+                value = getattr(constants, alias.name, None)
+                if isinstance(value, str):
+                    names[alias.asname or alias.name] = value
+        elif isinstance(node, ast.Assign):
+            value = resolve(node.value)
+            for target in node.targets:
+                if isinstance(target, ast.Name) and value is not None:
+                    names[target.id] = value
+        elif isinstance(node, ast.ClassDef):
+            for item in node.body:
+                if isinstance(item, ast.Assign):
+                    targets, value_node = item.targets, item.value
+                elif isinstance(item, ast.AnnAssign) and item.value is not None:
+                    targets, value_node = [item.target], item.value
+                else:
+                    continue
+                if not any(isinstance(t, ast.Name) and t.id == 'key' for t in targets):
+                    continue
+                key = resolve(value_node)
+                if key is None:
+                    return None
+                keys.add(key)
+                names['{}.key'.format(node.name)] = key
+    return frozenset(keys)
+
+
+@functools.lru_cache(maxsize=None)
+def get_plugin_index(plugins_dir: str) -> Dict[Optional[str], List[str]]:
+    """Map plugin keys to the modules in a directory defining them
+
+    The index is built only once per process for each directory.
+
+    :param plugins_dir: str, directory containing plugin modules
+    :return: dict, plugin key -> list of module paths; modules whose plugin
+             keys could not be determined are listed under the None key
+    """
+    index: Dict[Optional[str], List[str]] = {}
+    for f in sorted(os.listdir(plugins_dir)):
+        if not f.endswith(".py"):
+            continue
+        path = os.path.join(plugins_dir, f)
+        keys = get_plugin_keys(path)
+        for key in (keys if keys is not None else [None]):
+            index.setdefault(key, []).append(path)
+    return index
+
+
+def _load_plugin_module(path):
+    """Load a plugin module from its source file
+
+    The module is registered in sys.modules under the file's base name and
+    it is not loaded again if a module of that name was loaded already.
+    """
+    module_name = os.path.basename(path).rsplit('.', 1)[0]
+    # Do not reload plugins
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    logger.debug("load file '%s'", path)
+    loader = importlib.machinery.SourceFileLoader(module_name, path)
+    spec = importlib.util.spec_from_loader(module_name, loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
 
 class PluginsRunner(object):
 
+    # name of the workflow data field holding results of this runner's plugins
+    results_field: Optional[str] = None
+
+    # seconds a plugin is waited for after its deadline before it is abandoned
+    timeout_grace_period = 30
+
     def __init__(self, plugin_class_name, plugins_conf, *args, **kwargs):
         """
         constructor
 
         :param plugin_class_name: str, name of plugin class to filter (e.g. 'PreBuildPlugin')
         :param plugins_conf: list of dicts, configuration for plugins
+        :param max_workers: int, maximum number of plugins run concurrently,
+                            see Plugin.reads and Plugin.writes
+        :param plugin_timeouts: dict, plugin key -> seconds, default timeouts of
+                                plugins which have none in their configuration
+        :param deadline: Deadline, by which all plugins of the runner have to finish
         """
         self.plugins_results = getattr(self, "plugins_results", {})
         self.plugins_conf = plugins_conf or []
         self.plugin_files = kwargs.get("plugin_files", [])
+        self.max_workers = kwargs.get("max_workers", 1)
+        self.plugin_timeouts = kwargs.get("plugin_timeouts") or {}
+        self.deadline = kwargs.get("deadline") or Deadline()
+        # event loop running the plugins with async run(), started when first needed
+        self._event_loop = None
+        self._event_loop_thread = None
+        self._event_loop_lock = threading.Lock()
         self.plugin_classes = self.load_plugins(plugin_class_name)
         self.available_plugins = self.get_available_plugins()
 
     def load_plugins(self, plugin_class_name):
         """
-        load all available plugins
+        load plugins requested in the runner configuration
+
+        Only modules which define plugins with the requested keys are
+        imported, see get_plugin_index.
 
         :param plugin_class_name: str, name of plugin class (e.g. 'PreBuildPlugin')
         :return: dict, bindings for plugins of the plugin_class_name class
         """
-        # imp.findmodule('atomic_reactor') doesn't work
         plugins_dir = os.path.join(os.path.dirname(__file__), 'plugins')
         logger.debug("loading plugins from dir '%s'", plugins_dir)
-        files = [os.path.join(plugins_dir, f)
-                 for f in os.listdir(plugins_dir)
-                 if f.endswith(".py")]
+        index = get_plugin_index(plugins_dir)
         if self.plugin_files:
             logger.debug("loading additional plugins from files '%s'", self.plugin_files)
-            files += self.plugin_files
+
+        requested_keys = {plugin_request['name'] for plugin_request in self.plugins_conf}
+        files = []
+        for key in sorted(requested_keys) + [None]:
+            files.extend(f for f in index.get(key, []) if f not in files)
+        for f in self.plugin_files or []:
+            keys = get_plugin_keys(f)
+            if (keys is None or keys & requested_keys) and f not in files:
+                files.append(f)
+
         plugin_class = globals()[plugin_class_name]
         plugin_classes = {}
         for f in files:
-            module_name = os.path.basename(f).rsplit('.', 1)[0]
-            # Do not reload plugins
-            if module_name in sys.modules:
-                f_module = sys.modules[module_name]
-            else:
-                try:
-                    logger.debug("load file '%s'", f)
-                    f_module = imp.load_source(module_name, f)
-                except (IOError, OSError, ImportError, SyntaxError) as ex:
-                    logger.warning("can't load module '%s': %s", f, ex)
-                    continue
+            try:
+                f_module = _load_plugin_module(f)
+            except (IOError, OSError, ImportError, SyntaxError) as ex:
+                logger.warning("can't load module '%s': %s", f, ex)
+                continue
             for name in dir(f_module):
                 binding = getattr(f_module, name, None)
                 try:
@@ -214,6 +484,133 @@ class PluginsRunner(object):
     def save_plugin_duration(self, plugin, duration):
         pass
 
+    def save_plugin_resources(self, plugin, resource_usage):
+        pass
+
+    def get_resource_usage(self):
+        """
+        take a snapshot of the resources used so far, see resources.get_resource_usage
+        """
+        return resources.get_resource_usage()
+
+    def profile_plugin(self, plugin):
+        """
+        context manager profiling the run of a plugin, profiling is disabled by default
+        """
+        return contextlib.nullcontext()
+
+    def watch_plugin(self, plugin):
+        """
+        context manager attributing the filesystem usage within it to a plugin
+        """
+        return contextlib.nullcontext()
+
+    def _call_plugin(self, plugin, plugin_instance):
+        """
+        run the plugin instance, waiting at most until its deadline and grace period
+
+        Plugins with a time limit are run in a daemon thread, which is
+        abandoned when they do not finish in time.
+        """
+        is_async = inspect.iscoroutinefunction(plugin_instance.run)
+        deadline = plugin_instance.deadline
+
+        def run_plugin():
+            with self.profile_plugin(plugin.plugin_class.key):
+                if is_async:
+                    return self._run_coroutine(plugin_instance.run(), deadline)
+                return plugin_instance.run()
+
+        deadline.check()
+        # async plugins are cancelled at their deadline on the event loop
+        if deadline.remaining is None or is_async:
+            return run_plugin()
+
+        outcome = {}
+
+        def target():
+            try:
+                outcome['response'] = run_plugin()
+            except BaseException as ex:
+                outcome['exception'] = ex
+
+        thread = threading.Thread(target=target, daemon=True,
+                                  name='plugin-{}'.format(plugin.plugin_class.key))
+        thread.start()
+        thread.join(deadline.remaining + self.timeout_grace_period)
+        if thread.is_alive():
+            logger.error("plugin '%s' did not stop after its deadline, abandoning it",
+                         plugin.name)
+            raise PluginTimeoutException("{} exceeded".format(deadline.description))
+        if 'exception' in outcome:
+            raise outcome['exception']
+        return outcome['response']
+
+    def _get_event_loop(self):
+        with self._event_loop_lock:
+            if self._event_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='plugin-event-loop',
+                                          daemon=True)
+                thread.start()
+                self._event_loop = loop
+                self._event_loop_thread = thread
+            return self._event_loop
+
+    def _close_event_loop(self):
+        with self._event_loop_lock:
+            loop = self._event_loop
+            if loop is None:
+                return
+            loop.call_soon_threadsafe(loop.stop)
+            self._event_loop_thread.join()
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+            self._event_loop = None
+            self._event_loop_thread = None
+
+    def _run_coroutine(self, coroutine, deadline):
+        """
+        run the coroutine of an async plugin on the event loop shared by the
+        plugins of this runner, wait for its result
+
+        :param coroutine: coroutine returned by the run() method of the plugin
+        :param deadline: Deadline, the coroutine is cancelled when it passes
+        """
+        if deadline.remaining is not None:
+            coroutine = asyncio.wait_for(coroutine, deadline.remaining)
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._get_event_loop())
+        try:
+            return future.result()
+        except asyncio.TimeoutError as ex:
+            if deadline.expired:
+                raise PluginTimeoutException("{} exceeded".format(deadline.description)) from ex
+            raise
+        except BaseException:
+            # e.g. the build was canceled
+            future.cancel()
+            raise
+
+    def get_plugin_fingerprint(self, plugin):
+        """
+        compute a fingerprint of the inputs of a plugin about to run
+
+        :param plugin: namedtuple, runnable plugin data
+        :return: str, or None if the plugin cannot be checkpointed
+        """
+        return None
+
+    def restore_plugin_checkpoint(self, plugin, fingerprint):
+        """
+        restore the results of a plugin from a checkpoint matching the fingerprint
+
+        :return: bool, whether the checkpoint was restored and the plugin can be skipped
+        """
+        return False
+
+    def save_plugin_checkpoint(self, plugin, fingerprint, plugin_response):
+        pass
+
     def get_available_plugins(self):
         """
         check requested plugins availability
@@ -222,7 +619,8 @@ class PluginsRunner(object):
         :return: list of namedtuples, runnable plugins data
         """
         available_plugins = []
-        PluginData = namedtuple('PluginData', 'name, plugin_class, conf, is_allowed_to_fail')
+        PluginData = namedtuple('PluginData',
+                                'name, plugin_class, conf, is_allowed_to_fail, timeout')
         for plugin_request in self.plugins_conf:
             plugin_name = plugin_request['name']
             try:
@@ -244,13 +642,205 @@ class PluginsRunner(object):
                                                            getattr(plugin_class,
                                                                    "is_allowed_to_fail", True))
             plugin_conf = plugin_request.get("args", {})
+            plugin_timeout = plugin_request.get("timeout", self.plugin_timeouts.get(plugin_name))
             plugin = PluginData(plugin_name,
                                 plugin_class,
                                 plugin_conf,
-                                plugin_is_allowed_to_fail)
+                                plugin_is_allowed_to_fail,
+                                plugin_timeout)
             available_plugins.append(plugin)
         return available_plugins
 
+    def _get_plugin_accesses(self, plugin):
+        """
+        get the workflow data accessed by a plugin
+
+        :param plugin: namedtuple, runnable plugin data
+        :return: tuple (reads, writes) of sets of workflow data names,
+                 or None if the plugin does not declare them
+        """
+        plugin_class = plugin.plugin_class
+        if plugin_class.reads is None or plugin_class.writes is None:
+            return None
+        writes = set(plugin_class.writes)
+        if self.results_field:
+            writes.add('{}.{}'.format(self.results_field, plugin_class.key))
+        return set(plugin_class.reads), writes
+
+    def get_plugin_dependencies(self) -> List[Set[int]]:
+        """
+        compute which of the available plugins each plugin has to wait for
+
+        A plugin depends on every plugin before it which writes data it
+        reads or writes, or which reads data it writes. Plugins which do
+        not declare their data accesses depend on, and are depended on by,
+        all plugins.
+
+        :return: list of sets, indexes of plugins in available_plugins
+                 each plugin depends on
+        """
+        accesses = [self._get_plugin_accesses(plugin) for plugin in self.available_plugins]
+        dependencies = []
+        for i, access in enumerate(accesses):
+            deps = set()
+            for j in range(i):
+                previous = accesses[j]
+                if (access is None or previous is None or
+                        _data_overlaps(previous[1], access[0] | access[1]) or
+                        _data_overlaps(previous[0], access[1])):
+                    deps.add(j)
+            dependencies.append(deps)
+        return dependencies
+
+    def _run_plugin(self, plugin, failed_msgs, keep_going=False, buildstep_phase=False):
+        """
+        run a single plugin and save its result
+
+        :param plugin: namedtuple, runnable plugin data
+        :param failed_msgs: list, messages of failed plugins which are
+                            not allowed to fail are appended to it
+        :param keep_going: bool, whether to keep going after unexpected failure
+        :param buildstep_phase: bool, whether the plugin is a build-step plugin
+        :return: tuple (plugin_successful, plugin_response, build_failed)
+        """
+        plugin_successful = False
+
+        fingerprint = self.get_plugin_fingerprint(plugin)
+        if fingerprint is not None and self.restore_plugin_checkpoint(plugin, fingerprint):
+            logger.info("plugin '%s' restored from checkpoint, not running it again",
+                        plugin.name)
+            return True, self.plugins_results.get(plugin.plugin_class.key), False
+        dicts_before = self._copy_written_dicts(plugin) if fingerprint is not None else None
+
+        logger.debug("running plugin '%s'", plugin.name)
+        start_time = datetime.datetime.now()
+        usage_before = self.get_resource_usage()
+
+        plugin_response = None
+        skip_response = False
+        try:
+            plugin_instance = self.create_instance_from_plugin(plugin.plugin_class,
+                                                               plugin.conf)
+            self.save_plugin_timestamp(plugin.plugin_class.key, start_time)
+            plugin_instance.deadline = Deadline(plugin.timeout, parent=self.deadline)
+            with self.watch_plugin(plugin.plugin_class.key):
+                plugin_response = self._call_plugin(plugin, plugin_instance)
+            plugin_successful = True
+            if buildstep_phase:
+                assert isinstance(plugin_response, atomic_reactor.inner.BuildResult)
+                if plugin_response.is_failed():
+                    logger.error("Build step plugin %s failed: %s",
+                                 plugin.plugin_class.key,
+                                 plugin_response.fail_reason)
+                    self.on_plugin_failed(plugin.plugin_class.key,
+                                          plugin_response.fail_reason)
+                    plugin_successful = False
+                    self.plugins_results[plugin.plugin_class.key] = plugin_response
+                    return plugin_successful, plugin_response, True
+
+        except InappropriateBuildStepError:
+            logger.debug('Build step %s is not appropriate', plugin.plugin_class.key)
+            # don't put None, in results for InappropriateBuildStepError
+            skip_response = True
+            if not buildstep_phase:
+                raise
+        except Exception as ex:
+            msg = "plugin '%s' raised an exception: %s" % (plugin.plugin_class.key,
+                                                           exception_message(ex))
+            logger.debug(traceback.format_exc())
+            if not plugin.is_allowed_to_fail:
+                self.on_plugin_failed(plugin.plugin_class.key, ex)
+
+            if plugin.is_allowed_to_fail or keep_going:
+                logger.warning(msg)
+                logger.info("error is not fatal, continuing...")
+                if not plugin.is_allowed_to_fail:
+                    failed_msgs.append(msg)
+            else:
+                logger.error(msg)
+                raise PluginFailedException(msg) from ex
+
+            plugin_response = ex
+
+        try:
+            if start_time:
+                finish_time = datetime.datetime.now()
+                duration = finish_time - start_time
+                seconds = duration.total_seconds()
+                logger.debug("plugin '%s' finished in %ds", plugin.name, seconds)
+                self.save_plugin_duration(plugin.plugin_class.key, seconds)
+        except Exception:
+            logger.exception("failed to save plugin duration")
+
+        try:
+            # when plugins run concurrently, the usage of the other plugins
+            # running at the same time is included
+            resource_usage = resources.get_resource_usage_delta(usage_before,
+                                                                self.get_resource_usage())
+            self.save_plugin_resources(plugin.plugin_class.key, resource_usage)
+        except Exception:
+            logger.exception("failed to save plugin resource usage")
+
+        if not skip_response:
+            self.plugins_results[plugin.plugin_class.key] = plugin_response
+
+        if fingerprint is not None and plugin_successful:
+            try:
+                self.save_plugin_checkpoint(plugin, fingerprint, plugin_response, dicts_before)
+            except Exception:
+                logger.exception("failed to save checkpoint of plugin '%s'", plugin.name)
+
+        return plugin_successful, plugin_response, False
+
+    def _run_concurrently(self, failed_msgs, keep_going=False):
+        """
+        run all requested plugins, independent plugins in parallel
+
+        Plugins are started in the requested order as soon as all plugins they
+        depend on have finished. After a fatal failure no more plugins are
+        started; the plugins already running are waited for and the failure is
+        then raised.
+
+        :param failed_msgs: list, messages of failed plugins which are
+                            not allowed to fail are appended to it
+        :param keep_going: bool, whether to keep going after unexpected failure
+        """
+        plugins = self.available_plugins
+        dependencies = self.get_plugin_dependencies()
+        pending = list(range(len(plugins)))
+        finished = set()
+        running = {}
+        fatal_exc = None
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                      thread_name_prefix='plugin')
+        try:
+            while pending or running:
+                if fatal_exc is None:
+                    for i in list(pending):
+                        if len(running) >= self.max_workers:
+                            break
+                        if dependencies[i] <= finished:
+                            pending.remove(i)
+                            future = executor.submit(self._run_plugin, plugins[i],
+                                                     failed_msgs, keep_going=keep_going)
+                            running[future] = i
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished.add(running.pop(future))
+                    exc = future.exception()
+                    if exc is not None and fatal_exc is None:
+                        fatal_exc = exc
+        finally:
+            # don't block on plugins still running when interrupted, e.g. on cancellation
+            executor.shutdown(wait=not running)
+
+        if fatal_exc is not None:
+            raise fatal_exc
+
     def run(self, keep_going=False, buildstep_phase=False):
         """
         run all requested plugins
@@ -264,74 +854,24 @@ class PluginsRunner(object):
         failed_msgs = []
         plugin_successful = False
         plugin_response = None
-        available_plugins = self.available_plugins
-        for plugin in available_plugins:
-            plugin_successful = False
-
-            logger.debug("running plugin '%s'", plugin.name)
-            start_time = datetime.datetime.now()
-
-            plugin_response = None
-            skip_response = False
-            try:
-                plugin_instance = self.create_instance_from_plugin(plugin.plugin_class,
-                                                                   plugin.conf)
-                self.save_plugin_timestamp(plugin.plugin_class.key, start_time)
-                plugin_response = plugin_instance.run()
-                plugin_successful = True
-                if buildstep_phase:
-                    assert isinstance(plugin_response, atomic_reactor.inner.BuildResult)
-                    if plugin_response.is_failed():
-                        logger.error("Build step plugin %s failed: %s",
-                                     plugin.plugin_class.key,
-                                     plugin_response.fail_reason)
-                        self.on_plugin_failed(plugin.plugin_class.key,
-                                              plugin_response.fail_reason)
-                        plugin_successful = False
-                        self.plugins_results[plugin.plugin_class.key] = plugin_response
+        try:
+            if self.max_workers > 1 and not buildstep_phase:
+                self._run_concurrently(failed_msgs, keep_going=keep_going)
+            else:
+                for plugin in self.available_plugins:
+                    plugin_successful, plugin_response, build_failed = self._run_plugin(
+                        plugin, failed_msgs, keep_going=keep_going,
+                        buildstep_phase=buildstep_phase
+                    )
+                    if build_failed:
                         break
 
-            except InappropriateBuildStepError:
-                logger.debug('Build step %s is not appropriate', plugin.plugin_class.key)
-                # don't put None, in results for InappropriateBuildStepError
-                skip_response = True
-                if not buildstep_phase:
-                    raise
-            except Exception as ex:
-                msg = "plugin '%s' raised an exception: %s" % (plugin.plugin_class.key,
-                                                               exception_message(ex))
-                logger.debug(traceback.format_exc())
-                if not plugin.is_allowed_to_fail:
-                    self.on_plugin_failed(plugin.plugin_class.key, ex)
-
-                if plugin.is_allowed_to_fail or keep_going:
-                    logger.warning(msg)
-                    logger.info("error is not fatal, continuing...")
-                    if not plugin.is_allowed_to_fail:
-                        failed_msgs.append(msg)
-                else:
-                    logger.error(msg)
-                    raise PluginFailedException(msg) from ex
-
-                plugin_response = ex
-
-            try:
-                if start_time:
-                    finish_time = datetime.datetime.now()
-                    duration = finish_time - start_time
-                    seconds = duration.total_seconds()
-                    logger.debug("plugin '%s' finished in %ds", plugin.name, seconds)
-                    self.save_plugin_duration(plugin.plugin_class.key, seconds)
-            except Exception:
-                logger.exception("failed to save plugin duration")
-
-            if not skip_response:
-                self.plugins_results[plugin.plugin_class.key] = plugin_response
-
-            if plugin_successful and buildstep_phase:
-                logger.debug('stopping further execution of plugins '
-                             'after first successful plugin')
-                break
+                    if plugin_successful and buildstep_phase:
+                        logger.debug('stopping further execution of plugins '
+                                     'after first successful plugin')
+                        break
+        finally:
+            self._close_event_loop()
 
         if len(failed_msgs) == 1:
             raise PluginFailedException(failed_msgs[0])
@@ -369,6 +909,156 @@ class BuildPluginsRunner(PluginsRunner):
     def save_plugin_duration(self, plugin, duration):
         self.workflow.data.plugins_durations[plugin] = duration
 
+    def save_plugin_resources(self, plugin, resource_usage):
+        self.workflow.data.plugins_resources[plugin] = resource_usage
+
+    def get_resource_usage(self):
+        return resources.get_resource_usage(self.workflow.build_dir.path)
+
+    def profile_plugin(self, plugin):
+        context_dir = getattr(self.workflow, 'context_dir', None)
+        if context_dir is None:
+            return super(BuildPluginsRunner, self).profile_plugin(plugin)
+
+        options = profiling.get_profiling_options(
+            plugin,
+            self.workflow.conf.plugin_runner['profile'],
+            self.workflow.user_params.get('profile_plugins'),
+        )
+        if options is None:
+            return super(BuildPluginsRunner, self).profile_plugin(plugin)
+
+        return profiling.profile_plugin(plugin, context_dir.profiles_dir, options)
+
+    def watch_plugin(self, plugin):
+        fs_watcher = getattr(self.workflow, 'fs_watcher', None)
+        if fs_watcher is None:
+            return super(BuildPluginsRunner, self).watch_plugin(plugin)
+        return fs_watcher.watch_plugin(plugin)
+
+    def _get_checkpoint_path(self, plugin):
+        context_dir = getattr(self.workflow, 'context_dir', None)
+        if context_dir is None or not self.workflow.conf.plugin_runner['resume']:
+            return None
+        return context_dir.checkpoints_dir / f'{plugin.plugin_class.key}.json'
+
+    def get_plugin_fingerprint(self, plugin):
+        """
+        compute a fingerprint of the inputs of a resumable plugin about to run
+
+        The inputs are the plugin configuration, user params, reactor config and
+        the workflow data the plugin declares to read. Anything else the plugin
+        depends on has to be determined by these, e.g. the source files are
+        determined by the git ref in the user params.
+        """
+        if not plugin.plugin_class.resumable or self._get_checkpoint_path(plugin) is None:
+            return None
+        accesses = self._get_plugin_accesses(plugin)
+        if accesses is None:
+            logger.warning("plugin '%s' is resumable but does not declare the data it reads "
+                           "and writes, not checkpointing it", plugin.name)
+            return None
+
+        reads, _ = accesses
+        inputs = {
+            'plugin': plugin.plugin_class.key,
+            'args': plugin.conf,
+            'user_params': self.workflow.user_params,
+            'reactor_config': self.workflow.conf.conf,
+            'data': {name: _get_data_item(self.workflow.data, name)
+                     for name in reads if _is_data_item(name)},
+        }
+        try:
+            serialized = json.dumps(inputs, sort_keys=True,
+                                    cls=atomic_reactor.inner.WorkflowDataEncoder)
+        except (TypeError, ValueError) as e:
+            logger.warning("cannot compute fingerprint of plugin '%s': %s", plugin.name, e)
+            return None
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def restore_plugin_checkpoint(self, plugin, fingerprint):
+        path = self._get_checkpoint_path(plugin)
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f, object_hook=atomic_reactor.inner.WorkflowDataDecoder())
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            logger.warning("ignoring invalid checkpoint %s: %s", path, e)
+            return False
+
+        if checkpoint['fingerprint'] != fingerprint:
+            logger.info("inputs of plugin '%s' changed since its checkpoint was saved",
+                        plugin.name)
+            return False
+
+        for name, value in checkpoint['writes'].items():
+            _set_data_item(self.workflow.data, name, value)
+        # dicts may have been updated by other plugins in this attempt already,
+        # only the items changed by the plugin are restored
+        for name, changes in checkpoint['dict_changes'].items():
+            target = _get_data_item(self.workflow.data, name)
+            if not isinstance(target, dict):
+                target = {}
+                _set_data_item(self.workflow.data, name, target)
+            for key in changes['removed']:
+                target.pop(key, None)
+            target.update(changes['set'])
+        self.plugins_results[plugin.plugin_class.key] = checkpoint['result']
+        return True
+
+    def _copy_written_dicts(self, plugin):
+        """
+        copy the dict-valued workflow data a plugin declares to write
+
+        :return: dict, name -> shallow copy of the value
+        """
+        copies = {}
+        for name in plugin.plugin_class.writes:
+            if _is_data_item(name):
+                value = _get_data_item(self.workflow.data, name)
+                if isinstance(value, dict):
+                    copies[name] = dict(value)
+        return copies
+
+    def save_plugin_checkpoint(self, plugin, fingerprint, plugin_response, dicts_before):
+        """
+        save the result of a plugin and the workflow data it wrote
+
+        :param dicts_before: dict, the dict-valued data the plugin declares to write
+                             as it was before the plugin was run, see _copy_written_dicts;
+                             only the items the plugin changed in them are saved
+        """
+        path = self._get_checkpoint_path(plugin)
+        writes = {}
+        dict_changes = {}
+        for name in plugin.plugin_class.writes:
+            if not _is_data_item(name):
+                continue
+            value = _get_data_item(self.workflow.data, name)
+            before = dicts_before.get(name)
+            if before is not None and isinstance(value, dict):
+                dict_changes[name] = {
+                    'set': {key: item for key, item in value.items()
+                            if key not in before or before[key] != item},
+                    'removed': [key for key in before if key not in value],
+                }
+            else:
+                writes[name] = value
+        checkpoint = {
+            'fingerprint': fingerprint,
+            'result': plugin_response,
+            'writes': writes,
+            'dict_changes': dict_changes,
+        }
+        serialized = json.dumps(checkpoint, cls=atomic_reactor.inner.WorkflowDataEncoder)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write the checkpoint atomically, the task may be killed at any time
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(serialized)
+        os.replace(tmp_path, path)
+
     def _translate_special_values(self, obj_to_translate):
         """
         you may want to write plugins for values which are not known before build:
@@ -431,6 +1121,8 @@ class PreBuildPlugin(BuildPlugin):
 
 class PreBuildPluginsRunner(BuildPluginsRunner):
 
+    results_field = 'prebuild_results'
+
     def __init__(self, workflow, plugins_conf, *args, **kwargs):
         logger.info("initializing runner of pre-build plugins")
         self.plugins_results = workflow.data.prebuild_results
@@ -444,6 +1136,8 @@ class BuildStepPlugin(BuildPlugin):
 
 class BuildStepPluginsRunner(BuildPluginsRunner):
 
+    results_field = 'buildstep_result'
+
     def __init__(self, workflow, plugin_conf, *args, **kwargs):
         logger.info("initializing runner of build-step plugin")
         self.plugins_results = workflow.data.buildstep_result
@@ -478,6 +1172,8 @@ class PrePublishPlugin(BuildPlugin):
 
 class PrePublishPluginsRunner(BuildPluginsRunner):
 
+    results_field = 'prepub_results'
+
     def __init__(self, workflow, plugins_conf, *args, **kwargs):
         logger.info("initializing runner of pre-publish plugins")
         self.plugins_results = workflow.data.prepub_results
@@ -491,6 +1187,8 @@ class PostBuildPlugin(BuildPlugin):
 
 class PostBuildPluginsRunner(BuildPluginsRunner):
 
+    results_field = 'postbuild_results'
+
     def __init__(self, workflow, plugins_conf, *args, **kwargs):
         logger.info("initializing runner of post-build plugins")
         self.plugins_results = workflow.data.postbuild_results
@@ -512,6 +1210,9 @@ class ExitPlugin(PostBuildPlugin):
 
 
 class ExitPluginsRunner(BuildPluginsRunner):
+
+    results_field = 'exit_results'
+
     def __init__(self, workflow, plugins_conf, *args, **kwargs):
         logger.info("initializing runner of exit plugins")
         self.plugins_results = workflow.data.exit_results
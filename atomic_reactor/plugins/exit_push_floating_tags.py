@@ -9,7 +9,7 @@ of the BSD license. See the LICENSE file for details.
 from atomic_reactor.constants import PLUGIN_PUSH_FLOATING_TAGS_KEY, PLUGIN_GROUP_MANIFESTS_KEY
 from atomic_reactor.utils.manifest import ManifestUtil
 from atomic_reactor.plugin import ExitPlugin
-from atomic_reactor.util import get_floating_images, get_unique_images
+from atomic_reactor.util import get_floating_images, get_unique_images, map_images_concurrently
 
 
 class PushFloatingTagsPlugin(ExitPlugin):
@@ -19,6 +19,8 @@ class PushFloatingTagsPlugin(ExitPlugin):
 
     key = PLUGIN_PUSH_FLOATING_TAGS_KEY
     is_allowed_to_fail = False
+    # attempts to push each floating tag
+    max_tries = 2
 
     def __init__(self, workflow):
         """
@@ -34,14 +36,34 @@ class PushFloatingTagsPlugin(ExitPlugin):
         manifest = manifest_list_data.get("manifest")
         manifest_digest = manifest_list_data.get("manifest_digest")
 
-        for image in floating_images:
+        def push_tag(image):
+            # group_manifests already stored the referenced manifests and blobs in
+            # the repositories, only the tag has to be uploaded
             target_repo = image.to_str(registry=False, tag=False)
-            # We have to call store_manifest_in_repository directly for each
-            # referenced manifest, since each one should be a new tag that requires uploading
-            # the manifest again
             self.log.debug("storing %s as %s", target_repo, image.tag)
-            self.manifest_util.store_manifest_in_repository(session, manifest, list_type,
-                                                            target_repo, target_repo, ref=image.tag)
+            self.manifest_util.put_manifest(session, manifest, list_type, target_repo, image.tag)
+
+        # the tags are independent of each other, push them concurrently and retry
+        # the failed ones, on top of the retries of the requests themselves
+        results = {}
+        pending = list(floating_images)
+        for attempt in range(1, self.max_tries + 1):
+            results.update(map_images_concurrently(push_tag, pending))
+            pending = [image for image in pending
+                       if isinstance(results[image.to_str()], Exception)]
+            if not pending or attempt == self.max_tries:
+                break
+            self.log.warning("Failed to push floating tags, retrying: %s",
+                             ", ".join(image.to_str() for image in pending))
+
+        failures = {image: result for image, result in results.items()
+                    if isinstance(result, Exception)}
+        if failures:
+            for image, error in sorted(failures.items()):
+                self.log.error("Failed to push floating tag %s: %s", image, error)
+            raise RuntimeError("Failed to push {} of {} floating tags: {}"
+                               .format(len(failures), len(results),
+                                       ", ".join(sorted(failures))))
 
         registry_image = get_unique_images(self.workflow)[0]
 
@@ -74,6 +96,7 @@ class PushFloatingTagsPlugin(ExitPlugin):
         digests = dict()
 
         session = self.manifest_util.get_registry_session()
+        session.prefetch_tokens(image.to_str(registry=False, tag=False) for image in floating_tags)
         repo, digest = self.add_floating_tags(session, manifest_data, floating_tags)
         digests[repo] = digest
 
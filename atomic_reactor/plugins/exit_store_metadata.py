@@ -126,6 +126,7 @@ class StoreMetadataPlugin(ExitPlugin):
             "errors": wf_data.plugins_errors,
             "timestamps": wf_data.plugins_timestamps,
             "durations": wf_data.plugins_durations,
+            "resources": wf_data.plugins_resources,
         }
 
     def get_filesystem_metadata(self):
@@ -13,7 +13,8 @@ import os
 from atomic_reactor.constants import (EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE,
                                       IMAGE_TYPE_DOCKER_ARCHIVE)
 from atomic_reactor.plugin import PostBuildPlugin
-from atomic_reactor.util import get_exported_image_metadata, human_size, is_scratch_build
+from atomic_reactor.util import (HashingWriter, get_exported_image_metadata, human_size,
+                                 is_scratch_build)
 
 
 class CompressPlugin(PostBuildPlugin):
@@ -51,20 +52,27 @@ class CompressPlugin(PostBuildPlugin):
                                EXPORTED_COMPRESSED_IMAGE_NAME_TEMPLATE)
         if self.method == 'gzip':
             outfile = outfile.format('gz')
-            fp = gzip.open(outfile, 'wb', compresslevel=6)
         elif self.method == 'lzma':
             outfile = outfile.format('xz')
-            fp = lzma.open(outfile, 'wb')
         else:
             raise RuntimeError('Unsupported compression format {0}'.format(self.method))
 
         _chunk_size = 1024**2  # 1 MB chunk size for reading/writing
         self.log.info('compressing image %s to %s using %s method',
                       self.workflow.image, outfile, self.method)
-        data = stream.read(_chunk_size)
-        while data != b'':
-            fp.write(data)
-            data = stream.read(_chunk_size)
+        with open(outfile, 'wb') as f:
+            # the compressed image is hashed as it is written, for its metadata
+            writer = HashingWriter(f)
+            if self.method == 'gzip':
+                fp = gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=6)
+            else:
+                fp = lzma.LZMAFile(writer, 'wb')
+            with fp:
+                data = stream.read(_chunk_size)
+                while data != b'':
+                    fp.write(data)
+                    data = stream.read(_chunk_size)
+        writer.remember(outfile)
 
         self.uncompressed_size = stream.tell()
 
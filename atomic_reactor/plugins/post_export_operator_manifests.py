@@ -15,6 +15,7 @@ from atomic_reactor.constants import (PLUGIN_EXPORT_OPERATOR_MANIFESTS_KEY,
                                       OPERATOR_MANIFESTS_ARCHIVE)
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.util import (
+    HashingWriter,
     has_operator_appregistry_manifest,
     has_operator_bundle_manifest,
     map_to_user_params,
@@ -122,17 +123,22 @@ class ExportOperatorManifestsPlugin(PostBuildPlugin):
             self._verify_csv(manifests_path)
 
         manifests_zipfile_path = os.path.join(manifests_archive_dir, OPERATOR_MANIFESTS_ARCHIVE)
-        with zipfile.ZipFile(manifests_zipfile_path, 'w') as archive:
-            for root, _, files in os.walk(manifests_path):
-                for f in files:
-                    filedir = os.path.relpath(root, manifests_path)
-                    filepath = os.path.join(filedir, f)
-                    archive.write(os.path.join(root, f), filepath, zipfile.ZIP_DEFLATED)
-            manifest_files = archive.namelist()
-            if not manifest_files:
-                self.log.error('Empty operator manifests directory')
-                raise RuntimeError('Empty operator manifests directory')
-            self.log.debug("Archiving operator manifests: %s", manifest_files)
+        with open(manifests_zipfile_path, 'wb') as zip_file:
+            # the archive is hashed as it is written, for its koji metadata; the zip
+            # file is written as a stream, the writer cannot seek back
+            writer = HashingWriter(zip_file, ['md5'])
+            with zipfile.ZipFile(writer, 'w') as archive:
+                for root, _, files in os.walk(manifests_path):
+                    for f in files:
+                        filedir = os.path.relpath(root, manifests_path)
+                        filepath = os.path.join(filedir, f)
+                        archive.write(os.path.join(root, f), filepath, zipfile.ZIP_DEFLATED)
+                manifest_files = archive.namelist()
+                if not manifest_files:
+                    self.log.error('Empty operator manifests directory')
+                    raise RuntimeError('Empty operator manifests directory')
+                self.log.debug("Archiving operator manifests: %s", manifest_files)
+        writer.remember(manifests_zipfile_path)
 
         shutil.rmtree(manifests_path)
 
@@ -16,7 +16,7 @@ from atomic_reactor import util
 from atomic_reactor.constants import (KOJI_BTYPE_REMOTE_SOURCE_FILE,
                                       PLUGIN_GENERATE_MAVEN_METADATA_KEY)
 from atomic_reactor.config import get_koji_session
-from atomic_reactor.download import download_url
+from atomic_reactor.download import Download, download_urls
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.utils.koji import NvrRequest
 
@@ -133,7 +133,8 @@ class GenerateMavenMetadataPlugin(PostBuildPlugin):
         koji_config = self.workflow.conf.koji
         insecure = koji_config.get('insecure_download', False)
 
-        for index, download in enumerate(download_queue):
+        downloads = []
+        for download in download_queue:
             dest_filename = download.dest
             if not re.fullmatch(r'^[\w\-.]+$', dest_filename):
                 dest_filename = session.head(download.url).headers.get(
@@ -145,21 +146,22 @@ class GenerateMavenMetadataPlugin(PostBuildPlugin):
             if not os.path.exists(dest_dir):
                 os.makedirs(dest_dir)
 
-            self.log.debug('%d/%d downloading %s', index + 1, len(download_queue),
-                           download.url)
+            downloads.append(Download(download.url, dest_dir, dest_filename=dest_filename,
+                                      expected_checksums=download.checksums))
 
-            download_url(url=download.url, dest_dir=dest_dir, insecure=insecure,
-                         session=session, dest_filename=dest_filename,
-                         expected_checksums=download.checksums)
+        dest_paths = download_urls(downloads, insecure=insecure, session=session,
+                                   cache=self.workflow.artifact_cache)
 
-            checksum_type = list(download.checksums.keys())[0]
+        for download, dest_path in zip(downloads, dest_paths):
+            dest_filename = download.dest_filename
+            checksum_type = list(download.expected_checksums.keys())[0]
 
             remote_source_files.append({
                 'file': dest_path,
                 'metadata': {
                     'type': KOJI_BTYPE_REMOTE_SOURCE_FILE,
                     'checksum_type': checksum_type,
-                    'checksum': download.checksums[checksum_type],
+                    'checksum': download.expected_checksums[checksum_type],
                     'filename': dest_filename,
                     'filesize': os.path.getsize(dest_path),
                     'extra': {
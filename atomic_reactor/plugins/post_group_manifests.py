@@ -80,10 +80,12 @@ class GroupManifestsPlugin(PostBuildPlugin):
         # Now push the manifest list to the registry once per each tag
         self.log.info("%s: Tagging manifest list", session.registry)
 
-        for image in self.non_floating_images:
-            target_repo = image.to_str(registry=False, tag=False)
-            # We have to call store_manifest_in_repository directly for each
-            # referenced manifest, since they potentially come from different repos
+        # The referenced manifests are stored only once into each repository, not once
+        # per tag. We have to call store_manifest_in_repository directly for each
+        # referenced manifest, since they potentially come from different repos
+        target_repos = dict.fromkeys(image.to_str(registry=False, tag=False)
+                                     for image in self.non_floating_images)
+        for target_repo in target_repos:
             for manifest in manifests:
                 self.manifest_util.store_manifest_in_repository(session,
                                                                 manifest['content'],
@@ -91,8 +93,8 @@ class GroupManifestsPlugin(PostBuildPlugin):
                                                                 manifest['repository'],
                                                                 target_repo,
                                                                 ref=manifest['digest'])
-            self.manifest_util.store_manifest_in_repository(session, list_json, list_type,
-                                                            target_repo, target_repo, ref=image.tag)
+        self.manifest_util.tag_manifest_in_repositories(session, list_json, list_type,
+                                                        self.non_floating_images)
         # Get the digest of the manifest list using one of the tags
         registry_image = get_unique_images(self.workflow)[0]
         _, digest_str, _, _ = self.manifest_util.get_manifest(session,
@@ -147,6 +149,11 @@ class GroupManifestsPlugin(PostBuildPlugin):
 
         for _, source in self.sort_annotations().items():
             session = self.manifest_util.get_registry_session()
+            # one token for all the repositories involved, rather than one per repository
+            session.prefetch_tokens(
+                [worker_image['repository'] for worker_image in source.values()] +
+                [image.to_str(registry=False, tag=False) for image in self.non_floating_images]
+            )
 
             if self.group:
                 return self.group_manifests_and_tag(session, source)
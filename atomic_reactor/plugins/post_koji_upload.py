@@ -13,7 +13,7 @@ from tempfile import NamedTemporaryFile
 from atomic_reactor.plugin import PostBuildPlugin
 from atomic_reactor.constants import PLUGIN_KOJI_UPLOAD_PLUGIN_KEY
 from atomic_reactor.config import get_koji_session, get_openshift_session
-from atomic_reactor.util import is_scratch_build, map_to_user_params
+from atomic_reactor.util import HashingWriter, is_scratch_build, map_to_user_params
 from atomic_reactor.utils.koji import get_buildroot, get_output, get_output_metadata
 
 # An output file and its metadata
@@ -98,8 +98,10 @@ class KojiUploadPlugin(PostBuildPlugin):
         build_logs = NamedTemporaryFile(prefix="buildstep-%s" % self.build_id,
                                         suffix=".log",
                                         mode='wb')
-        build_logs.write("\n".join(self.workflow.data.build_result.logs).encode('utf-8'))
-        build_logs.flush()
+        writer = HashingWriter(build_logs, ['md5'])
+        writer.write("\n".join(self.workflow.data.build_result.logs).encode('utf-8'))
+        writer.flush()
+        writer.remember(build_logs.name)
         filename = "{platform}-build.log".format(platform=self.platform)
         return [Output(file=build_logs,
                        metadata=get_output_metadata(build_logs.name, filename))]
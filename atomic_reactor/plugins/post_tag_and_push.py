@@ -194,8 +194,12 @@ class TagAndPushPlugin(PostBuildPlugin):
 
                     wf_data.koji_source_manifest = koji_source_manifest_response.json()
 
+                # only whether the pushed manifest is stored is checked, a single
+                # HEAD request gets its digest
                 digests = get_manifest_digests(registry_image, self.registry['uri'],
-                                               insecure, docker_push_secret)
+                                               insecure, docker_push_secret,
+                                               versions=('v2', 'oci'), require_digest=False,
+                                               single_request=True)
 
                 if not (digests.v2 or digests.oci) and (retry < max_retries):
                     sleep_time = DOCKER_PUSH_BACKOFF_FACTOR * (2 ** retry)
@@ -19,8 +19,8 @@ from atomic_reactor.constants import (PLUGIN_FETCH_MAVEN_KEY,
                                       REPO_FETCH_ARTIFACTS_KOJI)
 from atomic_reactor.config import get_koji_session
 from atomic_reactor.dirs import BuildDir
-from atomic_reactor.download import download_url
-from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.download import Download, download_urls
+from atomic_reactor.plugin import BUILD_DIRS, SOURCE_FILES, PreBuildPlugin
 from atomic_reactor.utils.koji import NvrRequest
 from atomic_reactor.utils.pnc import PNCUtil
 
@@ -40,6 +40,9 @@ class DownloadRequest:
 class FetchMavenArtifactsPlugin(PreBuildPlugin):
     key = PLUGIN_FETCH_MAVEN_KEY
     is_allowed_to_fail = False
+    reads = (SOURCE_FILES,)
+    writes = (BUILD_DIRS,)
+    resumable = True
 
     DOWNLOAD_DIR = 'artifacts'
 
@@ -158,22 +161,21 @@ class FetchMavenArtifactsPlugin(PreBuildPlugin):
         insecure = koji_config.get('insecure_download', False)
 
         self.log.debug('%d files to download', len(downloads))
-        session = util.get_retrying_requests_session()
 
-        for index, download in enumerate(downloads):
+        batch = []
+        for download in downloads:
             dest_path = artifacts_path / download.dest
             dest_dir = dest_path.parent
-            dest_filename = dest_path.name
 
             if not dest_dir.exists():
                 dest_dir.mkdir(parents=True)
 
-            self.log.debug('%d/%d downloading %s', index + 1, len(downloads),
-                           download.url)
+            batch.append(Download(download.url, dest_dir, dest_filename=dest_path.name,
+                                  expected_checksums=download.checksums))
 
-            download_url(url=download.url, dest_dir=dest_dir, insecure=insecure, session=session,
-                         dest_filename=dest_filename, expected_checksums=download.checksums)
-            yield dest_path
+        download_urls(batch, insecure=insecure, cache=self.workflow.artifact_cache)
+        for download in downloads:
+            yield artifacts_path / download.dest
 
     def run(self):
         self.session = get_koji_session(self.workflow.conf)
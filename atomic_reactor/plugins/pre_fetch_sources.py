@@ -20,7 +20,7 @@ from atomic_reactor.config import get_koji_session
 from atomic_reactor.plugin import PreBuildPlugin
 from atomic_reactor.source import GitSource
 from atomic_reactor.util import get_retrying_requests_session, map_to_user_params
-from atomic_reactor.download import download_url
+from atomic_reactor.download import Download, download_urls
 from atomic_reactor.metadata import label_map
 from atomic_reactor.utils.pnc import PNCUtil
 
@@ -138,14 +138,14 @@ class FetchSourcesPlugin(PreBuildPlugin):
         dest_dir: Path = self.workflow.build_dir.source_container_sources_dir / download_dir
         dest_dir.mkdir(parents=True, exist_ok=True)
 
-        req_session = get_retrying_requests_session()
+        downloads = []
         for source in sources:
             subdir: Path = dest_dir / source.get('subdir', '')
             subdir.mkdir(parents=True, exist_ok=True)
             checksums = source.get('checksums', {})
-            download_url(source['url'], subdir, insecure=insecure,
-                         session=req_session, dest_filename=source.get('dest'),
-                         expected_checksums=checksums)
+            downloads.append(Download(source['url'], subdir, dest_filename=source.get('dest'),
+                                      expected_checksums=checksums))
+        download_urls(downloads, insecure=insecure, cache=self.workflow.artifact_cache)
 
         return str(dest_dir)
 
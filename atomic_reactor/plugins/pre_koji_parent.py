@@ -9,7 +9,7 @@ from typing import Any, Dict, Optional
 from atomic_reactor.plugin import PreBuildPlugin
 from atomic_reactor.constants import (
     INSPECT_CONFIG, PLUGIN_KOJI_PARENT_KEY, BASE_IMAGE_KOJI_BUILD, PARENT_IMAGES_KOJI_BUILDS,
-    KOJI_BTYPE_IMAGE
+    KOJI_BTYPE_IMAGE, PLUGIN_CHECK_AND_SET_PLATFORMS_KEY
 )
 from atomic_reactor.config import get_koji_session
 from atomic_reactor.util import (
@@ -50,6 +50,13 @@ class KojiParentPlugin(PreBuildPlugin):
 
     key = PLUGIN_KOJI_PARENT_KEY
     is_allowed_to_fail = False
+    reads = (
+        'dockerfile_images',
+        'parent_images_digests',
+        f'prebuild_results.{PLUGIN_CHECK_AND_SET_PLATFORMS_KEY}',
+    )
+    writes = ()
+    resumable = True
 
     def __init__(self, workflow, poll_interval=DEFAULT_POLL_INTERVAL,
                  poll_timeout=DEFAULT_POLL_TIMEOUT):
@@ -87,6 +94,12 @@ class KojiParentPlugin(PreBuildPlugin):
                 inspect_data=self.workflow.imageutil.base_image_inspect(),
             )
 
+        # Inspect all parent images at once, detect_parent_image_nvr gets the cached results
+        self.workflow.imageutil.get_inspect_for_images(
+            local_tag for img, local_tag in df_images.items()
+            if local_tag and not base_image_is_custom(img.to_str())
+        )
+
         manifest_mismatches = []
         for img, local_tag in df_images.items():
             img_str = img.to_str()
@@ -298,7 +311,7 @@ class KojiParentPlugin(PreBuildPlugin):
                 elif build_state != 'BUILDING':
                     exc_msg = ('Parent image Koji build {} state is {}, not COMPLETE.')
                     raise KojiParentBuildMissing(exc_msg.format(nvr, build_state))
-            time.sleep(self.poll_interval)
+            self.deadline.sleep(self.poll_interval)
         raise KojiParentBuildMissing('Parent image Koji build NOT found for {}!'.format(nvr))
 
     def make_result(self) -> Optional[Dict[str, Any]]:
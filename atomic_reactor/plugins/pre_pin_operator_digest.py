@@ -22,6 +22,7 @@ from atomic_reactor.util import (RegistrySession,
                                  has_operator_bundle_manifest,
                                  read_yaml_from_url,
                                  terminal_key_paths,
+                                 map_images_concurrently,
                                  map_to_user_params)
 from osbs.utils.yaml import (
     load_schema,
@@ -483,6 +484,8 @@ class PinOperatorDigestsPlugin(PreBuildPlugin):
             if not replacer.registry_is_allowed(p):
                 raise RuntimeError("Registry not allowed: {} (in {})".format(p.registry, p))
 
+        replacer.prefetch(pullspecs, pin_digest=pin_digest, replace_repo=replace_repo)
+
         for original in pullspecs:
             self.log.info("Computing replacement for %s", original)
             replaced = original
@@ -577,6 +580,55 @@ class PullspecReplacer(object):
         # RegistryClient instances cached by registry name
         self.registry_clients = {}
 
+        # Results of registry queries made in advance, see prefetch
+        # Mappings of [pullspec => result, or the exception raised by the query]
+        self.prefetched_digests = {}
+        self.prefetched_inspections = {}
+
+    def prefetch(self, images, pin_digest=True, replace_repo=True):
+        """
+        Query registries for all the images concurrently
+
+        Instead of querying the registries one image at a time, pin_digest and
+        replace_repo then use the prefetched results. Errors are not raised
+        here, but by these methods when they process the image.
+
+        :param images: list of ImageName
+        :param pin_digest: bool, prefetch manifest list digests for pin_digest
+        :param replace_repo: bool, prefetch image labels for replace_repo
+        """
+        if pin_digest:
+            to_pin = [image for image in images if not image.tag.startswith("sha256:")]
+            self.log.debug("Querying registries for manifest list digests of %d images",
+                           len(to_pin))
+            self.prefetched_digests.update(map_images_concurrently(
+                lambda image: self._get_registry_client(image.registry)
+                .get_manifest_list_digest(image),
+                self._with_clients(to_pin),
+            ))
+
+        if replace_repo:
+            to_inspect = []
+            for image in images:
+                try:
+                    pinned = self.pin_digest(image) if pin_digest else image
+                    if self._needs_component_name(pinned):
+                        to_inspect.append(pinned)
+                except Exception:
+                    continue  # raised again when processing the image
+            self.log.debug("Querying registries for labels of %d images", len(to_inspect))
+            self.prefetched_inspections.update(map_images_concurrently(
+                lambda image: self._get_registry_client(image.registry)
+                .get_inspect_for_image(image),
+                self._with_clients(to_inspect),
+            ))
+
+    def _with_clients(self, images):
+        """Create registry clients for the images, clients must not be created concurrently"""
+        for image in images:
+            self._get_registry_client(image.registry)
+        return images
+
     def registry_is_allowed(self, image):
         """
         Is image registry allowed in OSBS config?
@@ -596,9 +648,13 @@ class PullspecReplacer(object):
         if image.tag.startswith("sha256:"):
             self.log.debug("%s looks like a digest, skipping query", image.tag)
             return image
-        self.log.debug("Querying %s for manifest list digest", image.registry)
-        registry_client = self._get_registry_client(image.registry)
-        digest = registry_client.get_manifest_list_digest(image)
+        digest = self.prefetched_digests.get(image.to_str())
+        if digest is None:
+            self.log.debug("Querying %s for manifest list digest", image.registry)
+            registry_client = self._get_registry_client(image.registry)
+            digest = registry_client.get_manifest_list_digest(image)
+        elif isinstance(digest, Exception):
+            raise digest
         return self._replace(image, tag=digest)
 
     def replace_registry(self, image):
@@ -622,8 +678,7 @@ class PullspecReplacer(object):
         :param image: ImageName
         :return: ImageName
         """
-        site_mapping = self._get_site_mapping(image.registry)
-        if site_mapping is None and image.registry not in self.user_package_mappings:
+        if not self._needs_component_name(image):
             self.log.debug("repo_replacements not configured for %s", image.registry)
             return image
 
@@ -645,6 +700,13 @@ class PullspecReplacer(object):
         replacement = ImageName.parse(replacements[0])
         return self._replace(image, namespace=replacement.namespace, repo=replacement.repo)
 
+    def _needs_component_name(self, image):
+        """
+        Are repo replacements configured for the registry of the image?
+        """
+        site_mapping = self._get_site_mapping(image.registry)
+        return site_mapping is not None or image.registry in self.user_package_mappings
+
     def _get_site_mapping(self, registry):
         """
         Get the package mapping file for the given registry. If said file has
@@ -666,9 +728,13 @@ class PullspecReplacer(object):
         """
         Get package for image by querying registry and looking at labels.
         """
-        self.log.debug("Querying %s for image labels", image.registry)
-        registry_client = self._get_registry_client(image.registry)
-        inspect = registry_client.get_inspect_for_image(image)
+        inspect = self.prefetched_inspections.get(image.to_str())
+        if inspect is None:
+            self.log.debug("Querying %s for image labels", image.registry)
+            registry_client = self._get_registry_client(image.registry)
+            inspect = registry_client.get_inspect_for_image(image)
+        elif isinstance(inspect, Exception):
+            raise inspect
         labels = Labels(inspect[INSPECT_CONFIG].get("Labels", {}))
 
         try:
@@ -13,10 +13,11 @@ from osbs.repo_utils import ModuleSpec
 
 from atomic_reactor import util
 from atomic_reactor.config import get_koji_session, get_odcs_session
-from atomic_reactor.constants import (PLUGIN_KOJI_PARENT_KEY,
+from atomic_reactor.constants import (PLUGIN_CHECK_AND_SET_PLATFORMS_KEY,
+                                      PLUGIN_KOJI_PARENT_KEY,
                                       PLUGIN_RESOLVE_COMPOSES_KEY,
                                       BASE_IMAGE_KOJI_BUILD)
-from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.plugin import SOURCE_FILES, PreBuildPlugin
 from atomic_reactor.util import get_platforms, is_isolated_build, is_scratch_build
 from atomic_reactor.utils.odcs import WaitComposeToFinishTimeout
 
@@ -37,6 +38,14 @@ class ResolveComposesPlugin(PreBuildPlugin):
 
     key = PLUGIN_RESOLVE_COMPOSES_KEY
     is_allowed_to_fail = False
+    reads = (
+        'dockerfile_images',
+        f'prebuild_results.{PLUGIN_CHECK_AND_SET_PLATFORMS_KEY}',
+        f'prebuild_results.{PLUGIN_KOJI_PARENT_KEY}',
+        SOURCE_FILES,
+    )
+    writes = ('all_yum_repourls',)
+    resumable = True
 
     args_from_user_params = util.map_to_user_params(
         "koji_target",
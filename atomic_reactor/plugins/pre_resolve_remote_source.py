@@ -25,7 +25,7 @@ from atomic_reactor.constants import (
     REMOTE_SOURCE_TARBALL_FILENAME,
 )
 from atomic_reactor.dirs import BuildDir
-from atomic_reactor.plugin import PreBuildPlugin
+from atomic_reactor.plugin import BUILD_DIRS, SOURCE_FILES, PreBuildPlugin
 from atomic_reactor.util import is_scratch_build, map_to_user_params
 from atomic_reactor.utils.cachito import CFG_TYPE_B64
 from atomic_reactor.utils.koji import get_koji_task_owner
@@ -73,6 +73,9 @@ class ResolveRemoteSourcePlugin(PreBuildPlugin):
 
     key = PLUGIN_RESOLVE_REMOTE_SOURCE
     is_allowed_to_fail = False
+    reads = (SOURCE_FILES,)
+    writes = ('buildargs', BUILD_DIRS)
+    resumable = True
     REMOTE_SOURCE = "unpacked_remote_sources"
 
     args_from_user_params = map_to_user_params("dependency_replacements")
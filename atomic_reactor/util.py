@@ -7,9 +7,11 @@ of the BSD license. See the LICENSE file for details.
 """
 
 import _hashlib
+import functools
 import hashlib
 from itertools import chain
 import json
+import jsonschema
 import io
 import os
 import re
@@ -17,7 +19,9 @@ import requests
 from requests.exceptions import SSLError, HTTPError, RetryError
 import shutil
 import tempfile
-from typing import Any, Final, Iterator, Sequence, Dict, Union, List, BinaryIO, Tuple, Optional
+import threading
+from typing import (Any, Final, Iterable, Iterator, Sequence, Dict, Union, List, BinaryIO, Tuple,
+                    Optional)
 import logging
 import uuid
 import yaml
@@ -25,6 +29,7 @@ import string
 import signal
 import tarfile
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from base64 import b64decode
 from typing import Callable
@@ -47,10 +52,13 @@ from atomic_reactor.constants import (DOCKERFILE_FILENAME, REPO_CONTAINER_CONFIG
                                       REPO_CONTENT_SETS_CONFIG,
                                       REPO_FETCH_ARTIFACTS_URL,
                                       REPO_FETCH_ARTIFACTS_PNC,
-                                      USER_CONFIG_FILES, REPO_FETCH_ARTIFACTS_KOJI)
+                                      USER_CONFIG_FILES, REPO_FETCH_ARTIFACTS_KOJI,
+                                      REGISTRY_MAX_CONCURRENT_REQUESTS,
+                                      REGISTRY_POOL_MAXSIZE)
 
-from atomic_reactor.auth import HTTPRegistryAuth
+from atomic_reactor.auth import HTTPRegistryAuth, get_credentials_id
 from atomic_reactor.types import ISerializer, ImageInspectionData
+from atomic_reactor.utils.registry_cache import RegistryCache, manifest_revalidation_cache
 
 from dockerfile_parse import DockerfileParser
 
@@ -355,54 +363,186 @@ def _process_plugin_substitution(mapping, key_parts, value):
                            (plugin_name, plugins_num))
 
 
+# hash algorithms get_checksums supports, variable-length ones need a length
+CHECKSUM_ALGORITHMS = sorted(algo for algo in hashlib.algorithms_guaranteed
+                             if not algo.startswith('shake_'))
+# block size used to read the files to hash
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+# Checksums of the files hashed by get_checksums, many callers hash the same files:
+# (path, inode, size, mtime) -> {algorithm: hexdigest}
+_checksums_cache: Dict[Tuple[str, int, int, int], Dict[str, str]] = {}
+_checksums_cache_lock = threading.Lock()
+_CHECKSUMS_CACHE_SIZE = 128
+
+
+def _checksums_cache_key(path: str) -> Tuple[str, int, int, int]:
+    stat = os.stat(path)
+    return os.path.realpath(path), stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _remember_checksums(cache_key: Tuple[str, int, int, int], checksums: Dict[str, str]) -> None:
+    with _checksums_cache_lock:
+        known = _checksums_cache.pop(cache_key, {})
+        known.update(checksums)
+        _checksums_cache[cache_key] = known
+        while len(_checksums_cache) > _CHECKSUMS_CACHE_SIZE:
+            del _checksums_cache[next(iter(_checksums_cache))]
+
+
 def _compute_checksums(
-    fd: BinaryIO, hash_objs: List[_hashlib.HASH], blocksize: int = 65536
+    fd: BinaryIO, hash_objs: List[_hashlib.HASH], blocksize: int = CHECKSUM_BLOCK_SIZE
 ) -> None:
     """
-    Compute file checksums in given hash objects.
+    Compute file checksums in given hash objects, reading the file only once.
+
+    Blocks are read into a reusable buffer. When computing several checksums
+    of a file larger than a block, each hash object is updated on its own
+    thread, hashlib releases the GIL while hashing.
 
     :param fd: file-like object
     :param hash_objs: list, hashlib hash objects for each algorithm to be calculated
     :param blocksize: block size used to read fd
     """
-    buf = fd.read(blocksize)
-    while len(buf) > 0:
-        for hash_object in hash_objs:
-            hash_object.update(buf)
+    if not hasattr(fd, 'readinto'):
         buf = fd.read(blocksize)
+        while len(buf) > 0:
+            for hash_object in hash_objs:
+                hash_object.update(buf)
+            buf = fd.read(blocksize)
+        return
+
+    buffer = bytearray(blocksize)
+    view = memoryview(buffer)
+    size = fd.readinto(buffer)
+    if len(hash_objs) > 1 and size == blocksize:
+        with ThreadPoolExecutor(max_workers=len(hash_objs)) as executor:
+            while size:
+                block = view[:size]
+                for _ in executor.map(lambda hash_object: hash_object.update(block), hash_objs):
+                    pass
+                size = fd.readinto(buffer)
+    else:
+        while size:
+            for hash_object in hash_objs:
+                hash_object.update(view[:size])
+            size = fd.readinto(buffer)
 
 
 def get_checksums(filename: Union[str, BinaryIO], algorithms: List[str]) -> Dict[str, str]:
     """
     Compute a checksum(s) of given file using specified algorithms.
 
+    All the checksums are computed in a single pass over the file. The
+    checksums of files given by path are remembered, as long as the file
+    is not modified, hashing it again with the same algorithms does not
+    read it again.
+
     :param filename: path to file or file-like object
-    :param algorithms: list of cryptographic hash functions, currently supported: md5, sha256
+    :param algorithms: list of cryptographic hash functions, any of CHECKSUM_ALGORITHMS
     :return: dictionary
     """
     if not algorithms:
         return {}
 
-    allowed_algorithms = ['md5', 'sha256']
-    if not all(elem in allowed_algorithms for elem in algorithms):
-        raise ValueError('Algorithms supported {}. Found {}'.format(allowed_algorithms, algorithms))
-
-    hash_objs = [getattr(hashlib, algorithm)() for algorithm in algorithms]
+    if not all(elem in CHECKSUM_ALGORITHMS for elem in algorithms):
+        raise ValueError('Algorithms supported {}. Found {}'.format(CHECKSUM_ALGORITHMS,
+                                                                    algorithms))
 
+    cache_key = None
+    known: Dict[str, str] = {}
     if isinstance(filename, str):
-        with open(filename, mode='rb') as f:
-            _compute_checksums(f, hash_objs)
-    else:
-        _compute_checksums(filename, hash_objs)
+        cache_key = _checksums_cache_key(filename)
+        with _checksums_cache_lock:
+            known = dict(_checksums_cache.get(cache_key, {}))
+
+    missing = [algorithm for algorithm in dict.fromkeys(algorithms) if algorithm not in known]
+    if missing:
+        hash_objs = [hashlib.new(algorithm) for algorithm in missing]
+        if isinstance(filename, str):
+            with open(filename, mode='rb') as f:
+                _compute_checksums(f, hash_objs)
+        else:
+            _compute_checksums(filename, hash_objs)
+        known.update((algorithm, hash_obj.hexdigest())
+                     for algorithm, hash_obj in zip(missing, hash_objs))
+
+    if cache_key is not None:
+        _remember_checksums(cache_key, known)
 
     checksums = {}
-    for hash_obj in hash_objs:
-        sum_name = '{}sum'.format(hash_obj.name)
-        checksums[sum_name] = hash_obj.hexdigest()
+    for algorithm in algorithms:
+        sum_name = '{}sum'.format(algorithm)
+        checksums[sum_name] = known[algorithm]
         logger.debug('%s: %s', sum_name, checksums[sum_name])
     return checksums
 
 
+class HashingWriter(object):
+    """Binary file-like object computing checksums of the data written into a file
+
+    Use it to write files whose checksums are needed afterwards, instead of
+    reading the whole file again:
+
+        with open(path, 'wb') as f:
+            writer = HashingWriter(f)
+            with gzip.GzipFile(fileobj=writer, mode='wb') as gz:
+                ...
+        writer.remember(path)
+        get_checksums(path, ['md5'])  # does not read the file
+
+    The writer is not seekable, the checksums would not match the data
+    overwritten by seeking back.
+    """
+
+    def __init__(self, fileobj: BinaryIO, algorithms: Sequence[str] = ('md5', 'sha256')):
+        """
+        :param fileobj: binary file-like object to write into
+        :param algorithms: hash algorithms to compute, see get_checksums
+        """
+        self._fileobj = fileobj
+        self._hash_objs = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self.size = 0
+        self.name = getattr(fileobj, 'name', None)
+
+    def write(self, data) -> int:
+        written = self._fileobj.write(data)
+        view = memoryview(data).cast('B')
+        if written is not None:
+            view = view[:written]
+        for hash_obj in self._hash_objs.values():
+            hash_obj.update(view)
+        self.size += len(view)
+        return len(view)
+
+    def flush(self) -> None:
+        self._fileobj.flush()
+
+    def tell(self) -> int:
+        return self.size
+
+    def seekable(self) -> bool:
+        return False
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        raise io.UnsupportedOperation('seek')
+
+    def writable(self) -> bool:
+        return True
+
+    @property
+    def checksums(self) -> Dict[str, str]:
+        """Checksums of the data written so far, in the format of get_checksums"""
+        return {'{}sum'.format(algorithm): hash_obj.hexdigest()
+                for algorithm, hash_obj in self._hash_objs.items()}
+
+    def remember(self, path: str) -> None:
+        """Remember the checksums for get_checksums, once all the data is written in path"""
+        _remember_checksums(_checksums_cache_key(path),
+                            {algorithm: hash_obj.hexdigest()
+                             for algorithm, hash_obj in self._hash_objs.items()})
+
+
 def get_exported_image_metadata(path, image_type):
     logger.info('getting metadata for exported image %s (%s)', path, image_type)
     metadata = {'path': path, 'type': image_type}
@@ -586,7 +726,11 @@ class Dockercfg(object):
 
 
 class RegistrySession(object):
-    def __init__(self, registry, insecure=False, dockercfg_path=None, access=None):
+    # tags can move, manifests fetched by tag are revalidated with conditional requests
+    MANIFEST_BY_TAG_URL = re.compile(r'^/v2/.+/manifests/(?!sha256:)[^/]+$')
+
+    def __init__(self, registry, insecure=False, dockercfg_path=None, access=None,
+                 pool_maxsize=None):
         self.registry = registry
         self._resolved = None
         self.insecure = insecure
@@ -602,6 +746,7 @@ class RegistrySession(object):
             password = dockercfg.get('password')
             auth_b64 = dockercfg.get('auth')
         self.auth = HTTPRegistryAuth(username, password, access=access, auth_b64=auth_b64)
+        credentials_id = get_credentials_id(username, password, auth_b64)
 
         self._fallback = None
         if re.match('http(s)?://', self.registry):
@@ -614,7 +759,12 @@ class RegistrySession(object):
                 # with https then fallback
                 self._fallback = 'http://{}'.format(self.registry)
 
-        self.session = get_retrying_requests_session()
+        # The connections to the registry are shared by all sessions using the same
+        # credentials (cookies are shared too), saving a TLS handshake for each session
+        self.session = atomic_reactor.utils.retries.get_shared_requests_session(
+            ('registry', self.registry, insecure, credentials_id),
+            pool_maxsize=pool_maxsize or REGISTRY_POOL_MAXSIZE,
+        )
 
     @classmethod
     def create_from_config(cls, config, registry=None, access=None):
@@ -659,7 +809,8 @@ class RegistrySession(object):
         return cls(matched_registry['uri'].uri,
                    insecure=matched_registry['insecure'],
                    dockercfg_path=matched_registry['dockercfg_path'],
-                   access=access)
+                   access=access,
+                   pool_maxsize=config.registry_pool_maxsize)
 
     def _do(self, f, relative_url, *args, **kwargs):
         kwargs['auth'] = self.auth
@@ -675,8 +826,37 @@ class RegistrySession(object):
         return f(self._base + relative_url, *args, **kwargs)
 
     def get(self, relative_url, data=None, **kwargs):
+        if self.MANIFEST_BY_TAG_URL.match(relative_url):
+            return self._get_conditional(relative_url, **kwargs)
         return self._do(self.session.get, relative_url, **kwargs)
 
+    def _get_conditional(self, relative_url, **kwargs):
+        """GET a resource, revalidating the response cached by a previous request.
+
+        If the registry answers 304 Not Modified, the cached response is returned,
+        the content is not downloaded again.
+        """
+        headers = dict(kwargs.pop('headers', None) or {})
+        key = (self.registry, relative_url, headers.get('Accept'))
+        validator = manifest_revalidation_cache.get_validator(key)
+        if validator:
+            headers['If-None-Match'] = validator
+
+        response = self._do(self.session.get, relative_url, headers=headers, **kwargs)
+
+        if response.status_code == requests.codes.not_modified:
+            if manifest_revalidation_cache.restore(key, validator, response):
+                logger.debug("%s%s not modified, using cached response",
+                             self.registry, relative_url)
+                return response
+            # the cached response was evicted or replaced meanwhile, fetch it again
+            headers.pop('If-None-Match', None)
+            response = self._do(self.session.get, relative_url, headers=headers, **kwargs)
+
+        if response.status_code == requests.codes.ok:
+            manifest_revalidation_cache.store(key, response)
+        return response
+
     def head(self, relative_url, data=None, **kwargs):
         return self._do(self.session.head, relative_url, **kwargs)
 
@@ -689,6 +869,17 @@ class RegistrySession(object):
     def delete(self, relative_url, **kwargs):
         return self._do(self.session.delete, relative_url, **kwargs)
 
+    def prefetch_tokens(self, repos: Iterable[str]) -> None:
+        """Fetch the registry tokens for the repositories in advance, in a single request.
+
+        Registries which do not use tokens are not affected. Tokens are cached in the
+        process, this saves a round-trip per repository when the repositories are
+        accessed later, even through other sessions.
+
+        :param repos: repositories to be accessed, e.g. namespace/repo
+        """
+        self.auth.prefetch_tokens(self._base, repos)
+
 
 class RegistryClient(object):
     """
@@ -704,8 +895,15 @@ class RegistryClient(object):
     >>> client = RegistryClient(session)
     """
 
-    def __init__(self, registry_session):
+    def __init__(self, registry_session, cache: Optional[RegistryCache] = None):
+        """
+        :param registry_session: RegistrySession
+        :param cache: RegistryCache, optional persistent cache of manifests and blobs
+        """
         self._session = registry_session
+        self._cache = cache
+        self._cache_registry = (registry_hostname(registry_session.registry)
+                                if cache is not None else None)
 
     @property
     def insecure(self):
@@ -753,20 +951,144 @@ class RegistryClient(object):
         logger.debug("content matches expected media type")
         return response, saved_not_found
 
+    def get_stored_manifest(
+        self, image: ImageName, versions: Sequence[str], head: bool = False
+    ) -> Tuple[Optional[str], Optional[requests.Response]]:
+        """Fetch the manifest as stored in the registry, in a single request.
+
+        The request accepts all the versions at once. If the media type of the
+        stored manifest is one of them, registries return it without any
+        conversion, e.g. a manifest list rather than the manifest of one of
+        its platforms, or a schema 2 manifest rather than schema 1.
+
+        :param image: ImageName, the remote image to inspect
+        :param versions: sequence, accepted manifest schema versions
+        :param head: bool, send a HEAD request, the response has no content
+
+        :return: tuple (version, response); (None, None) if the registry refused
+            the request or returned a manifest of none of the versions
+        :raises HTTPError: if the manifest does not exist or on unexpected errors
+        """
+        context = '/'.join([x for x in [image.namespace, image.repo] if x])
+        response = None
+        if self._cache is not None:
+            response = self._get_cached_stored_manifest(image, versions, head)
+
+        if response is None:
+            url = '/v2/{}/manifests/{}'.format(context, image.tag)
+            headers = {'Accept': ', '.join(get_manifest_media_type(v) for v in versions)}
+            request = self._session.head if head else self._session.get
+            logger.debug("querying %s, headers: %s", url, headers)
+
+            try:
+                response = request(url, headers=headers)
+                response.raise_for_status()
+            except (HTTPError, RetryError) as ex:
+                if ex.response is None:
+                    raise
+                # Some registries do not support HEAD or a combined Accept header
+                if ex.response.status_code in (requests.codes.bad_request,
+                                               requests.codes.method_not_allowed,
+                                               requests.codes.not_acceptable):
+                    logger.debug("registry refused request for any of %s, status code %s",
+                                 versions, ex.response.status_code)
+                    return None, None
+                raise
+
+            if self._cache is not None:
+                self._cache_stored_manifest(image, response)
+
+        if head and 'Content-Type' not in response.headers:
+            # the media type cannot be guessed without the content
+            return None, None
+        for version in versions:
+            if manifest_is_media_type(response, get_manifest_media_type(version)):
+                return version, response
+        logger.debug("registry returned a manifest of none of %s", versions)
+        return None, None
+
+    def _get_cached_stored_manifest(
+        self, image: ImageName, versions: Sequence[str], head: bool
+    ) -> Optional[requests.Response]:
+        """Get the manifest stored in the registry from the cache, see get_stored_manifest"""
+        assert self._cache is not None
+        context = '/'.join([x for x in [image.namespace, image.repo] if x])
+        if (image.tag or '').startswith('sha256:'):
+            digest = image.tag
+        else:
+            digest = self._cache.get_tag_digest(self._cache_registry, context, image.tag)
+            if (digest is None and not head and
+                    self._cache.get_tag_digest(self._cache_registry, context, image.tag,
+                                               include_expired=True) is not None):
+                # The tag was cached before, check whether it still points to the
+                # same manifest. HEAD requests are cheap and registries rate
+                # limiting pulls typically do not count them.
+                _, head_response = self.get_stored_manifest(image, versions, head=True)
+                if head_response is not None:
+                    digest = head_response.headers.get('Docker-Content-Digest')
+            if digest is None:
+                return None
+        return self._cache.get(self._cache_registry, digest)
+
+    def _cache_stored_manifest(self, image: ImageName, response: requests.Response) -> None:
+        assert self._cache is not None
+        digest = response.headers.get('Docker-Content-Digest')
+        if (image.tag or '').startswith('sha256:'):
+            self._cache.put(self._cache_registry, response, image.tag)
+            return
+        self._cache.put(self._cache_registry, response, digest)
+        if digest:
+            context = '/'.join([x for x in [image.namespace, image.repo] if x])
+            self._cache.put_tag(self._cache_registry, context, image.tag, digest)
+
+    def _query_by_digest(
+        self, image: ImageName, digest: str, version: str = 'v2', is_blob: bool = False
+    ) -> requests.Response:
+        """Query a manifest or a blob by digest, see query_registry
+
+        Content addressed by digest never changes, it is served from the cache if possible.
+        """
+        if self._cache is not None:
+            response = self._cache.get(self._cache_registry, digest)
+            if response is not None and (
+                is_blob or manifest_is_media_type(response, get_manifest_media_type(version))
+            ):
+                return response
+
+        response = query_registry(self._session, image, digest=digest, version=version,
+                                  is_blob=is_blob)
+        if self._cache is not None:
+            self._cache.put(self._cache_registry, response, digest)
+        return response
+
     def get_manifest_digests(self,
                              image,
                              versions=('v1', 'v2', 'v2_list', 'oci', 'oci_index'),
-                             require_digest=True):
+                             require_digest=True,
+                             single_request=False):
         """Return manifest digest for image.
 
         :param image: ImageName, the remote image to inspect
         :param versions: tuple, which manifest schema versions to fetch digest
         :param require_digest: bool, when True exception is thrown if no digest is
                                      set in the headers.
+        :param single_request: bool, when True only the digest of the manifest as
+            stored in the registry is returned, fetched with a single HEAD request
+            (see get_stored_manifest). Digests of manifests the registry converts
+            to on request, e.g. schema 1, are not included. Registries which do
+            not handle such request are queried for each version.
 
         :return: dict, versions mapped to their digest
         """
 
+        if single_request and versions:
+            version, response = self.get_stored_manifest(image, versions, head=True)
+            if response is not None and response.headers.get('Docker-Content-Digest'):
+                digest = response.headers['Docker-Content-Digest']
+                logger.debug('Image %s has %s manifest digest: %s', image, version, digest)
+                return ManifestDigest({version: digest})
+            logger.debug('Falling back to querying digests of %s for each version', image)
+
         digests = {}
         # If all of the media types return a 404 NOT_FOUND status, then we rethrow
         # an exception, if all of the media types fail for some other reason - like
@@ -829,15 +1151,34 @@ class RegistryClient(object):
         return 'sha256:{}'.format(digest_dict['sha256sum'])
 
     def get_all_manifests(
-        self, image: ImageName, versions: Sequence[str] = ('v1', 'v2', 'v2_list')
+        self,
+        image: ImageName,
+        versions: Sequence[str] = ('v1', 'v2', 'v2_list'),
+        single_request: bool = False,
     ) -> Dict[str, requests.Response]:
         """Return manifest digests for image.
 
         :param image: ImageName, the remote image to inspect
         :param versions: tuple, for which manifest schema versions to fetch manifests
+        :param single_request: bool, when True only the manifest as stored in the
+            registry is returned, fetched with a single request (see
+            get_stored_manifest). Registries which do not handle such request
+            are queried for each version.
 
         :return: dict of successful responses, with versions as keys
         """
+        if single_request and versions:
+            try:
+                version, response = self.get_stored_manifest(image, versions)
+            except (HTTPError, RetryError) as ex:
+                if ex.response is None or ex.response.status_code != requests.codes.not_found:
+                    raise
+                logger.debug("manifest of %s not found", image)
+                return {}
+            if response is not None:
+                return {version: response}
+            logger.debug('Falling back to querying manifests of %s for each version', image)
+
         digests = {}
         for version in versions:
             response, _ = self.get_manifest(image, version)
@@ -859,7 +1200,8 @@ class RegistryClient(object):
 
         :return: dict of inspected image
         """
-        all_man_digests = self.get_all_manifests(image)
+        # The manifest of the highest version below is the one stored in the registry
+        all_man_digests = self.get_all_manifests(image, single_request=True)
 
         config_digest: Optional[str]
 
@@ -916,8 +1258,33 @@ class RegistryClient(object):
 
         return image_inspect
 
+    def get_inspect_for_images(
+        self,
+        images: Iterable[ImageName],
+        arch: Optional[str] = None,
+        max_workers: int = REGISTRY_MAX_CONCURRENT_REQUESTS,
+    ) -> Dict[str, Union[ImageInspectionData, Exception]]:
+        """Inspect many images concurrently, see get_inspect_for_image.
+
+        :return: dict, image reference (str) -> inspect data, or the exception
+            raised when inspecting the image
+        """
+        return map_images_concurrently(
+            functools.partial(self.get_inspect_for_image, arch=arch), images, max_workers
+        )
+
+    def get_manifest_list_digests(
+        self, images: Iterable[ImageName], max_workers: int = REGISTRY_MAX_CONCURRENT_REQUESTS
+    ) -> Dict[str, Union[str, Exception]]:
+        """Get manifest list digests of many images concurrently, see get_manifest_list_digest.
+
+        :return: dict, image reference (str) -> digest, or the exception raised
+            when querying the image
+        """
+        return map_images_concurrently(self.get_manifest_list_digest, images, max_workers)
+
     def _blob_config_by_digest(self, image: ImageName, config_digest: str) -> dict:
-        config_response = query_registry(self._session, image, digest=config_digest, is_blob=True)
+        config_response = self._query_by_digest(image, config_digest, is_blob=True)
         blob_config = config_response.json()
         return blob_config
 
@@ -966,7 +1333,7 @@ class RegistryClient(object):
 
         :return: dict, versions mapped to their digest
         """
-        response = query_registry(self._session, image, digest=digest, version=version)
+        response = self._query_by_digest(image, digest, version=version)
         manifest_config = response.json()
 
         config_digest = manifest_config['config']['digest']
@@ -1027,6 +1394,37 @@ def is_manifest_list(version):
     return version == MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST or version == MEDIA_TYPE_OCI_V1_INDEX
 
 
+def map_images_concurrently(
+    func: Callable[[ImageName], Any],
+    images: Iterable[ImageName],
+    max_workers: int = REGISTRY_MAX_CONCURRENT_REQUESTS,
+) -> Dict[str, Any]:
+    """Call a function for each of the images in a bounded thread pool.
+
+    Identical image references are processed only once. The function must be
+    safe to call from multiple threads.
+
+    :param func: callable taking an ImageName
+    :param images: iterable of ImageName
+    :param max_workers: int, max number of concurrent calls
+    :return: dict, image reference (str) -> result of the function, or the
+        exception it raised
+    """
+    unique_images = {image.to_str(): image for image in images}
+    if not unique_images:
+        return {}
+
+    def call(image):
+        try:
+            return func(image)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_images))) as executor:
+        results = executor.map(call, unique_images.values())
+        return dict(zip(unique_images, results))
+
+
 def get_manifest_media_type(version: str) -> str:
     try:
         return ManifestDigest.content_type[version]
@@ -1150,7 +1548,8 @@ def get_manifest(image, registry_session, version):
 
 
 def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
-                         versions=('v1', 'v2', 'v2_list', 'oci', 'oci_index'), require_digest=True):
+                         versions=('v1', 'v2', 'v2_list', 'oci', 'oci_index'), require_digest=True,
+                         single_request=False):
     """Return manifest digest for image.
 
     :param image: ImageName, the remote image to inspect
@@ -1161,6 +1560,7 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
     :param versions: tuple, which manifest schema versions to fetch digest
     :param require_digest: bool, when True exception is thrown if no digest is
                                  set in the headers.
+    :param single_request: bool, see RegistryClient.get_manifest_digests
 
     :return: dict, versions mapped to their digest
     """
@@ -1168,7 +1568,8 @@ def get_manifest_digests(image, registry, insecure=False, dockercfg_path=None,
     registry_client = RegistryClient(registry_session)
     return registry_client.get_manifest_digests(image=image,
                                                 versions=versions,
-                                                require_digest=require_digest)
+                                                require_digest=require_digest,
+                                                single_request=single_request)
 
 
 def get_manifest_list(image, registry, insecure=False, dockercfg_path=None):
@@ -1188,7 +1589,7 @@ def get_manifest_list(image, registry, insecure=False, dockercfg_path=None):
 
 
 def get_all_manifests(image, registry, insecure=False, dockercfg_path=None,
-                      versions=('v1', 'v2', 'v2_list')):
+                      versions=('v1', 'v2', 'v2_list'), single_request=False):
     """Return manifest digests for image.
 
     :param image: ImageName, the remote image to inspect
@@ -1197,12 +1598,14 @@ def get_all_manifests(image, registry, insecure=False, dockercfg_path=None,
     :param insecure: bool, when True registry's cert is not verified
     :param dockercfg_path: str, dirname of .dockercfg location
     :param versions: tuple, for which manifest schema versions to fetch manifests
+    :param single_request: bool, see RegistryClient.get_all_manifests
 
     :return: dict of successful responses, with versions as keys
     """
     registry_session = RegistrySession(registry, insecure=insecure, dockercfg_path=dockercfg_path)
     registry_client = RegistryClient(registry_session)
-    return registry_client.get_all_manifests(image, versions=versions)
+    return registry_client.get_all_manifests(image, versions=versions,
+                                             single_request=single_request)
 
 
 def get_inspect_for_image(image, registry, insecure=False, dockercfg_path=None, arch=None):
@@ -1382,6 +1785,20 @@ def read_yaml(yaml_data, schema, package='atomic_reactor'):
     return osbs_yaml.read_yaml(yaml_data, schema, package)
 
 
+@functools.lru_cache(maxsize=None)
+def get_schema_validator(schema: str,
+                         package: str = "atomic_reactor") -> jsonschema.Draft4Validator:
+    """Get a validator for a JSON schema, loaded and checked only once per process.
+
+    :param schema: path to the JSON schema file
+    :param package: package name containing the JSON schema file
+    :raises jsonschema.SchemaError: if the schema itself is not valid
+    """
+    schema_data = osbs_yaml.load_schema(package, schema)
+    jsonschema.Draft4Validator.check_schema(schema_data)
+    return jsonschema.Draft4Validator(schema_data)
+
+
 def validate_with_schema(data: dict, schema: str, package: str = "atomic_reactor") -> None:
     """Validate data against a JSON schema.
 
@@ -1390,8 +1807,10 @@ def validate_with_schema(data: dict, schema: str, package: str = "atomic_reactor
     :param package: package name containing the JSON schema file
     :raises osbs.OsbsValidationException: if the data is not valid according to the schema
     """
-    schema = osbs_yaml.load_schema(package, schema)
-    osbs_yaml.validate_with_schema(data, schema)
+    validator = get_schema_validator(schema, package)
+    if not validator.is_valid(data):
+        # Let osbs-client report the errors, for consistency with other validations
+        osbs_yaml.validate_with_schema(data, validator.schema)
 
 
 def allow_repo_dir_in_dockerignore(build_path):
@@ -1517,6 +1936,8 @@ class OSBSLogs(object):
         filename = 'osbs-build'
         logfiles = {'noarch': NamedTemporaryFile(prefix=f'{pipeline_run_name}-{filename}-noarch-',
                                                  suffix='.log', mode='wb')}
+        # the logs are hashed as they are written, for their metadata
+        writers = {'noarch': HashingWriter(logfiles['noarch'], ['md5'])}
 
         # Correct log order depends on dict iteration order
         # and on osbs.get_build_logs returning correctly ordered dict
@@ -1530,12 +1951,14 @@ class OSBSLogs(object):
                 logfiles[task_platform] = NamedTemporaryFile(prefix=f'{pipeline_run_name}-'
                                                                     f'{filename}-{task_platform}-',
                                                              suffix='.log', mode='wb')
+                writers[task_platform] = HashingWriter(logfiles[task_platform], ['md5'])
 
             for log_message in containers.values():
-                logfiles[task_platform].write((log_message + '\n').encode('utf-8'))
-            logfiles[task_platform].flush()
+                writers[task_platform].write((log_message + '\n').encode('utf-8'))
+            writers[task_platform].flush()
 
         for platform, logfile in logfiles.items():
+            writers[platform].remember(logfile.name)
             if platform == 'noarch':
                 log_filename = filename
             else:
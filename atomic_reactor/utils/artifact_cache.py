@@ -0,0 +1,177 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Node-local cache of downloaded artifacts, shared by the builds running on the node
+"""
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from atomic_reactor.util import get_checksums
+
+logger = logging.getLogger(__name__)
+
+# bytes the cache may take, the least recently used entries are evicted beyond
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+# checksum types, from the preferred one, used to key the entries; files without
+# any of them are not cached, weaker checksums do not prevent planting colliding
+# files into the cache shared by the builds
+CHECKSUM_PREFERENCE = ('sha512', 'sha384', 'sha256')
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    """Hardlink src to dest, copy it if they are on different filesystems"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+class ArtifactCache:
+    """Content addressed cache of downloaded files
+
+    Files are keyed by their URL and checksum, so only downloads with
+    expected sha256 or stronger checksums are cached:
+
+        <path>/<checksum type>/<checksum>-<sha256 of the URL>
+
+    The entries are hardlinked into the build directories when possible and
+    made read-only, the builds must not modify the downloaded files in place.
+    Entries are verified against all the expected checksums when used, an
+    entry which does not match them is removed.
+
+    When the entries take more than max_size bytes, the least recently used
+    ones are evicted. Several builds may use the cache at the same time,
+    entries are added atomically.
+    """
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        :param path: Path, directory of the cache
+        :param max_size: int, bytes the cache may take
+        """
+        self.path = Path(path)
+        self.max_size = max_size
+
+    def _entry_path(self, url: str, checksums: Dict[str, str]) -> Optional[Path]:
+        preferred = [algo for algo in CHECKSUM_PREFERENCE if algo in checksums]
+        if not preferred:
+            return None
+        algo = preferred[0]
+        checksum = checksums[algo].lower()
+        if not checksum.isalnum():
+            return None
+        url_digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return self.path / algo / '{}-{}'.format(checksum, url_digest)
+
+    def _verify(self, path: Path, checksums: Dict[str, str]) -> bool:
+        try:
+            computed = get_checksums(str(path), list(checksums))
+        except ValueError:
+            # checksum types which can't be verified
+            return False
+        return all(computed['{}sum'.format(algo)] == checksum.lower()
+                   for algo, checksum in checksums.items())
+
+    def get(self, url: str, checksums: Dict[str, str], dest_path: Path) -> bool:
+        """Link the cached file downloaded from url with the checksums to dest_path
+
+        :param url: str, URL the file is downloaded from
+        :param checksums: dict, checksum type -> expected checksum of the file
+        :param dest_path: Path, where to put the file, replaced if it exists
+        :return: bool, whether the file was cached
+        """
+        entry = self._entry_path(url, checksums)
+        if entry is None or not entry.exists():
+            return False
+        dest_path = Path(dest_path)
+        try:
+            dest_path.unlink(missing_ok=True)
+            _link_or_copy(entry, dest_path)
+            if not self._verify(dest_path, checksums):
+                logger.warning('%s in artifact cache does not match checksums %s, removing it',
+                               entry, checksums)
+                dest_path.unlink()
+                entry.unlink(missing_ok=True)
+                return False
+            # the modification time tracks the last use of the entry
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning('Failed to get %s from artifact cache: %s', entry, e)
+            return False
+        logger.debug('artifact cache hit: %s', entry)
+        return True
+
+    def put(self, url: str, path: Path, checksums: Dict[str, str]) -> None:
+        """Add a downloaded file to the cache, then evict entries beyond max_size
+
+        :param url: str, URL the file was downloaded from
+        :param path: Path, the file
+        :param checksums: dict, checksum type -> verified checksum of the file
+        """
+        entry = self._entry_path(url, checksums)
+        if entry is None or entry.exists():
+            return
+        tmp_path = entry.parent / '.tmp-{}'.format(uuid.uuid4().hex)
+        try:
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                _link_or_copy(Path(path), tmp_path)
+                tmp_path.chmod(0o444)
+                os.replace(tmp_path, entry)
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+        except OSError as e:
+            # the cache only saves downloads, failing to write it is not an error
+            logger.warning('Failed to add %s into artifact cache: %s', path, e)
+            return
+        self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        for algo_dir in self.path.iterdir():
+            if not algo_dir.is_dir():
+                continue
+            for entry in algo_dir.iterdir():
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # evicted by another build
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+        return sorted(entries)
+
+    def evict(self) -> None:
+        """Remove the least recently used entries beyond max_size"""
+        try:
+            entries = self._entries()
+        except OSError as e:
+            logger.warning('Failed to list artifact cache %s: %s', self.path, e)
+            return
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry in entries:
+            if size <= self.max_size:
+                break
+            logger.debug('evicting %s from artifact cache', entry)
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning('Failed to evict %s from artifact cache: %s', entry, e)
+                continue
+            size -= entry_size
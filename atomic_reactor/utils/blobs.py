@@ -0,0 +1,228 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Content-addressed store for large data kept outside of the workflow data
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import IO, Any, Dict, Optional
+
+from atomic_reactor.types import ISerializer
+
+try:
+    import zstandard
+except ImportError:
+    # optional, only needed for the zstd compression
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+
+_SUFFIXES = {None: "", COMPRESSION_GZIP: ".gz", COMPRESSION_ZSTD: ".zst"}
+_CHUNK_SIZE = 1024 * 1024
+
+# default of the compression arguments, None means no compression
+_DEFAULT: Any = object()
+
+
+class BlobRef(ISerializer):
+    """Reference to a blob stored in a BlobStore
+
+    References are small, they can be put into the workflow data instead
+    of the content itself, e.g. into workflow.data.files or plugin results.
+    """
+
+    def __init__(self, digest: str, size: int, compression: Optional[str] = None):
+        """
+        :param digest: str, sha256 digest of the uncompressed content, e.g. sha256:abc...
+        :param size: int, size of the uncompressed content
+        :param compression: str, compression of the stored blob, gzip, zstd or None
+        """
+        self.digest = digest
+        self.size = size
+        self.compression = compression
+
+    @classmethod
+    def load(cls, data: Dict[str, Any]) -> "BlobRef":
+        return cls(data["digest"], data["size"], data.get("compression"))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"digest": self.digest, "size": self.size, "compression": self.compression}
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BlobRef):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __hash__(self) -> int:
+        return hash(self.digest)
+
+    def __repr__(self) -> str:
+        return f"BlobRef({self.digest!r}, {self.size!r}, {self.compression!r})"
+
+
+def _check_compression(compression: Optional[str]) -> None:
+    if compression not in _SUFFIXES:
+        raise ValueError(f"Unknown compression {compression!r}")
+    if compression == COMPRESSION_ZSTD and zstandard is None:
+        raise ValueError("zstd compression requires the zstandard package")
+
+
+def _open_compressed(path: Path, mode: str, compression: Optional[str]) -> IO[bytes]:
+    if compression == COMPRESSION_GZIP:
+        # compresslevel 6 is a lot faster than the default 9 and almost as good
+        return gzip.open(path, mode, compresslevel=6)  # type: ignore[return-value]
+    if compression == COMPRESSION_ZSTD:
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+class BlobStore:
+    """Content-addressed, deduplicated store of blobs
+
+    Blobs are stored in <path>/sha256/<hex digest>[.gz|.zst], keyed by
+    the digest of the uncompressed content. Storing content which is
+    already present does not write anything.
+
+    The content is verified against the digest when it is read back.
+    """
+
+    def __init__(self, path: Path, compression: Optional[str] = COMPRESSION_GZIP):
+        """
+        :param path: Path, directory of the store, created on the first write
+        :param compression: str, default compression of new blobs, gzip, zstd or None
+        """
+        _check_compression(compression)
+        self.path = path
+        self.compression = compression
+
+    def _blob_path(self, hex_digest: str, compression: Optional[str]) -> Path:
+        return self.path / "sha256" / f"{hex_digest}{_SUFFIXES[compression]}"
+
+    def get_path(self, ref: BlobRef) -> Path:
+        """Get the path of the stored blob, compressed as specified by the reference"""
+        algorithm, _, hex_digest = ref.digest.partition(":")
+        if algorithm != "sha256" or not hex_digest:
+            raise ValueError(f"Unsupported digest {ref.digest!r}")
+        return self._blob_path(hex_digest, ref.compression)
+
+    def _find(self, hex_digest: str, size: int) -> Optional[BlobRef]:
+        for compression in _SUFFIXES:
+            if self._blob_path(hex_digest, compression).exists():
+                return BlobRef(f"sha256:{hex_digest}", size, compression)
+        return None
+
+    def __contains__(self, ref: BlobRef) -> bool:
+        return self.get_path(ref).exists()
+
+    def put(self, data: bytes, compression: Optional[str] = _DEFAULT) -> BlobRef:
+        """Store the content
+
+        :param data: bytes, content to store
+        :param compression: str, compression of the blob, gzip, zstd or None;
+            the default of the store if omitted
+        :return: BlobRef, reference to the stored content; the compression
+            of an already stored blob is kept
+        """
+        hex_digest = hashlib.sha256(data).hexdigest()
+        existing = self._find(hex_digest, len(data))
+        if existing:
+            return existing
+
+        if compression is _DEFAULT:
+            compression = self.compression
+        _check_compression(compression)
+        self.path.joinpath("sha256").mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        os.close(fd)
+        try:
+            with _open_compressed(Path(tmp_path), "wb", compression) as f:
+                f.write(data)
+            os.replace(tmp_path, self._blob_path(hex_digest, compression))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        ref = BlobRef(f"sha256:{hex_digest}", len(data), compression)
+        logger.debug("stored blob %s", ref)
+        return ref
+
+    def put_file(self, path: Path, compression: Optional[str] = _DEFAULT) -> BlobRef:
+        """Store the content of a file, without reading it into memory at once
+
+        :param path: Path, file to store
+        :param compression: str, compression of the blob, gzip, zstd or None;
+            the default of the store if omitted
+        :return: BlobRef, reference to the stored content
+        """
+        if compression is _DEFAULT:
+            compression = self.compression
+        _check_compression(compression)
+        self.path.joinpath("sha256").mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        os.close(fd)
+        try:
+            checksum = hashlib.sha256()
+            size = 0
+            with open(path, "rb") as src, _open_compressed(Path(tmp_path), "wb", compression) as f:
+                for chunk in iter(lambda: src.read(_CHUNK_SIZE), b""):
+                    checksum.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+
+            hex_digest = checksum.hexdigest()
+            existing = self._find(hex_digest, size)
+            if existing:
+                os.unlink(tmp_path)
+                return existing
+            os.replace(tmp_path, self._blob_path(hex_digest, compression))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        ref = BlobRef(f"sha256:{hex_digest}", size, compression)
+        logger.debug("stored blob %s from %s", ref, path)
+        return ref
+
+    def put_json(self, data: Any, compression: Optional[str] = _DEFAULT) -> BlobRef:
+        """Store JSON serializable data, see put"""
+        return self.put(json.dumps(data).encode("utf-8"), compression)
+
+    def get(self, ref: BlobRef) -> bytes:
+        """Read the content of a blob
+
+        :param ref: BlobRef, reference returned when the blob was stored
+        :return: bytes, the uncompressed content
+        :raises FileNotFoundError: if the blob is not in the store
+        :raises ValueError: if the content does not match the digest
+        """
+        with _open_compressed(self.get_path(ref), "rb", ref.compression) as f:
+            data = f.read()
+        actual = f"sha256:{hashlib.sha256(data).hexdigest()}"
+        if actual != ref.digest:
+            raise ValueError(f"Blob {ref.digest} is corrupted, its content has digest {actual}")
+        return data
+
+    def get_json(self, ref: BlobRef) -> Any:
+        """Read data stored by put_json"""
+        return json.loads(self.get(ref))
+
+    def copy_to(self, ref: BlobRef, path: Path) -> None:
+        """Write the uncompressed content of a blob into a file
+
+        Unlike get, the content is not verified against the digest.
+        """
+        with _open_compressed(self.get_path(ref), "rb", ref.compression) as src:
+            with open(path, "wb") as f:
+                shutil.copyfileobj(src, f, _CHUNK_SIZE)
@@ -12,15 +12,17 @@ import logging
 import tarfile
 import json
 
-from typing import Optional, Union, Dict, List, Any
+from typing import Optional, Union, Dict, Iterable, List, Any
 from pathlib import Path
 
 from osbs.utils import ImageName
 
 from atomic_reactor import config
 from atomic_reactor import util
+from atomic_reactor.constants import REGISTRY_MAX_CONCURRENT_REQUESTS
 from atomic_reactor.types import ImageInspectionData
 from atomic_reactor.utils import retries
+from atomic_reactor.utils.registry_cache import RegistryCache
 
 logger = logging.getLogger(__name__)
 
@@ -37,14 +39,22 @@ class ImageUtil:
     Supports e.g. inspecting the base image and other parent images.
     """
 
-    def __init__(self, dockerfile_images: util.DockerfileImages, conf: config.Configuration):
+    def __init__(
+        self,
+        dockerfile_images: util.DockerfileImages,
+        conf: config.Configuration,
+        registry_cache: Optional[RegistryCache] = None,
+    ):
         """Init an ImageUtil.
 
         :param dockerfile_images: information about the image references in the Dockerfile
         :param conf: atomic-reactor configuration
+        :param registry_cache: optional persistent cache of registry content, unlike the
+            in-memory cache of inspected images, it is shared by all the tasks of a build
         """
         self._dockerfile_images = dockerfile_images
         self._conf = conf
+        self._registry_cache = registry_cache
 
     def set_dockerfile_images(self, dockerfile_images: util.DockerfileImages) -> None:
         """Set a new dockerfile_images instance."""
@@ -70,6 +80,32 @@ class ImageUtil:
         goarch = self._conf.platform_to_goarch_mapping[platform]
         return self._cached_inspect_image(str(image), goarch)
 
+    def get_inspect_for_images(
+        self,
+        images: Iterable[Union[str, ImageName]],
+        platform: Optional[str] = None,
+        max_workers: int = REGISTRY_MAX_CONCURRENT_REQUESTS,
+    ) -> Dict[str, Union[ImageInspectionData, Exception]]:
+        """Inspect many images concurrently.
+
+        Identical image references are inspected only once. The results are
+        cached like those of get_inspect_for_image, inspecting the images
+        in advance makes the subsequent get_inspect_for_image calls cheap.
+
+        :param images: The images to inspect
+        :param platform: Optionally, inspect the images for a specific platform,
+            see get_inspect_for_image
+        :param max_workers: Max number of images inspected at the same time
+        :return: dict, image reference (str) -> inspect data, or the exception
+            raised when inspecting the image (e.g. if it is not inspectable)
+        """
+        parsed_images = [
+            image if isinstance(image, ImageName) else ImageName.parse(image) for image in images
+        ]
+        return util.map_images_concurrently(
+            lambda image: self.get_inspect_for_image(image, platform), parsed_images, max_workers
+        )
+
     def base_image_inspect(self, platform: Optional[str] = None) -> ImageInspectionData:
         """Inspect the base image (the parent image for the final build stage).
 
@@ -99,7 +135,7 @@ class ImageUtil:
     @functools.lru_cache(maxsize=None)
     def _get_registry_client(self, registry: str) -> util.RegistryClient:
         session = util.RegistrySession.create_from_config(self._conf, registry)
-        return util.RegistryClient(session)
+        return util.RegistryClient(session, cache=self._registry_cache)
 
     def extract_file_from_image(self, image: Union[str, ImageName],
                                 src_path: str, dst_path: str) -> None:
@@ -7,7 +7,9 @@ of the BSD license. See the LICENSE file for details.
 """
 
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
+from urllib.parse import urlparse
 import requests
 
 from atomic_reactor.plugin import PluginFailedException
@@ -15,7 +17,7 @@ from atomic_reactor.util import (registry_hostname, RegistrySession, ManifestDig
                                  get_manifest_media_type)
 from atomic_reactor.constants import (MEDIA_TYPE_DOCKER_V2_SCHEMA2,
                                       MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST, MEDIA_TYPE_OCI_V1,
-                                      MEDIA_TYPE_OCI_V1_INDEX)
+                                      MEDIA_TYPE_OCI_V1_INDEX, REGISTRY_MAX_CONCURRENT_REQUESTS)
 
 
 class ManifestUtil(object):
@@ -87,34 +89,49 @@ class ManifestUtil(object):
         """
         Links ("mounts" in Docker Registry terminology) a blob from one repository in a
         registry into another repository in the same registry.
+
+        Blobs not present in the source repository, e.g. foreign layers, are skipped.
         """
         self.log.debug("%s: Linking blob %s from %s to %s",
                        session.registry, digest, source_repo, target_repo)
 
-        # Check that it exists in the source repository
-        url = "/v2/{}/blobs/{}".format(source_repo, digest)
-        # allow redirects, head call doesn't do it by default
-        result = session.head(url, allow_redirects=True)
-        if result.status_code == requests.codes.NOT_FOUND:
-            self.log.debug("%s: blob %s, not present in %s, skipping",
-                           session.registry, digest, source_repo)
-            # Assume we don't need to copy it - maybe it's a foreign layer
-            return
-        result.raise_for_status()
-
         url = "/v2/{}/blobs/uploads/?mount={}&from={}".format(target_repo, digest, source_repo)
         result = session.post(url, data='')
         result.raise_for_status()
 
-        if result.status_code != requests.codes.CREATED:
-            # A 202-Accepted would mean that the source blob didn't exist and
-            # we're starting an upload - but we've checked that above
-            raise RuntimeError("Blob mount had unexpected status {}".format(result.status_code))
+        if result.status_code == requests.codes.CREATED:
+            return
+        if result.status_code == requests.codes.ACCEPTED:
+            # The source blob doesn't exist and the registry started an upload instead
+            # of the mount. Assume we don't need to copy it - maybe it's a foreign layer
+            self.log.debug("%s: blob %s, not present in %s, skipping",
+                           session.registry, digest, source_repo)
+            self._cancel_upload(session, result)
+            return
+        raise RuntimeError("Blob mount had unexpected status {}".format(result.status_code))
+
+    def _cancel_upload(self, session, response):
+        """
+        Cancels the upload session started by a request, so it doesn't linger in the
+        registry until it is garbage collected.
+        """
+        location = response.headers.get('Location')
+        if not location:
+            return
+        parsed = urlparse(location)
+        url = parsed.path + ('?' + parsed.query if parsed.query else '')
+        try:
+            session.delete(url).raise_for_status()
+        except requests.RequestException as e:
+            self.log.warning("%s: failed to cancel upload %s: %s", session.registry, url, e)
 
     def link_manifest_references_into_repository(self, session, manifest, media_type,
-                                                 source_repo, target_repo):
+                                                 source_repo, target_repo,
+                                                 max_workers=REGISTRY_MAX_CONCURRENT_REQUESTS):
         """
         Links all the blobs referenced by the manifest from source_repo into target_repo.
+
+        The blobs are linked concurrently, by at most max_workers requests at a time.
         """
 
         if source_repo == target_repo:
@@ -132,8 +149,16 @@ class ManifestUtil(object):
             # we never copy a manifest list as a whole between repositories
             raise RuntimeError("Unhandled media-type {}".format(media_type))
 
-        for digest in references:
-            self.link_blob_into_repository(session, digest, source_repo, target_repo)
+        # the same layer may be referenced more than once
+        references = list(dict.fromkeys(references))
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(references))) as executor:
+            futures = [executor.submit(self.link_blob_into_repository,
+                                       session, digest, source_repo, target_repo)
+                       for digest in references]
+            for future in futures:
+                # re-raise the first error, if any
+                future.result()
 
     def store_manifest_in_repository(self, session, manifest: bytes, media_type,
                                      source_repo, target_repo, ref=None):
@@ -147,12 +172,47 @@ class ManifestUtil(object):
 
         self.link_manifest_references_into_repository(session, manifest, media_type,
                                                       source_repo, target_repo)
+        self.put_manifest(session, manifest, media_type, target_repo, ref)
 
-        url = '/v2/{}/manifests/{}'.format(target_repo, ref)
+    def put_manifest(self, session, manifest: bytes, media_type, repo, ref):
+        """
+        Uploads the manifest into repo as ref, a digest or a tag. The blobs it
+        references must already be present in repo.
+        """
+        url = '/v2/{}/manifests/{}'.format(repo, ref)
         headers = {'Content-Type': media_type}
         response = session.put(url, data=manifest, headers=headers)
         response.raise_for_status()
 
+    def tag_manifest_in_repositories(self, session, manifest: bytes, media_type, images,
+                                     max_workers=REGISTRY_MAX_CONCURRENT_REQUESTS):
+        """
+        Tags the manifest with the tags of images. The blobs it references must
+        already be present in the repositories of the images.
+
+        The manifest is uploaded with the first tag of each repository, the remaining
+        tags, which the registry only has to point to the existing manifest, are added
+        concurrently.
+        """
+        tags_by_repo = {}
+        for image in images:
+            repo = image.to_str(registry=False, tag=False)
+            tags_by_repo.setdefault(repo, {})[image.tag] = None
+
+        remaining = []
+        for repo, tags in tags_by_repo.items():
+            first_tag, *other_tags = tags
+            self.put_manifest(session, manifest, media_type, repo, first_tag)
+            remaining.extend((repo, tag) for tag in other_tags)
+
+        if not remaining:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(remaining))) as executor:
+            futures = [executor.submit(self.put_manifest, session, manifest, media_type, repo, tag)
+                       for repo, tag in remaining]
+            for future in futures:
+                future.result()
+
     def get_registry_session(self):
         insecure = self.registry.get('insecure', False)
         secret_path = self.registry.get('secret')
@@ -163,10 +223,13 @@ class ManifestUtil(object):
 
     def add_tag_and_manifest(self, session, image_manifest: bytes, media_type,
                              source_repo, configured_tags):
-        for image in configured_tags:
-            target_repo = image.to_str(registry=False, tag=False)
-            self.store_manifest_in_repository(session, image_manifest, media_type,
-                                              source_repo, target_repo, ref=image.tag)
+        # link the blobs only once into each repository, not once per tag
+        target_repos = dict.fromkeys(image.to_str(registry=False, tag=False)
+                                     for image in configured_tags)
+        for target_repo in target_repos:
+            self.link_manifest_references_into_repository(session, image_manifest, media_type,
+                                                          source_repo, target_repo)
+        self.tag_manifest_in_repositories(session, image_manifest, media_type, configured_tags)
 
     def tag_manifest_into_registry(self, session, digest: str, source_repo, configured_tags):
         """
@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Opt-in CPU and memory profiling of plugins
+"""
+import cProfile
+import contextlib
+import logging
+import threading
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+ALL_PLUGINS = '*'
+
+# tracemalloc is process-wide, keep it running while any plugin needs it
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def get_profiling_options(plugin_key: str,
+                          config: Optional[Dict[str, Any]],
+                          user_config: Optional[Dict[str, Any]] = None
+                          ) -> Optional[Dict[str, Any]]:
+    """Decide how a plugin should be profiled
+
+    :param plugin_key: str, key of the plugin
+    :param config: dict, profiling configuration from the reactor config
+    :param user_config: dict, profiling configuration from the user params,
+        its values take precedence over the reactor config
+    :return: dict with keys cprofile, tracemalloc and tracemalloc_top, None if
+        the plugin should not be profiled
+    """
+    options = dict(config or {})
+    options.update(user_config or {})
+
+    plugins = options.get('plugins', [])
+    if plugin_key not in plugins and ALL_PLUGINS not in plugins:
+        return None
+
+    options = {
+        'cprofile': options.get('cprofile', True),
+        'tracemalloc': options.get('tracemalloc', False),
+        'tracemalloc_top': options.get('tracemalloc_top', 50),
+    }
+    if not options['cprofile'] and not options['tracemalloc']:
+        return None
+    return options
+
+
+def _start_tracemalloc() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+def _write_top_allocations(snapshot: tracemalloc.Snapshot, path: Path, limit: int) -> None:
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+    ])
+    stats = snapshot.statistics('lineno')
+    total = sum(stat.size for stat in stats)
+    with open(path, 'w') as f:
+        f.write(f"Top {limit} of {len(stats)} allocation sites, "
+                f"{total / 1024:.1f} KiB allocated in total\n")
+        for index, stat in enumerate(stats[:limit], 1):
+            frame = stat.traceback[0]
+            f.write(f"#{index}: {frame.filename}:{frame.lineno}: "
+                    f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+
+
+@contextlib.contextmanager
+def profile_plugin(plugin_key: str, output_dir: Path, options: Dict[str, Any]) -> Iterator[None]:
+    """Profile the code running within the context
+
+    Writes <plugin_key>.pstats (readable by the pstats module or snakeviz)
+    and <plugin_key>.tracemalloc.txt with the top allocation sites into
+    output_dir, depending on options.
+
+    Failures of the profiling itself are logged and never propagated.
+
+    :param plugin_key: str, key of the profiled plugin
+    :param output_dir: Path, directory to write the results to
+    :param options: dict, returned by get_profiling_options
+    """
+    profiler = None
+    if options['cprofile']:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # only one profiler may be active at a time since Python 3.12
+            logger.warning("cannot profile plugin %s: %s", plugin_key, e)
+            profiler = None
+
+    if options['tracemalloc']:
+        _start_tracemalloc()
+
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+
+        try:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            if profiler:
+                pstats_path = output_dir / f'{plugin_key}.pstats'
+                profiler.dump_stats(pstats_path)
+                logger.info("CPU profile of plugin %s written to %s", plugin_key, pstats_path)
+            if options['tracemalloc']:
+                snapshot = tracemalloc.take_snapshot()
+                allocations_path = output_dir / f'{plugin_key}.tracemalloc.txt'
+                _write_top_allocations(snapshot, allocations_path, options['tracemalloc_top'])
+                logger.info("memory allocations of plugin %s written to %s",
+                            plugin_key, allocations_path)
+        except Exception:
+            logger.exception("failed to write profile of plugin %s", plugin_key)
+        finally:
+            if options['tracemalloc']:
+                _stop_tracemalloc()
@@ -0,0 +1,249 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Persistent cache of registry content, shared by the tasks of a build pipeline
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable, List, Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# seconds the digest a tag points to is trusted without asking the registry
+DEFAULT_TAG_TTL = 60
+
+
+def _write_atomically(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class RegistryCache:
+    """On-disk cache of manifests and blobs fetched from registries
+
+    Content addressed by a digest is immutable, it is cached for good,
+    keyed by the registry and the digest:
+
+        <path>/<registry>/sha256/<hex digest>
+
+    The content is verified against the digest when it is read back.
+
+    Tags can move, the digest of the manifest a tag points to is only
+    trusted for tag_ttl seconds:
+
+        <path>/<registry>/tags/<sha256 of repository:tag>.json
+
+    Optionally, a shared directory, e.g. a node-level directory used by all
+    the builds running on the node, is used as a second level of the cache.
+    Entries are looked up in both directories and written into both.
+    """
+
+    def __init__(
+        self, path: Path, shared_path: Optional[Path] = None, tag_ttl: float = DEFAULT_TAG_TTL
+    ):
+        """
+        :param path: Path, directory of the cache, e.g. in the context dir
+        :param shared_path: Path, optional directory shared with other builds
+        :param tag_ttl: float, seconds a cached tag is valid for, 0 disables caching of tags
+        """
+        self._paths: List[Path] = [path]
+        if shared_path is not None and shared_path != path:
+            self._paths.append(shared_path)
+        self.tag_ttl = tag_ttl
+
+    def _content_path(self, root: Path, registry: str, digest: str) -> Optional[Path]:
+        algorithm, _, hex_digest = digest.partition(":")
+        if algorithm != "sha256" or not hex_digest:
+            return None
+        return root / registry / "sha256" / hex_digest
+
+    def _tag_path(self, root: Path, registry: str, repository: str, tag: str) -> Path:
+        key = hashlib.sha256(f"{repository}:{tag}".encode("utf-8")).hexdigest()
+        return root / registry / "tags" / f"{key}.json"
+
+    def _write(self, relative_path: Path, data: bytes, roots: Optional[List[Path]] = None):
+        for root in roots or self._paths:
+            try:
+                _write_atomically(root / relative_path, data)
+            except OSError as e:
+                # the cache only saves requests, failing to write it is not an error
+                logger.warning("Failed to write %s into registry cache %s: %s",
+                               relative_path, root, e)
+
+    def get(self, registry: str, digest: str) -> Optional[requests.Response]:
+        """Get cached content by digest
+
+        :param registry: str, registry hostname
+        :param digest: str, digest of the content, e.g. sha256:abc...
+        :return: requests.Response with the content, its Content-Type and
+            Docker-Content-Digest headers; None if the content is not cached
+        """
+        for root in self._paths:
+            path = self._content_path(root, registry, digest)
+            if path is None or not path.exists():
+                continue
+            data = path.read_bytes()
+            media_type, _, content = data.partition(b"\n")
+            if f"sha256:{hashlib.sha256(content).hexdigest()}" != digest:
+                logger.warning("Ignoring corrupted registry cache entry %s", path)
+                continue
+            if root is not self._paths[0]:
+                self._write(path.relative_to(root), data, roots=self._paths[:1])
+
+            logger.debug("registry cache hit: %s@%s", registry, digest)
+            response = requests.Response()
+            response.status_code = requests.codes.ok
+            response._content = content  # pylint: disable=protected-access
+            response.encoding = "utf-8"
+            response.headers["Docker-Content-Digest"] = digest
+            if media_type:
+                response.headers["Content-Type"] = media_type.decode("utf-8")
+            return response
+        return None
+
+    def put(self, registry: str, response: requests.Response, digest: Optional[str] = None):
+        """Cache the content of a response
+
+        :param registry: str, registry hostname
+        :param response: requests.Response, successful response with the content
+        :param digest: str, digest the content was requested by, if any. The
+            content is only cached if its digest matches
+        """
+        content = response.content
+        if not content:
+            return
+        content_digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+        if digest is not None and digest != content_digest:
+            # e.g. signed schema 1 manifests, their digest is not the one of the content
+            logger.debug("Not caching %s, the content has digest %s", digest, content_digest)
+            return
+        path = self._content_path(self._paths[0], registry, content_digest)
+        if path is None or path.exists():
+            return
+        media_type = response.headers.get("Content-Type", "")
+        self._write(path.relative_to(self._paths[0]),
+                    media_type.encode("utf-8") + b"\n" + content)
+
+    def get_tag_digest(
+        self, registry: str, repository: str, tag: str, include_expired: bool = False
+    ) -> Optional[str]:
+        """Get the cached digest of the manifest a tag points to
+
+        :param registry: str, registry hostname
+        :param repository: str, e.g. namespace/repo
+        :param tag: str, the tag
+        :param include_expired: bool, return the digest even if it is older than tag_ttl
+        :return: str, the digest; None if not cached or expired
+        """
+        if not self.tag_ttl:
+            return None
+        newest = None
+        for root in self._paths:
+            path = self._tag_path(root, registry, repository, tag)
+            try:
+                entry = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if newest is None or entry["time"] > newest["time"]:
+                newest = entry
+        if newest is None:
+            return None
+        if not include_expired and time.time() - newest["time"] > self.tag_ttl:
+            return None
+        return newest["digest"]
+
+    def put_tag(self, registry: str, repository: str, tag: str, digest: str) -> None:
+        """Cache the digest of the manifest a tag points to"""
+        if not self.tag_ttl:
+            return
+        entry = {"repository": repository, "tag": tag, "digest": digest, "time": time.time()}
+        path = self._tag_path(self._paths[0], registry, repository, tag)
+        self._write(path.relative_to(self._paths[0]), json.dumps(entry).encode("utf-8"))
+
+
+class ConditionalRequestCache:
+    """In-memory cache of responses to be revalidated with conditional requests
+
+    Responses are stored with their validator, the ETag header or, if the
+    registry does not send one, the Docker-Content-Digest header. The next
+    request for the same resource sends the validator in If-None-Match, if
+    the registry answers 304 Not Modified, the cached response is used.
+
+    Safe to use from many threads. The least recently used entries are
+    dropped once max_entries responses are cached.
+    """
+
+    # headers of the cached response restored on a 304 response
+    HEADERS = ("Content-Type", "Content-Length", "Docker-Content-Digest", "ETag")
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[str, bytes, dict]]" = OrderedDict()
+
+    def get_validator(self, key: Hashable) -> Optional[str]:
+        """Get the value of the If-None-Match header for a request, None if not cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def store(self, key: Hashable, response: requests.Response) -> None:
+        """Cache a successful response, if it has a validator"""
+        validator = response.headers.get("ETag")
+        if not validator and response.headers.get("Docker-Content-Digest"):
+            validator = '"{}"'.format(response.headers["Docker-Content-Digest"])
+        if not validator:
+            return
+        headers = {name: response.headers[name] for name in self.HEADERS
+                   if name in response.headers}
+        with self._lock:
+            self._entries[key] = (validator, response.content, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def restore(self, key: Hashable, validator: str, response: requests.Response) -> bool:
+        """Turn a 304 Not Modified response into the cached response
+
+        :param validator: str, the If-None-Match header of the request
+        :return: bool, whether the response was restored from the cache; False if
+                 the entry was evicted or replaced since the request was sent
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != validator:
+                return False
+            self._entries.move_to_end(key)
+        _, content, headers = entry
+        response.status_code = requests.codes.ok
+        response._content = content  # pylint: disable=protected-access
+        response.headers.update(headers)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Process-wide cache of manifests fetched by tag, see RegistrySession.get
+manifest_revalidation_cache = ConditionalRequestCache()
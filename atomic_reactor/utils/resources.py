@@ -0,0 +1,148 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Accounting of resources used by the atomic-reactor process
+"""
+import logging
+import os
+import resource
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+ResourceUsage = Dict[str, Union[int, float]]
+
+
+class HTTPTrafficCounter(object):
+    """Count HTTP requests, connections and bytes transferred, safe to use from many threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._bytes = 0
+        self._connections = 0
+
+    def record(self, sent: int, received: int) -> None:
+        with self._lock:
+            self._requests += 1
+            self._bytes += sent + received
+
+    def record_connection(self) -> None:
+        with self._lock:
+            self._connections += 1
+
+    def get_connections(self) -> int:
+        """
+        :return: number of connections opened, fewer than requests if connections are reused
+        """
+        with self._lock:
+            return self._connections
+
+    def get_counts(self) -> Tuple[int, int]:
+        """
+        :return: tuple (number of requests, number of bytes sent and received)
+        """
+        with self._lock:
+            return self._requests, self._bytes
+
+
+# Process-wide counter of the HTTP traffic of requests sessions created by
+# atomic_reactor.utils.retries.get_retrying_requests_session
+http_traffic = HTTPTrafficCounter()
+
+
+def record_http_response(response, stream: bool = False) -> None:
+    """Count a request and the bytes transferred by it
+
+    The size of a streamed response body is only known if the server sent the
+    Content-Length header.
+
+    :param response: requests.Response, the response of the request
+    :param stream: bool, whether the response body is streamed
+    """
+    sent = received = 0
+    try:
+        body = response.request.body
+        if isinstance(body, (bytes, str)):
+            sent = len(body)
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit():
+            received = int(content_length)
+        elif not stream:
+            received = len(response.content or b'')
+    except (AttributeError, TypeError, ValueError):
+        # not a regular requests.Response, count just the request
+        pass
+    http_traffic.record(sent, received)
+
+
+def _read_proc_io() -> Dict[str, int]:
+    """Read bytes read from and written to storage by this process from /proc"""
+    try:
+        with open('/proc/self/io') as f:
+            stats = dict(line.split(':', 1) for line in f if ':' in line)
+        return {
+            'io_read_bytes': int(stats['read_bytes']),
+            'io_write_bytes': int(stats['write_bytes']),
+        }
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def get_resource_usage(path: Optional[os.PathLike] = None) -> ResourceUsage:
+    """Take a snapshot of the resources used by this process so far
+
+    Most values are cumulative for the whole process (CPU time also includes
+    finished subprocesses), a difference of two snapshots gives the usage in
+    between, see get_resource_usage_delta.
+
+    :param path: optional path on the filesystem whose usage should be included
+    :return: dict, the following keys are included when available:
+        cpu_user_seconds, cpu_system_seconds: CPU time
+        peak_rss_kb: peak resident set size in KiB
+        io_read_bytes, io_write_bytes: bytes read from and written to storage
+        http_requests, http_bytes: HTTP requests made and bytes transferred
+        http_connections: HTTP connections opened for the requests
+        disk_used_bytes: used space on the filesystem containing path
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage: ResourceUsage = {
+        'cpu_user_seconds': own.ru_utime + children.ru_utime,
+        'cpu_system_seconds': own.ru_stime + children.ru_stime,
+        'peak_rss_kb': own.ru_maxrss,
+    }
+    usage.update(_read_proc_io())
+    usage['http_requests'], usage['http_bytes'] = http_traffic.get_counts()
+    usage['http_connections'] = http_traffic.get_connections()
+
+    if path is not None:
+        try:
+            st = os.statvfs(path)
+        except OSError as e:
+            logger.debug("cannot get filesystem usage of %s: %s", path, e)
+        else:
+            usage['disk_used_bytes'] = (st.f_blocks - st.f_bfree) * st.f_frsize
+
+    return usage
+
+
+def get_resource_usage_delta(before: ResourceUsage, after: ResourceUsage) -> ResourceUsage:
+    """Compute the resources used between two snapshots
+
+    :param before: dict, snapshot taken by get_resource_usage
+    :param after: dict, later snapshot taken by get_resource_usage
+    :return: dict, difference of the values present in both snapshots
+    """
+    delta: ResourceUsage = {}
+    for key, value in after.items():
+        if key not in before:
+            continue
+        difference = value - before[key]
+        delta[key] = round(difference, 3) if isinstance(difference, float) else difference
+    return delta
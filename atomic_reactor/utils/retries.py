@@ -8,11 +8,13 @@ of the BSD license. See the LICENSE file for details.
 
 import logging
 import subprocess
-from typing import List
+import threading
+from typing import Dict, Hashable, List
 
 import backoff
 import requests
-from requests.adapters import HTTPAdapter
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.util import Retry
 
 from atomic_reactor.constants import (HTTP_CLIENT_STATUS_RETRY,
@@ -21,6 +23,7 @@ from atomic_reactor.constants import (HTTP_CLIENT_STATUS_RETRY,
                                       HTTP_REQUEST_TIMEOUT,
                                       SUBPROCESS_MAX_RETRIES,
                                       SUBPROCESS_BACKOFF_FACTOR)
+from atomic_reactor.utils import resources
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +38,34 @@ class SessionWithTimeout(requests.Session):
     # pylint: disable=signature-differs
     def request(self, *args, **kwargs):
         kwargs.setdefault('timeout', HTTP_REQUEST_TIMEOUT)
-        return super(SessionWithTimeout, self).request(*args, **kwargs)
+        response = super(SessionWithTimeout, self).request(*args, **kwargs)
+        resources.record_http_response(response, stream=kwargs.get('stream', False))
+        return response
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        resources.http_traffic.record_connection()
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        resources.http_traffic.record_connection()
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter counting the connections it opens, requests made over
+    reused connections are not counted (see resources.http_traffic)
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
 
 
 # This is a hook to mock during tests to temporarily disable retries
@@ -55,7 +85,8 @@ def hook_log_error_response_content(response, *args, **kwargs):
 
 def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
                                   times=HTTP_MAX_RETRIES, delay=HTTP_BACKOFF_FACTOR,
-                                  method_whitelist=None, raise_on_status=True):
+                                  method_whitelist=None, raise_on_status=True,
+                                  pool_maxsize=DEFAULT_POOLSIZE):
     if _http_retries_disabled():
         times = 0
 
@@ -72,13 +103,48 @@ def get_retrying_requests_session(client_statuses=HTTP_CLIENT_STATUS_RETRY,
         retry.raise_on_status = raise_on_status
 
     session = SessionWithTimeout()
-    session.mount('http://', HTTPAdapter(max_retries=retry))
-    session.mount('https://', HTTPAdapter(max_retries=retry))
+    session.mount('http://', CountingHTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize))
+    session.mount('https://', CountingHTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize))
     session.hooks['response'] = [hook_log_error_response_content]
 
     return session
 
 
+_shared_sessions: Dict[Hashable, requests.Session] = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def get_shared_requests_session(key: Hashable, **kwargs) -> requests.Session:
+    """Get a retrying session shared by the whole process
+
+    Sessions keep their connections open, sharing them saves the TCP and TLS
+    handshakes of the sessions created over and over again for the same server.
+
+    :param key: identifies the session, e.g. the server, TLS settings and
+        credentials; a session is created for each key
+    :param kwargs: arguments of get_retrying_requests_session, used only when
+        the session is created
+    :return: requests.Session
+    """
+    # sessions created while retries are disabled (in tests) must not be shared with others
+    key = (key, _http_retries_disabled())
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(key)
+        if session is None:
+            logger.debug("Creating shared HTTP session for %s", key[0])
+            session = get_retrying_requests_session(**kwargs)
+            _shared_sessions[key] = session
+        return session
+
+
+def close_shared_requests_sessions() -> None:
+    """Close the shared sessions and their connections"""
+    with _shared_sessions_lock:
+        for session in _shared_sessions.values():
+            session.close()
+        _shared_sessions.clear()
+
+
 @backoff.on_exception(
     backoff.expo,
     subprocess.CalledProcessError,
@@ -0,0 +1,133 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+
+Benchmark of loading and saving a large workflow.json
+
+Run from the repository root:
+
+    python -m tests.benchmark_workflow_data [--repeat N]
+"""
+import argparse
+import json
+import tempfile
+import timeit
+from pathlib import Path
+
+from osbs.utils import ImageName
+from osbs.utils import yaml as osbs_yaml
+
+from atomic_reactor import inner
+from atomic_reactor.dirs import ContextDir
+from atomic_reactor.inner import (BuildResult, ImageBuildWorkflowData, TagConf,
+                                  WORKFLOW_DATA_SECTIONS, WorkflowDataDecoder,
+                                  WorkflowDataEncoder)
+from atomic_reactor.util import DockerfileImages
+
+DIGEST = "sha256:" + "a" * 64
+
+
+def make_workflow_data(n_images: int = 5000, n_rpms: int = 20000) -> ImageBuildWorkflowData:
+    """Create workflow data similar to that of a build of a large operator bundle"""
+    tag_conf = TagConf()
+    for i in range(100):
+        tag_conf.add_unique_image(ImageName.parse(f"registry.example.com/ns/image:unique-{i}"))
+
+    pullspecs = [
+        {
+            "original": f"registry.example.com/ns/operand-{i}:v1.0",
+            "new": f"registry.example.com/ns/operand-{i}@{DIGEST}",
+            "pinned": True,
+            "replaced": False,
+        }
+        for i in range(n_images)
+    ]
+    remote_sources = [
+        {
+            "name": f"source-{i}",
+            "url": f"https://cachito.example.com/api/v1/requests/{i}/download",
+            "dependencies": [{"name": f"dep-{j}", "version": "1.0", "type": "gomod"}
+                             for j in range(100)],
+        }
+        for i in range(20)
+    ]
+    rpms = [
+        {
+            "type": "rpm", "name": f"package-{i}", "version": "1.0", "release": "1.el8",
+            "arch": "x86_64", "epoch": None, "sigmd5": "f" * 32, "signature": None,
+        }
+        for i in range(n_rpms)
+    ]
+    return ImageBuildWorkflowData(
+        dockerfile_images=DockerfileImages(["registry.example.com/ns/base:latest"]),
+        tag_conf=tag_conf,
+        prebuild_results={
+            "pin_operator_digest": {"pullspecs": pullspecs},
+            "resolve_remote_source": remote_sources,
+        },
+        buildstep_result={"binary_container": BuildResult(image_id="sha256:1234")},
+        postbuild_results={
+            "tag_and_push": [ImageName.parse(f"registry.example.com/ns/image:{i}")
+                             for i in range(100)],
+        },
+        image_components=rpms,
+    )
+
+
+def legacy_load(context_dir: ContextDir) -> None:
+    """Load workflow data the way it was done before: parse twice, load the schema each time"""
+    file_content = context_dir.workflow_json.read_text()
+    raw_data = json.loads(file_content)
+    schema = osbs_yaml.load_schema("atomic_reactor", "schemas/workflow_data.json")
+    osbs_yaml.validate_with_schema(raw_data, schema)
+    workflow_data = json.loads(file_content, object_hook=WorkflowDataDecoder())
+    build_result = workflow_data.pop("build_result")
+    loaded_data = ImageBuildWorkflowData(**workflow_data)
+    loaded_data.build_result = build_result
+
+
+def legacy_save(wf_data: ImageBuildWorkflowData, context_dir: ContextDir) -> None:
+    with open(context_dir.workflow_json, "w+") as f:
+        json.dump(wf_data.as_dict(), f, cls=WorkflowDataEncoder)
+
+
+def load_all_sections(context_dir: ContextDir) -> None:
+    wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+    for name in WORKFLOW_DATA_SECTIONS:
+        getattr(wf_data, name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark of loading and saving workflow data")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    wf_data = make_workflow_data()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        context_dir = ContextDir(Path(tmpdir) / "sections")
+        legacy_context_dir = ContextDir(Path(tmpdir) / "legacy")
+        wf_data.save(context_dir)
+        legacy_save(wf_data, legacy_context_dir)
+        size = legacy_context_dir.workflow_json.stat().st_size
+        print(f"workflow data: {size / 1024 / 1024:.1f} MiB, "
+              f"orjson {'available' if inner.orjson else 'not available'}")
+
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        benchmarks = [
+            ("load (legacy)", lambda: legacy_load(legacy_context_dir)),
+            ("load", lambda: ImageBuildWorkflowData.load_from_dir(context_dir)),
+            ("load (all sections)", lambda: load_all_sections(context_dir)),
+            ("save (legacy)", lambda: legacy_save(wf_data, legacy_context_dir)),
+            ("save", lambda: wf_data.save(context_dir)),
+            ("save (unchanged)", lambda: loaded_wf_data.save(context_dir)),
+        ]
+        for name, func in benchmarks:
+            seconds = min(timeit.repeat(func, number=1, repeat=args.repeat))
+            print(f"{name:>20}: {seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
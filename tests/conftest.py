@@ -12,9 +12,12 @@ from pathlib import Path
 import pytest
 import requests
 import requests.exceptions
+from atomic_reactor.auth import bearer_token_cache
 from atomic_reactor.constants import DOCKERFILE_FILENAME
 from atomic_reactor.dirs import RootBuildDir
 from atomic_reactor.source import DummySource
+from atomic_reactor.utils.registry_cache import manifest_revalidation_cache
+from atomic_reactor.utils.retries import close_shared_requests_sessions
 from tests.constants import LOCALHOST_REGISTRY_HTTP, DOCKER0_REGISTRY_HTTP, TEST_IMAGE
 from tests.util import uuid_value
 
@@ -22,6 +25,17 @@ from osbs.utils import ImageName
 from atomic_reactor.inner import DockerBuildWorkflow
 
 
+@pytest.fixture(autouse=True)
+def clear_http_caches():
+    """Do not share registry tokens, responses and HTTP sessions between tests.
+
+    They are cached for the whole process.
+    """
+    bearer_token_cache.clear()
+    manifest_revalidation_cache.clear()
+    close_shared_requests_sessions()
+
+
 @pytest.fixture()
 def temp_image_name():
     return ImageName(repo=("atomic-reactor-tests-%s" % uuid_value()))
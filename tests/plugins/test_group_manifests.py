@@ -50,6 +50,7 @@ class MockRegistry(object):
     def __init__(self, registry):
         self.hostname = registry_hostname(registry)
         self.repos = {}
+        self.cancelled_uploads = []
         self._add_pattern(responses.GET, r'/v2/(.*)/manifests/([^/]+)',
                           self._get_manifest)
         self._add_pattern(responses.HEAD, r'/v2/(.*)/manifests/([^/]+)',
@@ -62,6 +63,8 @@ class MockRegistry(object):
                           self._get_blob)
         self._add_pattern(responses.POST, r'/v2/(.*)/blobs/uploads/\?mount=([^&]+)&from=(.+)',
                           self._mount_blob)
+        self._add_pattern(responses.DELETE, r'/v2/(.*)/blobs/uploads/([^/?]+)',
+                          self._cancel_upload)
 
     def get_repo(self, name):
         return self.repos.setdefault(name, {
@@ -176,6 +179,10 @@ class MockRegistry(object):
             }
             return (202, headers, '')
 
+    def _cancel_upload(self, req, name, uuid):
+        self.cancelled_uploads.append((name, uuid))
+        return (204, {}, '')
+
 
 def mock_registries(registries, config, schema_version='v2', foreign_layers=False,
                     manifest_list_tag=None):
@@ -482,6 +489,16 @@ def test_group_manifests(workflow, source_dir, schema_version, test_name, group,
     if expected_exception is None:
         results = runner.run()
 
+        # blobs are mounted without checking they exist first
+        assert not [call for call in responses.calls
+                    if call.request.method == 'HEAD' and '/blobs/' in call.request.url]
+        # blobs are linked only once into each repository, whatever the number of tags
+        mounts = [call.request.url for call in responses.calls if call.request.method == 'POST']
+        assert len(mounts) == len(set(mounts))
+        if foreign_layers:
+            # uploads started instead of mounting the missing foreign layers are cancelled
+            assert all(registry.cancelled_uploads for registry in mocked_registries.values())
+
         manifest_type, list_type = {
             'v2': (
                 'application/vnd.docker.distribution.manifest.v2+json',
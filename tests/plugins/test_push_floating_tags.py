@@ -18,6 +18,7 @@ from tests.mock_env import MockEnv
 from atomic_reactor.inner import BuildResult
 from atomic_reactor.util import registry_hostname, ManifestDigest, sha256sum
 from osbs.utils import ImageName
+from atomic_reactor.plugin import PluginFailedException
 from atomic_reactor.plugins.exit_push_floating_tags import PushFloatingTagsPlugin
 from atomic_reactor.constants import PLUGIN_GROUP_MANIFESTS_KEY
 
@@ -478,3 +479,42 @@ def test_floating_tags_push(workflow, tmpdir, test_name, registries, manifest_re
     else:
         assert not plugin_result
         assert expected_exception in caplog.text
+
+
+@responses.activate
+def test_floating_tags_push_failures(workflow, tmpdir, caplog):
+    primary_images = ['namespace/httpd:2.4', 'namespace/httpd:primary']
+    floating_tags = ['namespace/httpd:latest', 'namespace/httpd:flaky', 'namespace/httpd:broken']
+    attempts = {}
+
+    def put_manifest(request):
+        tag = request.url.rsplit('/', 1)[-1]
+        attempts[tag] = attempts.get(tag, 0) + 1
+        if tag == 'broken' or (tag == 'flaky' and attempts[tag] == 1):
+            return 400, {}, '{"errors": [{"code": "TAG_INVALID"}]}'
+        return 201, {}, ''
+
+    responses.add_callback(responses.PUT,
+                           re.compile(r'^https://{}/v2/namespace/httpd/manifests/.+$'
+                                      .format(REGISTRY_V2)),
+                           callback=put_manifest)
+
+    tmpdir.join('.dockercfg').write(json.dumps({
+        REGISTRY_V2: {'username': 'user', 'password': DOCKER0_REGISTRY}
+    }))
+    env = mock_environment(workflow, primary_images=primary_images,
+                           floating_images=floating_tags,
+                           manifest_results=GROUPED_V2_RESULTS)
+    env.make_orchestrator()
+    env.set_reactor_config({
+        'version': 1,
+        'registries': [{'url': 'https://{}/v2'.format(REGISTRY_V2),
+                        'auth': {'cfg_path': str(tmpdir)}}],
+    })
+
+    with pytest.raises(PluginFailedException, match='Failed to push 1 of 3 floating tags'):
+        env.create_runner().run()
+
+    # the failed tags are retried, each tag is pushed once it succeeds
+    assert attempts == {'latest': 1, 'flaky': 2, 'broken': PushFloatingTagsPlugin.max_tries}
+    assert 'Failed to push floating tag namespace/httpd:broken' in caplog.text
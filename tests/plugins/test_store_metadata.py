@@ -200,6 +200,9 @@ CMD blabla"""
     workflow.data.plugins_durations = {
         PostBuildRPMqaPlugin.key: 3.03,
     }
+    workflow.data.plugins_resources = {
+        PostBuildRPMqaPlugin.key: {'cpu_user_seconds': 1.5, 'http_requests': 2},
+    }
     workflow.data.plugins_errors = {}
 
     if koji:
@@ -298,6 +301,9 @@ CMD blabla"""
 
     plugins_metadata = json.loads(annotations["plugins-metadata"])
     assert "all_rpm_packages" in plugins_metadata["durations"]
+    assert plugins_metadata["resources"]["all_rpm_packages"] == {
+        'cpu_user_seconds': 1.5, 'http_requests': 2,
+    }
 
     if br_annotations:
         assert annotations['br_annotations'] == expected_br_annotations
@@ -605,3 +605,21 @@ def test_exceed_binary_image_size(image_size_limit, workflow):
     else:
         with pytest.raises(ExceedsImageSizeError):
             plugin.run()
+
+
+def test_push_checked_with_stored_digest(workflow, caplog):
+    workflow.conf.conf = {'version': 1, 'registries': [{'url': LOCALHOST_REGISTRY}]}
+    workflow.data.layer_sizes = []
+    flexmock(time).should_receive('sleep')
+
+    (flexmock(atomic_reactor.plugins.post_tag_and_push)
+     .should_receive('get_manifest_digests')
+     .with_args(object, workflow.conf.registry['uri'], False, None, versions=('v2', 'oci'),
+                require_digest=False, single_request=True)
+     .and_return(ManifestDigest())
+     .and_return(ManifestDigest({'v2': DIGEST_V2}))
+     .twice())
+
+    plugin = TagAndPushPlugin(workflow)
+    assert workflow.image == plugin.run()[0].repo
+    assert "Retrying push because V2 schema 2" in caplog.text
@@ -93,6 +93,7 @@ class TestPluginBasedTask:
                 plugins=expect_plugins,
                 user_params={"a": "b"},
                 reactor_config_path="config.yaml",
+                context_dir=ContextDir,
             )
         )
         mocked_workflow.should_receive("build_docker_image").and_raise(
@@ -110,7 +110,6 @@ class TestHTTPBearerAuth(object):
         responses.add(responses.GET, fedora_url, status=200, json='fedora-success-also')
 
         centos_url = 'https://registry.example.com/v2/centos/tags/list'
-        responses.add_callback(responses.GET, centos_url, callback=bearer_unauthorized_callback)
         responses.add(responses.GET, centos_url, status=200, json='centos-success')
         responses.add(responses.GET, centos_url, status=200, json='centos-success-also')
 
@@ -119,10 +118,112 @@ class TestHTTPBearerAuth(object):
         assert requests.get(fedora_url, auth=auth).json() == 'fedora-success'
         assert requests.get(fedora_url, auth=auth).json() == 'fedora-success-also'
 
+        # the registry is known to require a token, it is fetched without a 401 round-trip
         assert requests.get(centos_url, auth=auth).json() == 'centos-success'
         assert requests.get(centos_url, auth=auth).json() == 'centos-success-also'
 
-        assert len(responses.calls) == 8
+        assert len(responses.calls) == 7
+
+    @responses.activate
+    @pytest.mark.parametrize(('other_username', 'shared'), (
+        ('spam', True),
+        ('eggs', False),
+    ))
+    def test_token_shared_by_instances(self, other_username, shared):
+        responses.add(responses.GET, BEARER_REALM_URL + '?scope=repository:fedora:pull',
+                      json={'token': BEARER_TOKEN}, match_querystring=True)
+        url = 'https://registry.example.com/v2/fedora/tags/list'
+        responses.add_callback(responses.GET, url, callback=bearer_unauthorized_callback)
+        responses.add_callback(responses.GET, url, callback=bearer_success_callback)
+
+        auth = HTTPBearerAuth(username='spam', password='bacon')
+        assert requests.get(url, auth=auth).json() == 'success'
+        assert len(responses.calls) == 3
+
+        # tokens are not shared by instances with other credentials
+        other_auth = HTTPBearerAuth(username=other_username, password='bacon')
+        assert requests.get(url, auth=other_auth).json() == 'success'
+        assert len(responses.calls) == (4 if shared else 5)
+
+    @responses.activate
+    @pytest.mark.parametrize(('expires_in', 'realm_calls'), (
+        (300, 1),
+        (5, 2),
+    ))
+    def test_token_expiry(self, expires_in, realm_calls):
+        responses.add(responses.GET, BEARER_REALM_URL + '?scope=repository:fedora:pull',
+                      json={'access_token': BEARER_TOKEN, 'expires_in': expires_in},
+                      match_querystring=True)
+        url = 'https://registry.example.com/v2/fedora/tags/list'
+        responses.add_callback(responses.GET, url, callback=bearer_unauthorized_callback)
+        responses.add_callback(responses.GET, url, callback=bearer_success_callback)
+
+        auth = HTTPBearerAuth()
+        assert requests.get(url, auth=auth).json() == 'success'
+        # tokens about to expire are not used
+        assert requests.get(url, auth=auth).json() == 'success'
+
+        assert len([call for call in responses.calls
+                    if call.request.url.startswith(BEARER_REALM_URL)]) == realm_calls
+
+    @responses.activate
+    def test_cached_token_refused(self):
+        tokens = iter(['old-token', BEARER_TOKEN])
+        responses.add_callback(
+            responses.GET, BEARER_REALM_URL + '?scope=repository:fedora:pull',
+            callback=lambda request: (200, {}, json.dumps({'token': next(tokens)})),
+            match_querystring=True,
+        )
+        url = 'https://registry.example.com/v2/fedora/tags/list'
+        responses.add_callback(responses.GET, url, callback=bearer_unauthorized_callback)
+        responses.add(responses.GET, url, status=200, json='success')
+        # e.g. the token was revoked
+        responses.add_callback(responses.GET, url, callback=bearer_unauthorized_callback)
+        responses.add_callback(responses.GET, url, callback=bearer_success_callback)
+
+        auth = HTTPBearerAuth()
+        assert requests.get(url, auth=auth).json() == 'success'
+        assert requests.get(url, auth=auth).json() == 'success'
+        assert len(responses.calls) == 6
+
+    @responses.activate
+    def test_prefetch_tokens(self):
+        realm_query = ('?service=registry.example.com'
+                       '&scope=repository:fedora:pull,push&scope=repository:spam/centos:pull,push')
+        responses.add(responses.GET, BEARER_REALM_URL + realm_query,
+                      json={'token': BEARER_TOKEN}, match_querystring=True)
+
+        def ping_callback(request):
+            headers = {'www-authenticate': 'Bearer realm="{}",service="registry.example.com"'
+                                           .format(BEARER_REALM_URL)}
+            return (401, headers, json.dumps('unauthorized'))
+
+        responses.add_callback(responses.GET, 'https://registry.example.com/v2/',
+                               callback=ping_callback)
+        for repo in ('fedora', 'spam/centos'):
+            responses.add_callback(responses.GET,
+                                   'https://registry.example.com/v2/{}/tags/list'.format(repo),
+                                   callback=bearer_success_callback)
+
+        auth = HTTPBearerAuth(access=('pull', 'push'))
+        auth.prefetch_tokens('https://registry.example.com',
+                             ['fedora', 'spam/centos', 'fedora'])
+        assert len(responses.calls) == 2
+
+        auth.prefetch_tokens('https://registry.example.com', ['fedora'])
+        for repo in ('fedora', 'spam/centos'):
+            url = 'https://registry.example.com/v2/{}/tags/list'.format(repo)
+            assert requests.get(url, auth=auth).json() == 'success'
+        assert len(responses.calls) == 4
+
+    @responses.activate
+    @pytest.mark.parametrize('ping_status', (200, 404))
+    def test_prefetch_tokens_not_needed(self, ping_status):
+        responses.add(responses.GET, 'https://registry.example.com/v2/', status=ping_status)
+
+        auth = HTTPBearerAuth()
+        auth.prefetch_tokens('https://registry.example.com', ['fedora'])
+        assert len(responses.calls) == 1
 
     @responses.activate
     @pytest.mark.parametrize(('partial_url', 'repo'), (
@@ -354,6 +354,11 @@ class TestContextDir:
         # The ContextDir does not ensure workflow.json is created by itself.
         assert not expected.exists()
 
+    def test_get_workflow_data_file(self, tmpdir):
+        expected = Path(tmpdir.join("workflow_data", "tag_conf.json"))
+        assert expected == ContextDir(Path(tmpdir)).get_workflow_data_file("tag_conf")
+        assert not expected.parent.exists()
+
     @pytest.mark.parametrize("platform,error", [
         [None, pytest.raises(ValueError, match="No platform is specified")],
         ["", pytest.raises(ValueError, match="No platform is specified")],
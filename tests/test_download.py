@@ -6,18 +6,23 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
-from io import BufferedReader, BytesIO
+from io import BufferedReader, BytesIO, RawIOBase
+import hashlib
 import os
 import requests
 import responses
 import tempfile
+import threading
 import time
 
 import pytest
 from flexmock import flexmock
+from urllib3.exceptions import ProtocolError
 
+import atomic_reactor.download
 from atomic_reactor.util import get_retrying_requests_session
-from atomic_reactor.download import download_url
+from atomic_reactor.download import Download, download_url, download_urls
+from atomic_reactor.utils.artifact_cache import ArtifactCache
 
 
 class TestDownloadUrl(object):
@@ -49,7 +54,7 @@ class TestDownloadUrl(object):
         dest_dir = tempfile.mkdtemp()
         session = get_retrying_requests_session()
         # get response shows successful connection
-        response = flexmock()
+        response = flexmock(headers={})
         (response
          .should_receive('raise_for_status'))
         # but streaming from the response fails
@@ -65,3 +70,252 @@ class TestDownloadUrl(object):
          .should_receive('sleep'))
         with pytest.raises(requests.exceptions.RequestException):
             download_url(url, dest_dir, session=session)
+
+    @responses.activate
+    def test_cache(self, tmp_path):
+        url = 'https://example.com/path/file'
+        content = b'abc'
+        checksums = {'sha256': hashlib.sha256(content).hexdigest()}
+        responses.add(responses.GET, url, body=content)
+        cache = ArtifactCache(tmp_path / 'cache')
+        (tmp_path / 'build-1').mkdir()
+        (tmp_path / 'build-2').mkdir()
+
+        download_url(url, tmp_path / 'build-1', expected_checksums=checksums, cache=cache)
+        result = download_url(url, tmp_path / 'build-2', expected_checksums=checksums,
+                              cache=cache)
+
+        assert len(responses.calls) == 1
+        with open(result, 'rb') as f:
+            assert f.read() == content
+
+        # downloading again to a path linked to the entry does not modify the entry
+        responses.add(responses.GET, url + '2', body=b'other')
+        download_url(url + '2', tmp_path / 'build-2', dest_filename='file')
+        with open(result, 'rb') as f:
+            assert f.read() == b'other'
+        assert cache.get(url, checksums, tmp_path / 'build-1' / 'file')
+        with open(tmp_path / 'build-1' / 'file', 'rb') as f:
+            assert f.read() == content
+        assert sorted(os.listdir(tmp_path / 'build-2')) == ['file']
+
+
+class FlakyStream(RawIOBase):
+    """Stream failing once the first fail_after bytes are read"""
+
+    def __init__(self, content, fail_after):
+        self.content = content
+        self.fail_after = fail_after
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos >= self.fail_after:
+            raise ProtocolError('Connection broken')
+        n = min(len(b), self.fail_after - self.pos)
+        b[:n] = self.content[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+class TestResumeDownload(object):
+    url = 'https://example.com/path/file'
+    content = b'0123456789'
+
+    def mock_server(self, resumed_response, validator_headers=None):
+        requested = []
+
+        def callback(request):
+            requested.append((request.headers.get('Range'), request.headers.get('If-Range')))
+            if len(requested) == 1:
+                headers = validator_headers or {'ETag': '"v1"'}
+                return 200, headers, BufferedReader(FlakyStream(self.content, 4), buffer_size=1)
+            return resumed_response(request)
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+        return requested
+
+    @pytest.fixture(autouse=True)
+    def small_blocks(self, monkeypatch):
+        monkeypatch.setattr(atomic_reactor.download, 'DEFAULT_DOWNLOAD_BLOCK_SIZE', 1)
+        flexmock(time).should_receive('sleep')
+
+    @pytest.mark.parametrize('validator_headers, if_range', [
+        ({'ETag': '"v1"'}, '"v1"'),
+        ({'ETag': 'W/"v1"', 'Last-Modified': 'Mon, 07 Feb 2022 10:00:00 GMT'},
+         'Mon, 07 Feb 2022 10:00:00 GMT'),
+    ])
+    @responses.activate
+    def test_resume(self, tmp_path, validator_headers, if_range):
+        requested = self.mock_server(
+            lambda request: (206, {'Content-Range': 'bytes 4-9/10'}, self.content[4:]),
+            validator_headers)
+        checksums = {'sha256': hashlib.sha256(self.content).hexdigest()}
+
+        path = download_url(self.url, tmp_path, expected_checksums=checksums)
+
+        assert requested == [(None, None), ('bytes=4-', if_range)]
+        with open(path, 'rb') as f:
+            assert f.read() == self.content
+
+    @responses.activate
+    def test_resume_not_supported(self, tmp_path):
+        # e.g. the file changed, the server sends it all
+        requested = self.mock_server(lambda request: (200, {}, self.content))
+
+        path = download_url(self.url, tmp_path,
+                            expected_checksums={'md5': hashlib.md5(self.content).hexdigest()})
+
+        assert requested == [(None, None), ('bytes=4-', '"v1"')]
+        with open(path, 'rb') as f:
+            assert f.read() == self.content
+
+    @responses.activate
+    def test_no_validator(self, tmp_path):
+        requested = self.mock_server(lambda request: (200, {}, self.content),
+                                     validator_headers={'Accept-Ranges': 'none', 'ETag': '"v1"'})
+
+        path = download_url(self.url, tmp_path)
+
+        assert requested == [(None, None), (None, None)]
+        with open(path, 'rb') as f:
+            assert f.read() == self.content
+
+    @responses.activate
+    def test_resumed_checksum_mismatch(self, tmp_path):
+        def resumed_response(request):
+            if request.headers.get('Range'):
+                # the server ignored that the file changed
+                return 206, {'Content-Range': 'bytes 4-9/10'}, b'abcdef'
+            return 200, {}, self.content
+
+        requested = self.mock_server(resumed_response)
+        checksums = {'sha256': hashlib.sha256(self.content).hexdigest()}
+
+        path = download_url(self.url, tmp_path, expected_checksums=checksums)
+
+        assert requested == [(None, None), ('bytes=4-', '"v1"'), (None, None)]
+        with open(path, 'rb') as f:
+            assert f.read() == self.content
+
+    @responses.activate
+    def test_resume_wrong_range(self, tmp_path):
+        def resumed_response(request):
+            if request.headers.get('Range'):
+                return 206, {'Content-Range': 'bytes 2-9/10'}, self.content[2:]
+            return 200, {}, self.content
+
+        requested = self.mock_server(resumed_response)
+
+        path = download_url(self.url, tmp_path)
+
+        assert requested == [(None, None), ('bytes=4-', '"v1"'), (None, None)]
+        with open(path, 'rb') as f:
+            assert f.read() == self.content
+
+    @responses.activate
+    def test_resume_range_not_satisfiable(self, tmp_path):
+        def resumed_response(request):
+            if request.headers.get('Range'):
+                # e.g. the previous attempt failed after the last byte
+                return 416, {'Content-Range': 'bytes */4'}, b''
+            return 200, {}, self.content
+
+        requested = self.mock_server(resumed_response)
+        checksums = {'sha256': hashlib.sha256(self.content).hexdigest()}
+
+        path = download_url(self.url, tmp_path, expected_checksums=checksums)
+
+        assert requested == [(None, None), ('bytes=4-', '"v1"'), (None, None)]
+        with open(path, 'rb') as f:
+            assert f.read() == self.content
+
+
+class TestDownloadUrls(object):
+    @responses.activate
+    def test_happy_path(self, tmp_path):
+        downloads = []
+        for i in range(10):
+            content = 'content {}'.format(i).encode()
+            url = 'https://example{}.com/path/file{}'.format(i % 2, i)
+            responses.add(responses.GET, url, body=content)
+            checksums = {'sha256': hashlib.sha256(content).hexdigest()}
+            downloads.append(Download(url, tmp_path, expected_checksums=checksums))
+        downloads.append(Download('https://example0.com/path/file0', tmp_path / 'subdir',
+                                  dest_filename='renamed'))
+        (tmp_path / 'subdir').mkdir()
+
+        paths = download_urls(downloads, max_workers=4, max_per_host=2)
+
+        # paths are returned in the order of the downloads
+        assert paths == [str(tmp_path / 'file{}'.format(i)) for i in range(10)] + \
+            [str(tmp_path / 'subdir' / 'renamed')]
+        for i in range(10):
+            assert (tmp_path / 'file{}'.format(i)).read_bytes() == 'content {}'.format(i).encode()
+        assert (tmp_path / 'subdir' / 'renamed').read_bytes() == b'content 0'
+
+    def test_max_per_host(self, tmp_path):
+        lock = threading.Lock()
+        active = {}
+        max_active = {}
+        threads = set()
+
+        def fake_download_url(url, dest_dir, **kwargs):
+            host = url.split('/')[2]
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                max_active[host] = max(max_active.get(host, 0), active[host])
+                threads.add(threading.get_ident())
+            time.sleep(0.01)
+            with lock:
+                active[host] -= 1
+            return os.path.join(dest_dir, os.path.basename(url))
+
+        flexmock(atomic_reactor.download).should_receive('download_url').replace_with(
+            fake_download_url)
+
+        downloads = [Download('https://{}/file{}'.format(host, i), tmp_path)
+                     for i, host in enumerate(['a.example.com', 'b.example.com'] * 10)]
+        for i in range(20):
+            (tmp_path / 'file{}'.format(i)).write_bytes(b'')
+        download_urls(downloads, max_workers=8, max_per_host=2)
+
+        assert max_active == {'a.example.com': 2, 'b.example.com': 2}
+        # no more workers than the hosts can use
+        assert len(threads) <= 4
+
+        threads.clear()
+        download_urls(downloads[::2], max_workers=8, max_per_host=2)
+        assert len(threads) <= 2
+
+    @responses.activate
+    def test_same_dest(self, tmp_path):
+        responses.add(responses.GET, 'https://example.com/file', body=b'content')
+        responses.add(responses.GET, 'https://example.com/other/file', body=b'other')
+
+        downloads = [Download('https://example.com/file', tmp_path)] * 3
+        paths = download_urls(downloads)
+
+        assert paths == [str(tmp_path / 'file')] * 3
+        assert len(responses.calls) == 1
+
+        downloads.append(Download('https://example.com/other/file', tmp_path))
+        with pytest.raises(ValueError, match='Conflicting downloads'):
+            download_urls(downloads)
+        assert len(responses.calls) == 1
+
+    @responses.activate
+    def test_failure(self, tmp_path):
+        responses.add(responses.GET, 'https://example.com/good', body=b'good')
+        responses.add(responses.GET, 'https://example.com/bad', body=b'bad')
+        downloads = [
+            Download('https://example.com/good', tmp_path),
+            Download('https://example.com/bad', tmp_path, expected_checksums={'md5': 'wrong'}),
+        ]
+        with pytest.raises(ValueError, match='does not match expected checksum'):
+            download_urls(downloads)
+
+    def test_empty(self):
+        assert download_urls([]) == []
@@ -9,7 +9,7 @@ of the BSD license. See the LICENSE file for details.
 import logging
 import json
 import os
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from dataclasses import fields, Field
 from pathlib import Path
 
@@ -18,7 +18,8 @@ from dockerfile_parse import DockerfileParser
 from textwrap import dedent
 
 import osbs.exceptions
-from atomic_reactor.dirs import ContextDir
+from atomic_reactor import inner
+from atomic_reactor.dirs import ContextDir, RootBuildDir
 from atomic_reactor.plugin import (PreBuildPlugin, PrePublishPlugin, PostBuildPlugin, ExitPlugin,
                                    PluginFailedException,
                                    BuildStepPlugin, InappropriateBuildStepError)
@@ -31,9 +32,11 @@ import signal
 
 from atomic_reactor.inner import (BuildResults, BuildResultsEncoder,
                                   BuildResultsJSONDecoder, DockerBuildWorkflow,
-                                  FSWatcher, ImageBuildWorkflowData, BuildResult, TagConf)
+                                  FSWatcher, ImageBuildWorkflowData, BuildResult, TagConf,
+                                  WORKFLOW_DATA_SECTIONS, WorkflowDataEncoder)
 from atomic_reactor.constants import PLUGIN_BUILD_ORCHESTRATE_KEY
 from atomic_reactor.source import PathSource, DummySource
+from atomic_reactor.utils.blobs import BlobStore
 from atomic_reactor.util import (
     DockerfileImages, df_parser, validate_with_schema, graceful_chain_get
 )
@@ -1013,6 +1016,19 @@ def test_workflow_is_orchestrator_build(buildstep_plugins, is_orchestrator, buil
     assert workflow.is_orchestrator_build() == is_orchestrator
 
 
+@pytest.mark.parametrize('has_context_dir', [True, False])
+def test_workflow_blob_store(has_context_dir, build_dir, tmpdir):
+    context_dir = ContextDir(Path(tmpdir.join("context_dir"))) if has_context_dir else None
+    workflow = DockerBuildWorkflow(RootBuildDir(build_dir), source=None, context_dir=context_dir)
+
+    ref = workflow.blob_store.put(b"big content")
+
+    expected_dir = context_dir.blobs_dir if has_context_dir else build_dir / "blobs"
+    assert workflow.blob_store.path == expected_dir
+    assert workflow.blob_store.get_path(ref).parent.parent == expected_dir
+    assert workflow.blob_store.get(ref) == b"big content"
+
+
 def test_parent_images_to_str(caplog, build_dir):
     workflow = DockerBuildWorkflow(build_dir, source=None)
     workflow.data.dockerfile_images = DockerfileImages(['fedora:latest', 'bacon'])
@@ -1101,6 +1117,69 @@ def test_fs_watcher(monkeypatch):
     assert "mb_used" in w.get_usage_data()
 
 
+def test_fs_watcher_plugins(monkeypatch, tmpdir):
+    used_blocks = {"/": 10, str(tmpdir): 100}
+
+    def statvfs(path):
+        return flexmock(f_frsize=1000 ** 2, f_blocks=1000, f_bfree=1000 - used_blocks[path],
+                        f_files=1000, f_ffree=1000 - used_blocks[path])
+
+    monkeypatch.setattr(os, "statvfs", statvfs)
+    series_path = Path(tmpdir) / "fs_usage.jsonl"
+    w = FSWatcher({"root": "/", "build_dir": str(tmpdir)}, series_path=series_path)
+    w.start()
+
+    with w.watch_plugin("small_plugin"):
+        used_blocks[str(tmpdir)] = 200
+    with w.watch_plugin("big_plugin"):
+        used_blocks[str(tmpdir)] = 500
+    # freed space does not change the peak
+    with w.watch_plugin("cleanup_plugin"):
+        used_blocks[str(tmpdir)] = 100
+
+    w.finish()
+    w.join(1)
+    assert not w.is_alive()
+
+    data = w.get_usage_data()
+    # usage of the first filesystem is at the top level
+    assert data["mb_used"] == 10
+    assert data["filesystems"]["root"]["mb_used"] == 10
+    build_dir_data = data["filesystems"]["build_dir"]
+    assert build_dir_data["path"] == str(tmpdir)
+    assert build_dir_data["mb_used"] == 500
+    assert build_dir_data["mb_free"] == 500
+    assert build_dir_data["peak_plugins"] == ["big_plugin"]
+    assert build_dir_data["inodes_used"] == 500
+    assert build_dir_data["inodes_peak_plugins"] == ["big_plugin"]
+
+    samples = [json.loads(line) for line in series_path.read_text().splitlines()]
+    plugin_samples = {
+        sample["plugins"][0]: sample["filesystems"]["build_dir"]["mb_used"]
+        for sample in samples if sample["plugins"]
+    }
+    assert plugin_samples == {"small_plugin": 200, "big_plugin": 500, "cleanup_plugin": 100}
+
+
+def test_fs_watcher_adaptive_interval(monkeypatch):
+    used_blocks = [0]
+    monkeypatch.setattr(os, "statvfs", lambda path: flexmock(
+        f_frsize=1000 ** 2, f_blocks=1000, f_bfree=1000 - used_blocks[0],
+        f_files=1000, f_ffree=1000))
+    w = FSWatcher()
+
+    w._sample()
+    w._sample()
+    assert w._interval > FSWatcher.min_interval
+    for _ in range(10):
+        w._sample()
+    assert w._interval == FSWatcher.max_interval
+
+    used_blocks[0] += FSWatcher.mb_threshold
+    w._sample()
+    assert w._interval == FSWatcher.min_interval
+
+
 def test_build_result():
     with pytest.raises(AssertionError):
         BuildResult(fail_reason='it happens', image_id='spam')
@@ -1312,16 +1391,36 @@ class TestWorkflowData:
         data.prebuild_results["plugin_1"] = "result"
         data.save(context_dir)
 
-        saved_data = json.loads(context_dir.workflow_json.read_bytes())
+        section_file = context_dir.get_workflow_data_file(data_path[0])
+        saved_data = json.loads(section_file.read_bytes())
         # Make data invalid
         graceful_chain_get(saved_data, *data_path, make_copy=False)[prop_name] = wrong_value
+        section_file.write_text(json.dumps(saved_data), encoding="utf-8")
+
+        loaded_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        # Sections are validated when they are loaded
+        with pytest.raises(osbs.exceptions.OsbsValidationException):
+            getattr(loaded_data, data_path[0])
+
+    def test_load_invalid_core_data_from_directory(self, tmpdir):
+        context_dir = ContextDir(Path(tmpdir.join("context_dir").mkdir()))
+        ImageBuildWorkflowData().save(context_dir)
+
+        saved_data = json.loads(context_dir.workflow_json.read_bytes())
+        saved_data["plugins_errors"] = "wrong value"
         context_dir.workflow_json.write_text(json.dumps(saved_data), encoding="utf-8")
 
         with pytest.raises(osbs.exceptions.OsbsValidationException):
             ImageBuildWorkflowData.load_from_dir(context_dir)
 
-    def test_save_and_load(self, tmpdir):
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_save_and_load(self, tmpdir, monkeypatch, use_orjson):
         """Test save workflow data and then load them back properly."""
+        if use_orjson:
+            pytest.importorskip("orjson")
+        else:
+            monkeypatch.setattr(inner, "orjson", None)
+
         tag_conf = TagConf()
         tag_conf.add_floating_image(ImageName.parse("registry/image:latest"))
         tag_conf.add_primary_image(ImageName.parse("registry/image:1.0"))
@@ -1357,6 +1456,9 @@ class TestWorkflowData:
 
         # Verify the saved data matches the schema
         saved_data = json.loads(context_dir.workflow_json.read_bytes())
+        for name in WORKFLOW_DATA_SECTIONS:
+            assert name not in saved_data
+            saved_data.update(json.loads(context_dir.get_workflow_data_file(name).read_bytes()))
         try:
             validate_with_schema(saved_data, "schemas/workflow_data.json")
         except osbs.exceptions.OsbsValidationException as e:
@@ -1370,3 +1472,107 @@ class TestWorkflowData:
         assert wf_data.buildstep_result == loaded_wf_data.buildstep_result
         assert wf_data.postbuild_results == loaded_wf_data.postbuild_results
         assert wf_data.prebuild_results == loaded_wf_data.prebuild_results
+
+    def test_load_sections_lazily(self, tmpdir):
+        """Test sections are loaded on first access and saved only when changed."""
+        wf_data = ImageBuildWorkflowData(
+            prebuild_results={"plugin_a": "result"},
+            postbuild_results={"plugin_b": "result"},
+        )
+        wf_data.tag_conf.add_floating_image(ImageName.parse("registry/image:latest"))
+        context_dir = ContextDir(Path(tmpdir.join("context_dir").mkdir()))
+        wf_data.save(context_dir)
+
+        # Mark the saved sections as old to find out which were written again
+        for name in WORKFLOW_DATA_SECTIONS:
+            os.utime(context_dir.get_workflow_data_file(name), ns=(0, 0))
+
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        for name in WORKFLOW_DATA_SECTIONS:
+            assert name not in vars(loaded_wf_data)
+
+        assert loaded_wf_data.tag_conf == wf_data.tag_conf
+        assert loaded_wf_data.postbuild_results == {"plugin_b": "result"}
+        loaded_wf_data.prebuild_results["plugin_c"] = "result"
+        loaded_wf_data.save(context_dir)
+
+        rewritten = {
+            name for name in WORKFLOW_DATA_SECTIONS
+            if context_dir.get_workflow_data_file(name).stat().st_mtime_ns != 0
+        }
+        # tag_conf and postbuild_results were loaded, but have not changed
+        assert rewritten == {"prebuild_results"}
+
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        assert loaded_wf_data.prebuild_results == {"plugin_a": "result", "plugin_c": "result"}
+        assert loaded_wf_data.postbuild_results == {"plugin_b": "result"}
+
+    def test_save_unloaded_sections_into_another_directory(self, tmpdir):
+        wf_data = ImageBuildWorkflowData(prebuild_results={"plugin_a": "result"})
+        context_dir = ContextDir(Path(tmpdir.join("context_dir").mkdir()))
+        wf_data.save(context_dir)
+
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        other_context_dir = ContextDir(Path(tmpdir.join("other_context_dir").mkdir()))
+        loaded_wf_data.save(other_context_dir)
+
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(other_context_dir)
+        assert loaded_wf_data.prebuild_results == {"plugin_a": "result"}
+
+    def test_load_sections_from_workflow_json(self, tmpdir):
+        """Test loading data saved with all the sections in workflow.json"""
+        wf_data = ImageBuildWorkflowData(prebuild_results={"plugin_a": "result"})
+        wf_data.tag_conf.add_floating_image(ImageName.parse("registry/image:latest"))
+        context_dir = ContextDir(Path(tmpdir.join("context_dir").mkdir()))
+        context_dir.workflow_json.write_text(json.dumps(wf_data.as_dict(), cls=WorkflowDataEncoder))
+
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        assert loaded_wf_data.prebuild_results == {"plugin_a": "result"}
+        assert loaded_wf_data.tag_conf == wf_data.tag_conf
+
+        loaded_wf_data.save(context_dir)
+        assert "prebuild_results" not in json.loads(context_dir.workflow_json.read_bytes())
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        assert loaded_wf_data.prebuild_results == {"plugin_a": "result"}
+
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_save_unusual_values(self, tmpdir, monkeypatch, use_orjson):
+        """Test values serialized differently by the JSON backends are saved like with json."""
+        if use_orjson:
+            pytest.importorskip("orjson")
+        else:
+            monkeypatch.setattr(inner, "orjson", None)
+
+        Digest = namedtuple("Digest", ["algorithm", "value"])
+        wf_data = ImageBuildWorkflowData(
+            prebuild_results={
+                "plugin_a": {1: Digest("sha256", "abc"), "text": "\u2603"},
+            },
+        )
+
+        context_dir = ContextDir(Path(tmpdir.join("context_dir").mkdir()))
+        wf_data.save(context_dir)
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+
+        assert loaded_wf_data.prebuild_results == {
+            "plugin_a": {"1": ["sha256", "abc"], "text": "\u2603"},
+        }
+
+    def test_save_and_load_blob_refs(self, tmpdir):
+        context_dir = ContextDir(Path(tmpdir.join("context_dir").mkdir()))
+        ref = BlobStore(context_dir.blobs_dir).put(b"big content")
+        wf_data = ImageBuildWorkflowData(
+            files={"big_file": ref}, postbuild_results={"plugin_a": {"logs": ref}},
+        )
+        wf_data.save(context_dir)
+
+        loaded_wf_data = ImageBuildWorkflowData.load_from_dir(context_dir)
+        assert loaded_wf_data.files == {"big_file": ref}
+        assert loaded_wf_data.postbuild_results == {"plugin_a": {"logs": ref}}
+
+    def test_save_unserializable_value(self, tmpdir):
+        wf_data = ImageBuildWorkflowData(prebuild_results={"plugin_a": object()})
+
+        context_dir = ContextDir(Path(tmpdir.join("context_dir").mkdir()))
+        with pytest.raises(TypeError):
+            wf_data.save(context_dir)
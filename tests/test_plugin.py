@@ -6,20 +6,29 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+import asyncio
+import os
+import threading
 import time
 import inspect
+from textwrap import dedent
 
 from flexmock import flexmock
 import pytest
 
-from atomic_reactor.inner import BuildResult
-from atomic_reactor.plugin import (BuildPluginsRunner, PreBuildPluginsRunner,
+from atomic_reactor import plugin as plugin_module
+from atomic_reactor.dirs import ContextDir
+from atomic_reactor.inner import BuildResult, ImageBuildWorkflowData
+from atomic_reactor.plugin import (BUILD_DIRS, SOURCE_FILES,
+                                   BuildPluginsRunner, PreBuildPluginsRunner,
                                    PostBuildPluginsRunner,
                                    PluginFailedException, PrePublishPluginsRunner,
                                    ExitPluginsRunner, BuildStepPluginsRunner,
                                    PluginsRunner, InappropriateBuildStepError,
                                    BuildPlugin, BuildStepPlugin, PreBuildPlugin, ExitPlugin,
-                                   PreBuildSleepPlugin, PrePublishPlugin, PostBuildPlugin)
+                                   PreBuildSleepPlugin, PrePublishPlugin, PostBuildPlugin,
+                                   Deadline, PluginTimeoutException,
+                                   get_plugin_index, get_plugin_keys)
 
 from tests.constants import DOCKERFILE_GIT
 
@@ -51,20 +60,73 @@ class MyPreBuildPlugin(PreBuildPlugin):
         raise InappropriateBuildStepError
 
 
-@pytest.mark.parametrize('runner_type', [  # noqa
-    PreBuildPluginsRunner,
-    PrePublishPluginsRunner,
-    PostBuildPluginsRunner,
-    ExitPluginsRunner,
-    BuildStepPluginsRunner,
+@pytest.mark.parametrize('runner_type, plugin_key', [  # noqa
+    (PreBuildPluginsRunner, 'add_help'),
+    (PrePublishPluginsRunner, 'squash'),
+    (PostBuildPluginsRunner, 'compress'),
+    (ExitPluginsRunner, 'store_metadata'),
+    (BuildStepPluginsRunner, 'orchestrate_build'),
 ])
-def test_load_plugins(runner_type, workflow):
+def test_load_plugins(runner_type, plugin_key, workflow):
     """
     test loading plugins
     """
-    runner = runner_type(workflow, None)
+    runner = runner_type(workflow, [{"name": plugin_key}])
     assert runner.plugin_classes is not None
-    assert len(runner.plugin_classes) > 0
+    assert plugin_key in runner.plugin_classes
+
+
+def test_load_plugins_only_requested(workflow):
+    loaded = []
+    load_plugin_module = plugin_module._load_plugin_module
+
+    def spy(path):
+        loaded.append(os.path.basename(path))
+        return load_plugin_module(path)
+
+    flexmock(plugin_module).should_receive('_load_plugin_module').replace_with(spy)
+    runner = PreBuildPluginsRunner(workflow, [{"name": "add_help"}])
+
+    assert loaded == ['pre_add_help.py']
+    assert list(runner.plugin_classes) == ['add_help']
+
+
+def test_get_plugin_keys(tmpdir):
+    module = tmpdir.join('pre_my_plugins.py')
+    module.write(dedent("""\
+        from atomic_reactor.constants import PLUGIN_KOJI_PARENT_KEY as KOJI_PARENT
+        from atomic_reactor.plugin import PreBuildPlugin
+
+        MY_KEY = 'my_key'
+
+        class LiteralPlugin(PreBuildPlugin):
+            key = 'literal'
+
+        class ConstantPlugin(PreBuildPlugin):
+            key = KOJI_PARENT
+
+        class ModuleConstantPlugin(PreBuildPlugin):
+            key = MY_KEY
+
+        class AliasPlugin(PreBuildPlugin):
+            key = LiteralPlugin.key
+        """))
+    assert get_plugin_keys(str(module)) == {'literal', 'koji_parent', 'my_key'}
+
+    module.write("class UnknownPlugin(object):\n    key = get_key()\n")
+    get_plugin_keys.cache_clear()
+    assert get_plugin_keys(str(module)) is None
+
+
+def test_get_plugin_index():
+    plugins_dir = os.path.join(os.path.dirname(plugin_module.__file__), 'plugins')
+    index = get_plugin_index(plugins_dir)
+
+    assert [os.path.basename(f) for f in index['koji_parent']] == ['pre_koji_parent.py']
+    assert [os.path.basename(f) for f in index['koji_import_source_container']] == [
+        'exit_koji_import.py'
+    ]
+    assert None not in index
 
 
 class X(object):
@@ -280,6 +342,391 @@ def test_which_buildstep_plugin_configured(workflow, pluginconf_method, expected
     assert runner.plugins_conf == expected
 
 
+def _make_prebuild_plugin(plugin_key, plugin_reads=None, plugin_writes=None, run=None):
+    class MyPlugin(PreBuildPlugin):
+        key = plugin_key
+        reads = plugin_reads
+        writes = plugin_writes
+
+        def run(self):
+            return run(self) if run else self.key
+
+    return MyPlugin
+
+
+@pytest.mark.parametrize(('accesses', 'expected'), [
+    # nothing declared, plugins are run one after another
+    ([(None, None), (None, None), (None, None)],
+     [set(), {0}, {0, 1}]),
+    # independent plugins
+    ([((), ()), ((), ('buildargs',)), (('dockerfile_images',), ())],
+     [set(), set(), set()]),
+    # undeclared plugin is a barrier, the plugins after it wait for the ones before it
+    ([((), ()), (None, None), ((), ())],
+     [set(), {0}, {1}]),
+    # read after write, write after read, write after write
+    ([((), ('buildargs',)), (('buildargs',), ()), ((), ('buildargs',))],
+     [set(), {0}, {0, 1}]),
+    # items of a field
+    ([((), ('plugin_workspace.a',)), (('plugin_workspace.b',), ()),
+      (('plugin_workspace',), ())],
+     [set(), set(), {0}]),
+    # results of other plugins
+    ([((), ()), (('prebuild_results.plugin0',), ()), (('prebuild_results.plugin5',), ())],
+     [set(), {0}, set()]),
+    # state shared outside the workflow data
+    ([((SOURCE_FILES,), ()), ((SOURCE_FILES,), (BUILD_DIRS,)), ((), (BUILD_DIRS,))],
+     [set(), set(), {1}]),
+])
+def test_plugin_dependencies(workflow, accesses, expected):
+    plugins = {}
+    for i, (reads, writes) in enumerate(accesses):
+        plugin_class = _make_prebuild_plugin('plugin{}'.format(i), reads, writes)
+        plugins[plugin_class.key] = plugin_class
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": key} for key in plugins])
+    assert runner.get_plugin_dependencies() == expected
+
+
+def test_run_plugins_concurrently(workflow):
+    started = threading.Event()
+    order = []
+
+    def waiting_run(plugin):
+        # only finishes if the other independent plugin runs at the same time
+        assert started.wait(5)
+        order.append(plugin.key)
+        return plugin.key
+
+    def signaling_run(plugin):
+        order.append(plugin.key)
+        started.set()
+        return plugin.key
+
+    def dependent_run(plugin):
+        order.append(plugin.key)
+        return plugin.workflow.data.prebuild_results['waiting'] + '-done'
+
+    plugins = {
+        'waiting': _make_prebuild_plugin('waiting', (), (), waiting_run),
+        'signaling': _make_prebuild_plugin('signaling', (), (), signaling_run),
+        'dependent': _make_prebuild_plugin('dependent', ('prebuild_results.waiting',), (),
+                                           dependent_run),
+        'barrier': _make_prebuild_plugin('barrier', run=lambda plugin: order.append('barrier')),
+    }
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": key} for key in plugins], max_workers=2)
+    results = runner.run()
+
+    assert order == ['signaling', 'waiting', 'dependent', 'barrier']
+    assert results['waiting'] == 'waiting'
+    assert results['dependent'] == 'waiting-done'
+    assert set(workflow.data.plugins_durations) == set(plugins)
+    assert set(workflow.data.plugins_resources) == set(plugins)
+
+
+@pytest.mark.parametrize('keep_going', [True, False])
+def test_run_plugins_concurrently_failure(workflow, keep_going):
+    def failing_run(plugin):
+        raise RuntimeError('failure')
+
+    plugins = {
+        'failing': _make_prebuild_plugin('failing', (), (), failing_run),
+        'independent': _make_prebuild_plugin('independent', (), ()),
+        'barrier': _make_prebuild_plugin('barrier'),
+    }
+    plugins['failing'].is_allowed_to_fail = False
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": key} for key in plugins], max_workers=4)
+    with pytest.raises(PluginFailedException, match="plugin 'failing' raised an exception"):
+        runner.run(keep_going=keep_going)
+
+    assert workflow.data.plugin_failed
+    assert 'failing' in workflow.data.plugins_errors
+    assert workflow.data.prebuild_results['independent'] == 'independent'
+    # no more plugins are started after a fatal failure
+    assert ('barrier' in workflow.data.prebuild_results) == keep_going
+
+
+@pytest.mark.parametrize(('config', 'user_config', 'expected'), [
+    (None, None, set()),
+    ({'plugins': ['profiled']}, None,
+     {'profiled.pstats'}),
+    ({'plugins': ['*'], 'tracemalloc': True}, None,
+     {'profiled.pstats', 'profiled.tracemalloc.txt', 'other.pstats', 'other.tracemalloc.txt'}),
+    ({'plugins': ['profiled']}, {'plugins': ['other'], 'cprofile': False, 'tracemalloc': True},
+     {'other.tracemalloc.txt'}),
+])
+def test_profile_plugins(workflow, tmp_path, config, user_config, expected):
+    plugins = {
+        'profiled': _make_prebuild_plugin('profiled'),
+        'other': _make_prebuild_plugin('other'),
+    }
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+    workflow.context_dir = ContextDir(tmp_path / 'context')
+    workflow.conf.conf = {'version': 1, 'plugin_runner': {'profile': config or {}}}
+    if user_config:
+        workflow.user_params['profile_plugins'] = user_config
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": key} for key in plugins])
+    results = runner.run()
+
+    assert results == {'profiled': 'profiled', 'other': 'other'}
+    profiles_dir = workflow.context_dir.profiles_dir
+    profiles = set(os.listdir(profiles_dir)) if profiles_dir.exists() else set()
+    assert profiles == expected
+
+
+@pytest.mark.parametrize('resume', [True, False])
+def test_resume_plugins(workflow, tmp_path, resume):
+    calls = []
+
+    def resumable_run(plugin):
+        calls.append(plugin.key)
+        plugin.workflow.data.buildargs['REPO'] = 'repo-' + plugin.workflow.user_params['git_ref']
+        return {'compose': 1}
+
+    def other_run(plugin):
+        calls.append(plugin.key)
+        return plugin.key
+
+    plugins = {
+        'resumable': _make_prebuild_plugin('resumable', (SOURCE_FILES,),
+                                           ('buildargs', BUILD_DIRS), resumable_run),
+        'other': _make_prebuild_plugin('other', run=other_run),
+    }
+    plugins['resumable'].resumable = True
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+    workflow.context_dir = ContextDir(tmp_path / 'context')
+    workflow.conf.conf = {'version': 1, 'plugin_runner': {'resume': resume}}
+    workflow.user_params['git_ref'] = 'abc'
+    plugins_conf = [{"name": key} for key in plugins]
+
+    PreBuildPluginsRunner(workflow, plugins_conf).run()
+    assert calls == ['resumable', 'other']
+
+    # the task is retried
+    workflow.data = ImageBuildWorkflowData()
+    results = PreBuildPluginsRunner(workflow, plugins_conf).run()
+
+    if resume:
+        assert calls == ['resumable', 'other', 'other']
+    else:
+        assert calls == ['resumable', 'other', 'resumable', 'other']
+    assert results == {'resumable': {'compose': 1}, 'other': 'other'}
+    assert workflow.data.buildargs == {'REPO': 'repo-abc'}
+
+    # the inputs changed
+    workflow.data = ImageBuildWorkflowData()
+    workflow.user_params['git_ref'] = 'def'
+    PreBuildPluginsRunner(workflow, plugins_conf).run()
+
+    assert calls[-2:] == ['resumable', 'other']
+    assert workflow.data.buildargs == {'REPO': 'repo-def'}
+
+
+def test_resume_plugins_merges_dicts(workflow, tmp_path):
+    calls = []
+
+    def earlier_run(plugin):
+        calls.append(plugin.key)
+        plugin.workflow.data.buildargs['ATTEMPT'] = str(calls.count(plugin.key))
+        plugin.workflow.data.buildargs['REMOVED'] = 'x'
+
+    def resumable_run(plugin):
+        calls.append(plugin.key)
+        plugin.workflow.data.buildargs['REPO'] = 'repo'
+        del plugin.workflow.data.buildargs['REMOVED']
+
+    plugins = {
+        'earlier': _make_prebuild_plugin('earlier', run=earlier_run),
+        'resumable': _make_prebuild_plugin('resumable', (), ('buildargs',), resumable_run),
+    }
+    plugins['resumable'].resumable = True
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+    workflow.context_dir = ContextDir(tmp_path / 'context')
+    workflow.conf.conf = {'version': 1, 'plugin_runner': {'resume': True}}
+    plugins_conf = [{"name": key} for key in plugins]
+
+    PreBuildPluginsRunner(workflow, plugins_conf).run()
+    assert workflow.data.buildargs == {'ATTEMPT': '1', 'REPO': 'repo'}
+
+    # the task is retried, the buildargs set by the earlier plugin are kept
+    workflow.data = ImageBuildWorkflowData()
+    PreBuildPluginsRunner(workflow, plugins_conf).run()
+
+    assert calls == ['earlier', 'resumable', 'earlier']
+    assert workflow.data.buildargs == {'ATTEMPT': '2', 'REPO': 'repo'}
+
+
+def test_deadline():
+    assert Deadline().remaining is None
+    assert not Deadline().expired
+    Deadline().check()
+
+    deadline = Deadline(60)
+    assert 59 < deadline.remaining <= 60
+    assert Deadline(120, parent=deadline).remaining <= 60
+    assert Deadline(parent=deadline).remaining <= 60
+    assert Deadline(1, parent=deadline).remaining <= 1
+
+    expired = Deadline(0, description='task time budget')
+    assert expired.expired
+    with pytest.raises(PluginTimeoutException, match='task time budget of 0s exceeded'):
+        Deadline(60, parent=expired).check()
+
+    start = time.monotonic()
+    with pytest.raises(PluginTimeoutException, match='timeout of 0.05s exceeded'):
+        Deadline(0.05).sleep(10)
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.parametrize('cooperative', [True, False])
+def test_plugin_timeout(workflow, monkeypatch, cooperative):
+    release = threading.Event()
+
+    def polling_run(plugin):
+        while True:
+            plugin.deadline.sleep(0.01)
+
+    def stuck_run(plugin):
+        release.wait(10)
+
+    plugins = {
+        'slow': _make_prebuild_plugin('slow', run=polling_run if cooperative else stuck_run),
+        'fast': _make_prebuild_plugin('fast'),
+    }
+    plugins['slow'].is_allowed_to_fail = False
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+    monkeypatch.setattr(PluginsRunner, 'timeout_grace_period', 0)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": "slow", "timeout": 0.1},
+                                              {"name": "fast", "timeout": 5}])
+    try:
+        with pytest.raises(PluginFailedException, match='timeout of 0.1s exceeded'):
+            runner.run()
+    finally:
+        release.set()
+
+    assert workflow.data.plugins_errors['slow'] == 'timeout of 0.1s exceeded'
+    assert 'fast' not in workflow.data.prebuild_results
+
+
+def test_task_time_budget(workflow):
+    plugins = {
+        'first': _make_prebuild_plugin('first'),
+        'second': _make_prebuild_plugin('second'),
+    }
+    plugins['second'].is_allowed_to_fail = False
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": key} for key in plugins],
+                                   deadline=Deadline(0, description='task time budget'))
+    with pytest.raises(PluginFailedException, match='task time budget of 0s exceeded'):
+        runner.run()
+
+    assert isinstance(workflow.data.prebuild_results['first'], PluginTimeoutException)
+    assert 'second' in workflow.data.plugins_errors
+
+
+def test_plugin_timeouts(workflow):
+    plugins = {
+        'configured': _make_prebuild_plugin('configured'),
+        'default': _make_prebuild_plugin('default'),
+        'unlimited': _make_prebuild_plugin('unlimited'),
+    }
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow,
+                                   [{"name": "configured", "timeout": 10},
+                                    {"name": "default"},
+                                    {"name": "unlimited"}],
+                                   plugin_timeouts={'configured': 20, 'default': 30})
+
+    assert [plugin.timeout for plugin in runner.available_plugins] == [10, 30, None]
+
+
+def _make_async_prebuild_plugin(plugin_key, plugin_reads=None, plugin_writes=None, run=None):
+    class MyAsyncPlugin(PreBuildPlugin):
+        key = plugin_key
+        reads = plugin_reads
+        writes = plugin_writes
+
+        async def run(self):
+            return await run(self)
+
+    return MyAsyncPlugin
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_run_async_plugins(workflow, max_workers):
+    loops = []
+
+    def fetch(item):
+        time.sleep(0.05)
+        return item * 2
+
+    async def fetching_run(plugin):
+        loops.append(asyncio.get_running_loop())
+        return await asyncio.gather(*(plugin.run_blocking(fetch, i) for i in range(10)))
+
+    plugins = {
+        'first': _make_async_prebuild_plugin('first', (), (), fetching_run),
+        'sync': _make_prebuild_plugin('sync'),
+        'second': _make_async_prebuild_plugin('second', (), (), fetching_run),
+    }
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": key} for key in plugins],
+                                   max_workers=max_workers)
+    results = runner.run()
+
+    expected = [i * 2 for i in range(10)]
+    assert results == {'first': expected, 'sync': 'sync', 'second': expected}
+    # both plugins were run on the same event loop, closed after the run
+    assert len(loops) == 2
+    assert loops[0] is loops[1]
+    assert loops[0].is_closed()
+
+
+def test_async_plugin_failure(workflow):
+    async def failing_run(plugin):
+        await asyncio.sleep(0)
+        raise RuntimeError('async failure')
+
+    plugins = {'failing': _make_async_prebuild_plugin('failing', run=failing_run)}
+    plugins['failing'].is_allowed_to_fail = False
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": "failing"}])
+    with pytest.raises(PluginFailedException, match='async failure'):
+        runner.run()
+    assert workflow.data.plugins_errors['failing'] == 'async failure'
+
+
+def test_async_plugin_timeout(workflow):
+    cancelled = []
+
+    async def hanging_run(plugin):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(plugin.key)
+            raise
+
+    plugins = {'hanging': _make_async_prebuild_plugin('hanging', run=hanging_run)}
+    plugins['hanging'].is_allowed_to_fail = False
+    flexmock(PluginsRunner, load_plugins=lambda x: plugins)
+
+    runner = PreBuildPluginsRunner(workflow, [{"name": "hanging", "timeout": 0.1}])
+    with pytest.raises(PluginFailedException, match='timeout of 0.1s exceeded'):
+        runner.run()
+    assert cancelled == ['hanging']
+
+
 class TestBuildPluginsRunner(object):
 
     @pytest.mark.parametrize(('params'), [
@@ -6,12 +6,16 @@ This software may be modified and distributed under the terms
 of the BSD license. See the LICENSE file for details.
 """
 
+import gzip
+import hashlib
 import io
 import json
 import logging
 import os
 import tempfile
 import tarfile
+import time
+import zipfile
 from typing import List
 
 import pytest
@@ -35,15 +39,17 @@ from atomic_reactor.constants import (IMAGE_TYPE_DOCKER_ARCHIVE, IMAGE_TYPE_OCI,
                                       MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST,
                                       DOCKERIGNORE, RELATIVE_REPOS_PATH)
 from atomic_reactor.inner import BuildResult
+from atomic_reactor.utils.registry_cache import (DEFAULT_TAG_TTL, RegistryCache,
+                                                 manifest_revalidation_cache)
 from atomic_reactor.util import (LazyGit, figure_out_build_file,
                                  render_yum_repo, process_substitutions,
-                                 get_checksums, print_version_of_tools,
+                                 get_checksums, HashingWriter, print_version_of_tools,
                                  get_version_of_tools,
                                  human_size, CommandResult,
                                  registry_hostname, Dockercfg, RegistrySession,
                                  get_manifest_digests, ManifestDigest,
                                  get_manifest_list, get_all_manifests,
-                                 get_inspect_for_image, get_manifest,
+                                 get_inspect_for_image, get_manifest, map_images_concurrently,
                                  is_scratch_build, is_isolated_build, is_flatpak_build,
                                  df_parser, base_image_is_custom,
                                  are_plugins_in_order, LabelFormatter,
@@ -56,7 +62,7 @@ from atomic_reactor.util import (LazyGit, figure_out_build_file,
                                  get_unique_images,
                                  get_image_upload_filename,
                                  read_yaml, read_yaml_from_file_path, read_yaml_from_url,
-                                 validate_with_schema,
+                                 validate_with_schema, get_schema_validator,
                                  OSBSLogs,
                                  get_orchestrator_platforms,
                                  dump_stacktraces, setup_introspection_signal_handler,
@@ -69,7 +75,7 @@ from atomic_reactor.util import (LazyGit, figure_out_build_file,
                                  )
 from tests.constants import MOCK, REACTOR_CONFIG_MAP
 import atomic_reactor.util
-from atomic_reactor.constants import INSPECT_CONFIG
+from atomic_reactor.constants import INSPECT_CONFIG, REGISTRY_POOL_MAXSIZE
 from osbs.utils import ImageName
 from osbs.exceptions import OsbsValidationException
 from tests.mock_env import MockEnv
@@ -238,6 +244,72 @@ def test_get_hexdigests(tmpdir, content, algorithms, expected, write_to_file, sh
         assert checksums == expected
 
 
+@pytest.mark.parametrize('size', [0, 10, 3 * 1024 * 1024 + 5])
+def test_get_checksums_single_pass(tmp_path, monkeypatch, size):
+    content = os.urandom(size)
+    path = tmp_path / 'file'
+    path.write_bytes(content)
+    algorithms = ['md5', 'sha1', 'sha256', 'sha512', 'sha3_256']
+
+    reads = []
+    real_open = open
+
+    def counting_open(*args, **kwargs):
+        f = real_open(*args, **kwargs)
+        reads.append(args[0])
+        return f
+
+    monkeypatch.setattr(atomic_reactor.util, 'open', counting_open, raising=False)
+    checksums = get_checksums(str(path), algorithms)
+
+    assert checksums == {'{}sum'.format(algo): hashlib.new(algo, content).hexdigest()
+                         for algo in algorithms}
+    assert reads == [str(path)]
+
+    # the checksums are remembered while the file is not modified
+    assert get_checksums(str(path), ['sha256', 'md5']) == {
+        'sha256sum': checksums['sha256sum'], 'md5sum': checksums['md5sum']}
+    assert reads == [str(path)]
+
+    path.write_bytes(content + b'x')
+    assert get_checksums(str(path), ['md5']) == {
+        'md5sum': hashlib.md5(content + b'x').hexdigest()}
+    assert reads == [str(path), str(path)]
+
+
+@pytest.mark.parametrize('archive', ['gzip', 'zip'])
+def test_hashing_writer(tmp_path, monkeypatch, archive):
+    content = os.urandom(3 * 1024 ** 2)
+    path = tmp_path / 'archive'
+
+    with open(path, 'wb') as f:
+        writer = HashingWriter(f)
+        if archive == 'gzip':
+            with gzip.GzipFile(fileobj=writer, mode='wb') as gz:
+                gz.write(content)
+        else:
+            with zipfile.ZipFile(writer, 'w') as zf:
+                zf.writestr('content', content, zipfile.ZIP_DEFLATED)
+    writer.remember(str(path))
+
+    written = path.read_bytes()
+    assert writer.size == len(written)
+    assert writer.checksums == {'md5sum': hashlib.md5(written).hexdigest(),
+                                'sha256sum': hashlib.sha256(written).hexdigest()}
+    if archive == 'gzip':
+        assert gzip.decompress(written) == content
+    else:
+        with zipfile.ZipFile(path) as zf:
+            assert zf.read('content') == content
+
+    # get_checksums does not read the file again
+    def fail_open(*args, **kwargs):
+        raise AssertionError('file read again')
+
+    monkeypatch.setattr(atomic_reactor.util, 'open', fail_open, raising=False)
+    assert get_checksums(str(path), ['md5', 'sha256']) == writer.checksums
+
+
 @pytest.mark.parametrize('path, image_type, expected', [
     ('foo.tar', IMAGE_TYPE_DOCKER_ARCHIVE, 'docker-image-XXX.x86_64.tar'),
     ('foo.tar.gz', IMAGE_TYPE_DOCKER_ARCHIVE, 'docker-image-XXX.x86_64.tar.gz'),
@@ -496,11 +568,76 @@ def test_registry_create_from_config(workflow, registry, reactor_config, matched
      .with_args(matched_registry['uri'],
                 insecure=matched_registry['insecure'],
                 dockercfg_path=matched_registry['dockercfg_path'],
-                access=access))
+                access=access,
+                pool_maxsize=REGISTRY_POOL_MAXSIZE))
 
     RegistrySession.create_from_config(workflow.conf, registry, access)
 
 
+def test_registry_session_shares_connections(tmp_path):
+    dockercfg = {'registry.example.com': {'username': 'user', 'password': 'pass'}}
+    (tmp_path / '.dockercfg').write_text(json.dumps(dockercfg))
+
+    session = RegistrySession('registry.example.com')
+    assert RegistrySession('registry.example.com', access=('pull', 'push')).session is \
+        session.session
+    assert RegistrySession('registry.example.com', insecure=True).session is not session.session
+    assert RegistrySession('other.example.com').session is not session.session
+    # sessions using other credentials do not share cookies
+    assert RegistrySession('registry.example.com',
+                           dockercfg_path=str(tmp_path)).session is not session.session
+
+
+@responses.activate
+def test_registry_session_revalidates_manifests_by_tag():
+    manifest = b'{"schemaVersion": 2}'
+    digest = 'sha256:' + hashlib.sha256(manifest).hexdigest()
+    requested = []
+    evict = []
+
+    def manifest_cb(request):
+        requested.append(request.headers.get('If-None-Match'))
+        if request.headers.get('If-None-Match') == '"{}"'.format(digest):
+            if evict:
+                evict.pop()
+                manifest_revalidation_cache.clear()
+            return 304, {'ETag': '"{}"'.format(digest)}, ''
+        return 200, {'Docker-Content-Digest': digest, 'Content-Type': MEDIA_TYPE_DOCKER_V2_SCHEMA2,
+                     'Content-Length': str(len(manifest))}, manifest
+
+    for ref in ('latest', digest):
+        responses.add_callback(responses.GET,
+                               'https://registry.example.com/v2/ns/repo/manifests/' + ref,
+                               callback=manifest_cb)
+
+    session = RegistrySession('registry.example.com')
+    headers = {'Accept': MEDIA_TYPE_DOCKER_V2_SCHEMA2}
+    for _ in range(2):
+        response = session.get('/v2/ns/repo/manifests/latest', headers=headers)
+        assert response.status_code == 200
+        assert response.content == manifest
+        assert response.headers['Docker-Content-Digest'] == digest
+        assert response.headers['Content-Length'] == str(len(manifest))
+    assert requested == [None, '"{}"'.format(digest)]
+
+    # the cached response was evicted while the request was sent, it is fetched again
+    evict.append(True)
+    response = session.get('/v2/ns/repo/manifests/latest', headers=headers)
+    assert response.status_code == 200
+    assert response.content == manifest
+    assert requested[-2:] == ['"{}"'.format(digest), None]
+
+    # responses depend on the Accept header
+    session.get('/v2/ns/repo/manifests/latest',
+                headers={'Accept': MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST})
+    assert requested[-1] is None
+
+    # manifests by digest do not change
+    session.get('/v2/ns/repo/manifests/' + digest, headers=headers)
+    session.get('/v2/ns/repo/manifests/' + digest, headers=headers)
+    assert requested[-2:] == [None, None]
+
+
 @pytest.mark.parametrize('registry, reactor_config, error', [
     # Registry not specified, no registries in config
     (None,
@@ -872,6 +1009,98 @@ def test_get_manifest_digests_connection_error(tmpdir):
         get_manifest_digests(**kwargs)
 
 
+@pytest.mark.parametrize('stored_version', ['v1', 'v2', 'v2_list', 'oci', 'oci_index'])
+@responses.activate
+def test_get_manifest_digests_single_request(stored_version):
+    image = ImageName.parse('example.com/spam:latest')
+    url = 'https://example.com/v2/spam/manifests/latest'
+    stored_media_type = get_manifest_media_type(stored_version)
+
+    def request_callback(request):
+        accepted = request.headers['Accept'].split(', ')
+        assert accepted == [get_manifest_media_type(version)
+                            for version in ManifestDigest.content_type]
+        return (200, {'Content-Type': stored_media_type,
+                      'Docker-Content-Digest': 'stored-digest'}, '')
+
+    responses.add_callback(responses.HEAD, url, callback=request_callback)
+
+    digests = get_manifest_digests(image, 'https://example.com', single_request=True)
+
+    assert digests == ManifestDigest({stored_version: 'stored-digest'})
+    assert digests.default == 'stored-digest'
+    assert len(responses.calls) == 1
+
+
+@pytest.mark.parametrize('head_status,head_headers', [
+    # HEAD not supported
+    (405, {}),
+    # combined Accept header not supported
+    (406, {}),
+    # no digest
+    (200, {'Content-Type': MEDIA_TYPE_DOCKER_V2_SCHEMA2}),
+    # unexpected media type
+    (200, {'Content-Type': 'text/html', 'Docker-Content-Digest': 'digest'}),
+])
+@responses.activate
+def test_get_manifest_digests_single_request_fallback(head_status, head_headers):
+    image = ImageName.parse('example.com/spam:latest')
+    url = 'https://example.com/v2/spam/manifests/latest'
+
+    def get_callback(request):
+        media_type = request.headers['Accept']
+        if media_type != MEDIA_TYPE_DOCKER_V2_SCHEMA2:
+            return (404, {}, '')
+        return (200, {'Content-Type': media_type, 'Docker-Content-Digest': 'v2-digest'}, '')
+
+    responses.add(responses.HEAD, url, status=head_status, headers=head_headers)
+    responses.add_callback(responses.GET, url, callback=get_callback)
+
+    digests = get_manifest_digests(image, 'https://example.com', versions=('v1', 'v2'),
+                                   single_request=True)
+
+    assert digests == ManifestDigest(v2='v2-digest')
+    assert [call.request.method for call in responses.calls] == ['HEAD', 'GET', 'GET']
+
+
+@responses.activate
+def test_get_manifest_digests_single_request_not_found():
+    image = ImageName.parse('example.com/spam:latest')
+    url = 'https://example.com/v2/spam/manifests/latest'
+    responses.add(responses.HEAD, url, status=404)
+
+    with pytest.raises(requests.HTTPError):
+        get_manifest_digests(image, 'https://example.com', single_request=True)
+    assert len(responses.calls) == 1
+
+
+@pytest.mark.parametrize('status,content_type,expected_versions', [
+    (200, MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST, ['v2_list']),
+    (200, MEDIA_TYPE_DOCKER_V2_SCHEMA2, ['v2']),
+    (404, None, []),
+    # falls back to a request for each version
+    (406, None, ['v1', 'v2']),
+])
+@responses.activate
+def test_get_all_manifests_single_request(status, content_type, expected_versions):
+    image = ImageName.parse('example.com/spam:latest')
+    url = 'https://example.com/v2/spam/manifests/latest'
+
+    def request_callback(request):
+        media_type = request.headers['Accept']
+        if ', ' in media_type:
+            return (status, {'Content-Type': content_type} if content_type else {}, '{}')
+        if media_type == MEDIA_TYPE_DOCKER_V2_MANIFEST_LIST:
+            return (404, {}, '')
+        return (200, {'Content-Type': media_type}, '{}')
+
+    responses.add_callback(responses.GET, url, callback=request_callback)
+
+    all_manifests = get_all_manifests(image, 'https://example.com', single_request=True)
+
+    assert sorted(all_manifests) == expected_versions
+
+
 @responses.activate
 @pytest.mark.parametrize('body', [
     requests.exceptions.ConnectTimeout,
@@ -1187,6 +1416,13 @@ def test_validate_with_schema(data, schema, valid):
             validate_with_schema(data, schema)
 
 
+def test_get_schema_validator():
+    validator = get_schema_validator("schemas/plugins.json")
+    assert get_schema_validator("schemas/plugins.json") is validator
+    assert validator.is_valid({"exit_plugins": [{"name": "store_metadata"}]})
+    assert not validator.is_valid({"exit_plugins": [{"name": None}]})
+
+
 LogEntry = namedtuple('LogEntry', ['platform', 'line'])
 
 
@@ -1807,6 +2043,82 @@ class TestRegistryClient(object):
         expected = "sha256:d84ad27a3055f11cf2d34e611b8d14aada444e1e71866ea6a076b773aeac3c93"
         assert client.get_manifest_list_digest(image) == expected
 
+    def test_get_inspect_for_images(self):
+        client = atomic_reactor.util.RegistryClient(RegistrySession('https://reg.test'))
+        fedora = ImageName.parse('reg.test/namespace/fedora:32')
+        ubi = ImageName.parse('reg.test/namespace/ubi:8')
+        error = RuntimeError('not found')
+
+        (flexmock(client)
+         .should_receive('get_inspect_for_image')
+         .with_args(fedora, arch='amd64')
+         .and_return(MOCK_INSPECT_DATA)
+         .once())
+        (flexmock(client)
+         .should_receive('get_inspect_for_image')
+         .with_args(ubi, arch='amd64')
+         .and_raise(error)
+         .once())
+
+        results = client.get_inspect_for_images([fedora, ubi, fedora], arch='amd64')
+        assert results == {fedora.to_str(): MOCK_INSPECT_DATA, ubi.to_str(): error}
+
+    def test_get_manifest_list_digests(self):
+        client = atomic_reactor.util.RegistryClient(RegistrySession('https://reg.test'))
+        images = [ImageName.parse(f'reg.test/namespace/image-{i}:1') for i in range(20)]
+
+        (flexmock(client)
+         .should_receive('get_manifest_list_digest')
+         .replace_with(lambda image: f'sha256:{image.repo}')
+         .times(len(images)))
+
+        results = client.get_manifest_list_digests(images, max_workers=4)
+        assert results == {image.to_str(): f'sha256:{image.repo}' for image in images}
+
+    @responses.activate
+    def test_get_inspect_for_image_cached(self, tmp_path):
+        config_blob = json.dumps(MOCK_INSPECT_DATA).encode('utf-8')
+        config_digest = 'sha256:{}'.format(hashlib.sha256(config_blob).hexdigest())
+        manifest = json.dumps({
+            'schemaVersion': 2,
+            'mediaType': MEDIA_TYPE_DOCKER_V2_SCHEMA2,
+            'config': {'digest': config_digest},
+        }).encode('utf-8')
+        manifest_headers = {
+            'Content-Type': MEDIA_TYPE_DOCKER_V2_SCHEMA2,
+            'Docker-Content-Digest': 'sha256:{}'.format(hashlib.sha256(manifest).hexdigest()),
+        }
+        manifest_url = 'https://reg.test/v2/namespace/fedora/manifests/32'
+        responses.add(responses.GET, manifest_url, headers=manifest_headers, body=manifest)
+        responses.add(responses.HEAD, manifest_url, headers=manifest_headers)
+        responses.add(responses.GET, f'https://reg.test/v2/namespace/fedora/blobs/{config_digest}',
+                      body=config_blob)
+
+        image = ImageName.parse('reg.test/namespace/fedora:32')
+        expected = {**MOCK_EXPECT_INSPECT, 'Id': config_digest}
+
+        def inspect():
+            # a new client and cache, as in another task of the pipeline
+            session = RegistrySession('https://reg.test')
+            client = atomic_reactor.util.RegistryClient(session, cache=RegistryCache(tmp_path))
+            return client.get_inspect_for_image(image)
+
+        assert inspect() == expected
+        assert [call.request.method for call in responses.calls] == ['GET', 'GET']
+
+        assert inspect() == expected
+        assert len(responses.calls) == 2
+
+        # once the tag expires, only the digest it points to is checked
+        expired = time.time() + DEFAULT_TAG_TTL + 1
+        flexmock(time).should_receive('time').and_return(expired)
+        assert inspect() == expected
+        assert [call.request.method for call in responses.calls] == ['GET', 'GET', 'HEAD']
+
+
+def test_map_images_concurrently_empty():
+    assert map_images_concurrently(lambda image: pytest.fail('should not be called'), []) == {}
+
 
 @pytest.mark.parametrize(('source_registry', 'organization'), [
     (None, None),
@@ -0,0 +1,129 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import hashlib
+import os
+
+import pytest
+
+from atomic_reactor.utils.artifact_cache import ArtifactCache
+
+CONTENT = b"artifact content"
+CHECKSUMS = {"sha256": hashlib.sha256(CONTENT).hexdigest()}
+URL = "https://example.com/artifact"
+
+
+def entry_path(cache_dir, url, checksum, algo="sha256"):
+    return cache_dir / algo / "{}-{}".format(checksum, hashlib.sha256(url.encode()).hexdigest())
+
+
+def test_put_and_get(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache")
+    downloaded = tmp_path / "downloaded"
+    downloaded.write_bytes(CONTENT)
+    dest = tmp_path / "dest"
+
+    assert not cache.get(URL, CHECKSUMS, dest)
+    cache.put(URL, downloaded, CHECKSUMS)
+
+    assert cache.get(URL, CHECKSUMS, dest)
+    assert dest.read_bytes() == CONTENT
+    assert entry_path(tmp_path / "cache", URL, CHECKSUMS["sha256"]).exists()
+    # existing files are replaced
+    assert cache.get(URL, CHECKSUMS, dest)
+    # entries are keyed by URL too
+    assert not cache.get("https://example.com/other", CHECKSUMS, tmp_path / "dest2")
+
+
+@pytest.mark.parametrize("checksums", [
+    {},
+    {"md5": hashlib.md5(CONTENT).hexdigest()},
+    {"sha1": hashlib.sha1(CONTENT).hexdigest(), "md5": hashlib.md5(CONTENT).hexdigest()},
+])
+def test_weak_checksums_not_cached(tmp_path, checksums):
+    cache = ArtifactCache(tmp_path / "cache")
+    downloaded = tmp_path / "downloaded"
+    downloaded.write_bytes(CONTENT)
+
+    cache.put(URL, downloaded, checksums)
+
+    assert not (tmp_path / "cache").exists()
+    assert not cache.get(URL, checksums, tmp_path / "dest")
+
+
+def test_keyed_by_preferred_checksum(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache")
+    downloaded = tmp_path / "downloaded"
+    downloaded.write_bytes(CONTENT)
+    checksums = dict(CHECKSUMS, sha512=hashlib.sha512(CONTENT).hexdigest(),
+                     md5=hashlib.md5(CONTENT).hexdigest())
+
+    cache.put(URL, downloaded, checksums)
+
+    assert os.listdir(tmp_path / "cache") == ["sha512"]
+    assert cache.get(URL, checksums, tmp_path / "dest")
+    assert not cache.get(URL, CHECKSUMS, tmp_path / "dest2")
+
+
+def test_entry_verified(tmp_path, caplog):
+    cache = ArtifactCache(tmp_path / "cache")
+    downloaded = tmp_path / "downloaded"
+    downloaded.write_bytes(CONTENT)
+    checksums = dict(CHECKSUMS, md5=hashlib.md5(CONTENT).hexdigest())
+    cache.put(URL, downloaded, checksums)
+
+    # a build expecting another md5 for the same sha256 does not get the entry
+    assert not cache.get(URL, dict(checksums, md5="0" * 32), tmp_path / "dest")
+    assert not (tmp_path / "dest").exists()
+    assert "does not match" in caplog.text
+    # and the entry is removed
+    assert not cache.get(URL, checksums, tmp_path / "dest")
+
+    # neither do entries modified in place
+    cache.put(URL, downloaded, checksums)
+    entry = entry_path(tmp_path / "cache", URL, CHECKSUMS["sha256"])
+    entry.chmod(0o644)
+    entry.write_bytes(b"tampered")
+    assert not cache.get(URL, checksums, tmp_path / "dest")
+    assert not entry.exists()
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_size=3 * (len(CONTENT) + 1))
+    entries = []
+    for i in range(3):
+        content = CONTENT + str(i).encode()
+        downloaded = tmp_path / "downloaded-{}".format(i)
+        downloaded.write_bytes(content)
+        checksums = {"sha256": hashlib.sha256(content).hexdigest()}
+        cache.put(URL, downloaded, checksums)
+        entry = entry_path(tmp_path / "cache", URL, checksums["sha256"])
+        # entries added by earlier builds
+        os.utime(entry, (1000 + i, 1000 + i))
+        entries.append(checksums)
+
+    # using an entry makes it the most recently used one
+    assert cache.get(URL, entries[0], tmp_path / "dest")
+    cache.max_size = 2 * (len(CONTENT) + 1)
+    cache.evict()
+
+    assert cache.get(URL, entries[0], tmp_path / "dest")
+    assert not cache.get(URL, entries[1], tmp_path / "dest")
+    assert cache.get(URL, entries[2], tmp_path / "dest")
+
+
+def test_not_writable(tmp_path, caplog):
+    (tmp_path / "cache").write_text("not a directory")
+    cache = ArtifactCache(tmp_path / "cache")
+    downloaded = tmp_path / "downloaded"
+    downloaded.write_bytes(CONTENT)
+
+    cache.put(URL, downloaded, CHECKSUMS)
+
+    assert "Failed to add" in caplog.text
+    assert not cache.get(URL, CHECKSUMS, tmp_path / "dest")
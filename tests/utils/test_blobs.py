@@ -0,0 +1,115 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import hashlib
+
+import pytest
+from flexmock import flexmock
+
+from atomic_reactor.utils import blobs
+from atomic_reactor.utils.blobs import BlobRef, BlobStore
+
+CONTENT = b"some content\n" * 1000
+DIGEST = f"sha256:{hashlib.sha256(CONTENT).hexdigest()}"
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_put_and_get(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    store = BlobStore(tmp_path / "blobs", compression=compression)
+
+    ref = store.put(CONTENT)
+
+    assert ref == BlobRef(DIGEST, len(CONTENT), compression)
+    assert ref in store
+    assert store.get(ref) == CONTENT
+    if compression:
+        assert store.get_path(ref).stat().st_size < len(CONTENT)
+    else:
+        assert store.get_path(ref).read_bytes() == CONTENT
+
+    out_path = tmp_path / "out"
+    store.copy_to(ref, out_path)
+    assert out_path.read_bytes() == CONTENT
+
+
+def test_put_deduplicates(tmp_path):
+    store = BlobStore(tmp_path)
+    ref = store.put(CONTENT)
+    blob_mtime = store.get_path(ref).stat().st_mtime_ns
+
+    # the stored blob is reused, even when requesting another compression
+    assert store.put(CONTENT, compression=None) == ref
+    content_file = tmp_path / "content"
+    content_file.write_bytes(CONTENT)
+    assert store.put_file(content_file) == ref
+
+    assert store.get_path(ref).stat().st_mtime_ns == blob_mtime
+    assert [path.name for path in (tmp_path / "sha256").iterdir()] == [f"{ref.digest[7:]}.gz"]
+
+
+def test_put_uncompressed(tmp_path):
+    store = BlobStore(tmp_path)
+    content_file = tmp_path / "content"
+    content_file.write_bytes(CONTENT)
+
+    # None asks for an uncompressed blob, not for the default of the store
+    ref = store.put(CONTENT, compression=None)
+    assert ref == BlobRef(DIGEST, len(CONTENT), None)
+    assert store.get_path(ref).read_bytes() == CONTENT
+    assert store.put_file(content_file, compression=None) == ref
+    assert store.put_json({"other": "content"}, compression=None).compression is None
+
+
+def test_put_file(tmp_path):
+    content_file = tmp_path / "content"
+    content_file.write_bytes(CONTENT)
+    store = BlobStore(tmp_path / "blobs")
+
+    ref = store.put_file(content_file)
+
+    assert ref == BlobRef(DIGEST, len(CONTENT), "gzip")
+    assert store.get(ref) == CONTENT
+    # no temporary files are left behind
+    assert [path.name for path in store.path.iterdir()] == ["sha256"]
+
+
+def test_put_and_get_json(tmp_path):
+    store = BlobStore(tmp_path)
+    data = {"rpms": [{"name": "bash", "version": "5.1"}]}
+    assert store.get_json(store.put_json(data)) == data
+
+
+def test_get_corrupted(tmp_path):
+    store = BlobStore(tmp_path, compression=None)
+    ref = store.put(CONTENT)
+    store.get_path(ref).write_bytes(b"other content")
+
+    with pytest.raises(ValueError, match="is corrupted"):
+        store.get(ref)
+
+
+def test_get_missing(tmp_path):
+    store = BlobStore(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        store.get(BlobRef(DIGEST, len(CONTENT), "gzip"))
+
+
+@pytest.mark.parametrize("compression", ["xz", "zstd"])
+def test_unsupported_compression(tmp_path, compression):
+    if compression == "zstd":
+        flexmock(blobs, zstandard=None)
+    with pytest.raises(ValueError):
+        BlobStore(tmp_path, compression=compression)
+
+
+def test_blob_ref_serialization():
+    ref = BlobRef(DIGEST, 123, "zstd")
+    assert ref.as_dict() == {"digest": DIGEST, "size": 123, "compression": "zstd"}
+    assert BlobRef.load(ref.as_dict()) == ref
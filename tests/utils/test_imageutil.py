@@ -129,6 +129,23 @@ class TestImageUtil:
         with pytest.raises(ValueError, match=r"ImageName\(.*\) is not inspectable"):
             image_util.get_inspect_for_image(custom_image)
 
+    def test_get_inspect_for_images(self, df_images):
+        """Test that get_inspect_for_images inspects each image once and collects errors."""
+        image_util = imageutil.ImageUtil(df_images, self.config)
+        image = ImageName.parse("registry.com/some-image:1")
+        custom_image = ImageName.parse("koji/image-build")
+
+        self.mock_get_registry_client(image, expect_arch="amd64")
+
+        results = image_util.get_inspect_for_images(
+            [image, image.to_str(), custom_image], platform="x86_64"
+        )
+        assert results.keys() == {image.to_str(), custom_image.to_str()}
+        assert results[image.to_str()] == self.inspect_data
+        assert isinstance(results[custom_image.to_str()], ValueError)
+        # the results are cached
+        assert image_util.get_inspect_for_image(image, "x86_64") == self.inspect_data
+
     @pytest.mark.parametrize("platform", [None, "x86_64"])
     def test_base_image_inspect(self, platform, df_images):
         """Test that base_image_inspect just calls get_inspect_for_image with the right args."""
@@ -161,7 +178,12 @@ class TestImageUtil:
             .once()
             .and_return(registry_session)
         )
-        flexmock(util.RegistryClient).should_receive("__init__").with_args(registry_session).once()
+        (
+            flexmock(util.RegistryClient)
+            .should_receive("__init__")
+            .with_args(registry_session, cache=None)
+            .once()
+        )
 
         image_util._get_registry_client("registry.com")
         # test caching (i.e. test that the create_from_config method is called only once)
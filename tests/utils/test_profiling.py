@@ -0,0 +1,58 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import pstats
+import tracemalloc
+
+import pytest
+
+from atomic_reactor.utils.profiling import get_profiling_options, profile_plugin
+
+
+@pytest.mark.parametrize(('config', 'user_config', 'expected'), [
+    (None, None, None),
+    ({'plugins': ['other']}, None, None),
+    ({'plugins': ['my_plugin']}, None,
+     {'cprofile': True, 'tracemalloc': False, 'tracemalloc_top': 50}),
+    ({'plugins': ['*'], 'tracemalloc': True, 'tracemalloc_top': 5}, None,
+     {'cprofile': True, 'tracemalloc': True, 'tracemalloc_top': 5}),
+    ({'plugins': ['my_plugin']}, {'cprofile': False}, None),
+    (None, {'plugins': ['my_plugin'], 'tracemalloc': True},
+     {'cprofile': True, 'tracemalloc': True, 'tracemalloc_top': 50}),
+    ({'plugins': ['my_plugin'], 'tracemalloc': True}, {'plugins': ['other']}, None),
+])
+def test_get_profiling_options(config, user_config, expected):
+    assert get_profiling_options('my_plugin', config, user_config) == expected
+
+
+def test_profile_plugin(tmp_path):
+    options = {'cprofile': True, 'tracemalloc': True, 'tracemalloc_top': 3}
+    output_dir = tmp_path / 'profiles'
+
+    with profile_plugin('my_plugin', output_dir, options):
+        data = [str(i) * 100 for i in range(1000)]
+    assert data
+
+    stats = pstats.Stats(str(output_dir / 'my_plugin.pstats'))
+    assert stats.total_calls > 0
+
+    allocations = (output_dir / 'my_plugin.tracemalloc.txt').read_text().splitlines()
+    assert allocations[0].startswith('Top 3 of ')
+    assert len(allocations) <= 4
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_plugin_failure(tmp_path):
+    options = {'cprofile': True, 'tracemalloc': False, 'tracemalloc_top': 50}
+
+    with pytest.raises(RuntimeError, match='plugin failed'):
+        with profile_plugin('my_plugin', tmp_path, options):
+            raise RuntimeError('plugin failed')
+
+    # the profile of a failed plugin is still written
+    assert (tmp_path / 'my_plugin.pstats').exists()
@@ -0,0 +1,141 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import hashlib
+import time
+
+import requests
+from flexmock import flexmock
+
+from atomic_reactor.utils.registry_cache import ConditionalRequestCache, RegistryCache
+
+REGISTRY = "registry.example.com"
+CONTENT = b'{"schemaVersion": 2}'
+DIGEST = f"sha256:{hashlib.sha256(CONTENT).hexdigest()}"
+MEDIA_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+
+
+def make_response(content=CONTENT, media_type=MEDIA_TYPE):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content
+    response.headers["Content-Type"] = media_type
+    return response
+
+
+def test_put_and_get(tmp_path):
+    cache = RegistryCache(tmp_path)
+    assert cache.get(REGISTRY, DIGEST) is None
+
+    cache.put(REGISTRY, make_response())
+
+    response = cache.get(REGISTRY, DIGEST)
+    assert response.content == CONTENT
+    assert response.json() == {"schemaVersion": 2}
+    assert response.headers["Content-Type"] == MEDIA_TYPE
+    assert response.headers["Docker-Content-Digest"] == DIGEST
+    # entries are keyed by registry
+    assert cache.get("other.example.com", DIGEST) is None
+
+
+def test_put_digest_mismatch(tmp_path):
+    cache = RegistryCache(tmp_path)
+    other_digest = "sha256:" + "0" * 64
+    cache.put(REGISTRY, make_response(), digest=other_digest)
+
+    assert cache.get(REGISTRY, DIGEST) is None
+    assert cache.get(REGISTRY, other_digest) is None
+
+
+def test_get_corrupted(tmp_path):
+    cache = RegistryCache(tmp_path)
+    cache.put(REGISTRY, make_response())
+    (tmp_path / REGISTRY / "sha256" / DIGEST[7:]).write_bytes(b"\nother content")
+
+    assert cache.get(REGISTRY, DIGEST) is None
+
+
+def test_shared_path(tmp_path):
+    shared_path = tmp_path / "shared"
+    RegistryCache(tmp_path / "build-1", shared_path).put(REGISTRY, make_response())
+
+    cache = RegistryCache(tmp_path / "build-2", shared_path)
+    assert cache.get(REGISTRY, DIGEST).content == CONTENT
+    # the entry is copied into the primary directory
+    assert (tmp_path / "build-2" / REGISTRY / "sha256" / DIGEST[7:]).exists()
+
+
+def test_shared_path_not_writable(tmp_path, caplog):
+    shared_path = tmp_path / "shared"
+    shared_path.write_text("not a directory")
+    cache = RegistryCache(tmp_path / "cache", shared_path)
+
+    cache.put(REGISTRY, make_response())
+
+    assert cache.get(REGISTRY, DIGEST).content == CONTENT
+    assert "Failed to write" in caplog.text
+
+
+def test_tags(tmp_path):
+    cache = RegistryCache(tmp_path, tag_ttl=60)
+    assert cache.get_tag_digest(REGISTRY, "ns/repo", "latest") is None
+
+    cache.put_tag(REGISTRY, "ns/repo", "latest", DIGEST)
+
+    assert cache.get_tag_digest(REGISTRY, "ns/repo", "latest") == DIGEST
+    assert cache.get_tag_digest(REGISTRY, "ns/repo", "1.0") is None
+    assert cache.get_tag_digest(REGISTRY, "ns/other", "latest") is None
+
+    expired = time.time() + 61
+    flexmock(time).should_receive("time").and_return(expired)
+    assert cache.get_tag_digest(REGISTRY, "ns/repo", "latest") is None
+    assert cache.get_tag_digest(REGISTRY, "ns/repo", "latest", include_expired=True) == DIGEST
+
+
+def test_tags_disabled(tmp_path):
+    cache = RegistryCache(tmp_path, tag_ttl=0)
+    cache.put_tag(REGISTRY, "ns/repo", "latest", DIGEST)
+
+    assert cache.get_tag_digest(REGISTRY, "ns/repo", "latest", include_expired=True) is None
+
+
+def test_conditional_request_cache():
+    cache = ConditionalRequestCache(max_entries=2)
+    assert cache.get_validator("a") is None
+    assert not cache.restore("a", '"etag"', requests.Response())
+
+    response = make_response()
+    response.headers["ETag"] = '"etag"'
+    cache.store("a", response)
+    # without ETag, the digest is the validator
+    response = make_response(b"b")
+    response.headers["Docker-Content-Digest"] = DIGEST
+    cache.store("b", response)
+    # responses without any validator are not cached
+    cache.store("c", make_response(b"c"))
+
+    assert cache.get_validator("a") == '"etag"'
+    assert cache.get_validator("b") == f'"{DIGEST}"'
+    assert cache.get_validator("c") is None
+
+    not_modified = requests.Response()
+    not_modified.status_code = 304
+    # the entry was replaced since the request was sent
+    assert not cache.restore("a", '"old"', not_modified)
+    assert not_modified.status_code == 304
+    assert cache.restore("a", '"etag"', not_modified)
+    assert not_modified.status_code == 200
+    assert not_modified.content == CONTENT
+    assert not_modified.headers["Content-Type"] == MEDIA_TYPE
+
+    # the least recently used entry is dropped
+    response = make_response(b"d")
+    response.headers["ETag"] = '"d"'
+    cache.store("d", response)
+    assert cache.get_validator("b") is None
+    assert cache.get_validator("a") == '"etag"'
@@ -0,0 +1,118 @@
+"""
+Copyright (c) 2022 Red Hat, Inc
+All rights reserved.
+
+This software may be modified and distributed under the terms
+of the BSD license. See the LICENSE file for details.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+import responses
+from flexmock import flexmock
+
+from atomic_reactor.utils import resources
+from atomic_reactor.utils.retries import get_retrying_requests_session
+
+
+@pytest.fixture
+def http_traffic(monkeypatch):
+    counter = resources.HTTPTrafficCounter()
+    monkeypatch.setattr(resources, 'http_traffic', counter)
+    return counter
+
+
+@responses.activate
+def test_record_http_traffic(http_traffic):
+    responses.add(responses.GET, 'https://example.com/get', body=b'x' * 10)
+    responses.add(responses.POST, 'https://example.com/post', body=b'')
+
+    session = get_retrying_requests_session()
+    session.get('https://example.com/get')
+    session.post('https://example.com/post', data=b'y' * 5)
+
+    assert http_traffic.get_counts() == (2, 15)
+
+
+def test_record_unknown_response(http_traffic):
+    resources.record_http_response(None)
+    resources.record_http_response(flexmock(request=flexmock(body=None), headers={}),
+                                   stream=True)
+    assert http_traffic.get_counts() == (2, 0)
+
+
+def test_get_resource_usage(tmp_path, http_traffic):
+    http_traffic.record(3, 7)
+
+    usage = resources.get_resource_usage(tmp_path)
+
+    assert usage['cpu_user_seconds'] >= 0
+    assert usage['cpu_system_seconds'] >= 0
+    assert usage['peak_rss_kb'] > 0
+    assert usage['http_requests'] == 1
+    assert usage['http_bytes'] == 10
+    assert usage['http_connections'] == 0
+    assert usage['disk_used_bytes'] >= 0
+
+
+def test_get_resource_usage_without_proc(tmp_path):
+    flexmock(resources).should_receive('_read_proc_io').and_return({})
+
+    usage = resources.get_resource_usage(tmp_path / 'missing')
+
+    assert 'io_read_bytes' not in usage
+    assert 'disk_used_bytes' not in usage
+
+
+def test_get_resource_usage_delta():
+    before = {'cpu_user_seconds': 1.25, 'http_requests': 2, 'io_read_bytes': 10}
+    after = {'cpu_user_seconds': 3.5004, 'http_requests': 5, 'disk_used_bytes': 20}
+
+    assert resources.get_resource_usage_delta(before, after) == {
+        'cpu_user_seconds': 2.25,
+        'http_requests': 3,
+    }
+
+
+def test_session_counts_requests(http_traffic):
+    flexmock(requests.Session).should_receive('request').and_return(None)
+
+    session = get_retrying_requests_session()
+    session.get('https://example.com')
+
+    assert http_traffic.get_counts() == (1, 0)
+
+
+def test_session_counts_connections(http_traffic):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        session = get_retrying_requests_session()
+        for _ in range(3):
+            session.get(url)
+        # the connection is reused
+        assert http_traffic.get_counts() == (3, 6)
+        assert http_traffic.get_connections() == 1
+
+        get_retrying_requests_session().get(url)
+        assert http_traffic.get_connections() == 2
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -73,6 +73,28 @@ def test_get_retrying_requests_session(times):
     assert https.max_retries.total == expected_total
 
 
+def test_get_retrying_requests_session_pool_maxsize():
+    session = retries.get_retrying_requests_session(pool_maxsize=32)
+    assert session.adapters['https://']._pool_maxsize == 32
+
+
+def test_get_shared_requests_session():
+    session = retries.get_shared_requests_session('registry.example.com', pool_maxsize=32)
+
+    assert retries.get_shared_requests_session('registry.example.com') is session
+    assert session.adapters['https://']._pool_maxsize == 32
+    assert retries.get_shared_requests_session('other.example.com') is not session
+
+    # sessions with retries disabled are separate
+    flexmock(retries).should_receive('_http_retries_disabled').and_return(True)
+    no_retries_session = retries.get_shared_requests_session('registry.example.com')
+    assert no_retries_session is not session
+    assert no_retries_session.adapters['https://'].max_retries.total == 0
+
+    retries.close_shared_requests_sessions()
+    assert retries.get_shared_requests_session('registry.example.com') is not no_retries_session
+
+
 @responses.activate
 @pytest.mark.parametrize('http_code', [399, 400, 401, 500, 599])
 def test_log_error_response(http_code, caplog):